@@ -21,11 +21,8 @@ class Feature_Extractor(nn.Module):
         return features
 
     def Iwantshapes(self, device=None):
-        if device is None:
-            device = next(self.model.parameters()).device
-        pseudo_input = torch.rand(1, self.input_shape[0], self.input_shape[1], self.input_shape[2]).to(device)
-        features = self.model(pseudo_input)
-        return [feat.size()[1:] for feat in features]
+        # computed from the strides, avoiding a dummy forward through the backbone
+        return self.model.output_shapes(self.input_shape)
 
 '''
 Convolutional Alignment Module
@@ -160,9 +157,17 @@ class CAM_transposed(nn.Module):
         x = self.fpn[-1](x)
         # Transpose B-C-H-W to B-W-C-H
         x = x.permute(0, 3, 1, 2).contiguous()
+        # Narrower inputs (width buckets) are zero-padded along the sequence axis
+        # to the width the deconvs were built for, and the attention is cropped back.
+        nW = x.size(1)
+        full_W = self.deconvs[0][0].in_channels
+        if nW < full_W:
+            x = F.pad(x, (0, 0, 0, 0, 0, full_W - nW))
  
         for i in range(0, len(self.deconvs)):
             x = self.deconvs[i](x)
+        if nW < full_W:
+            x = x[:, :, :, :nW].contiguous()
         return x
 '''
 Decoupled Text Decoder
@@ -3,6 +3,9 @@ import math
 import torch
 import torch.nn.functional as F
 
+def _pair(x):
+    return tuple(x) if isinstance(x, (tuple, list)) else (x, x)
+
 def conv1x1(in_planes, out_planes, stride=1):
     return nn.Conv2d(in_planes, out_planes, kernel_size=1, stride=stride, bias=False)
 
@@ -48,6 +51,7 @@ class ResNet(nn.Module):
     def __init__(self, block, layers, strides, compress_layer=True):
         super(ResNet, self).__init__()
         self.inplanes = 32
+        self.strides = strides
         self.conv1 = nn.Conv2d(1, 32, kernel_size=3, stride=strides[0], padding=1,
                                bias=False)
         self.bn1 = nn.BatchNorm2d(32)
@@ -95,6 +99,26 @@ class ResNet(nn.Module):
 
         return nn.Sequential(*layers)
 
+    def output_shapes(self, input_shape):
+        # analytic version of the shapes returned by forward, [C, H, W] per output feature
+        def _down(size, stride):
+            # 3x3 conv with padding 1 (and the 1x1 downsample) share this output size
+            return [(n - 1) // s + 1 for n, s in zip(size, _pair(stride))]
+        out_shapes = []
+        size = _down(input_shape[1:], self.strides[0])
+        tmp_shape = size
+        channels = [32, 64, 128, 256, 512]
+        for i in range(1, 6):
+            size = _down(size, self.strides[i])
+            if i == 5 and not self.compress_layer:
+                out_shapes.append(torch.Size([channels[i - 1]] + size))
+            elif size != tmp_shape:
+                tmp_shape = size
+                out_shapes.append(torch.Size([channels[i - 1]] + size))
+        if self.compress_layer:
+            out_shapes.append(torch.Size([256, size[0] - 2, size[1]]))
+        return out_shapes
+
     def forward(self, x, multiscale=False):
         out_features = []
         x = self.conv1(x)
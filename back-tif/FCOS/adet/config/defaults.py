@@ -11,6 +11,9 @@ _C.MODEL.RESNETS.DEFORM_INTERVAL = 1
 _C.INPUT.HFLIP_TRAIN = True
 _C.INPUT.CROP.CROP_INSTANCE = True
 _C.INPUT.IS_ROTATE = False
+# Bit-pack the SOLOv2 candidate masks as adet.structures.PackedMasks (1 bit per
+# pixel) for mask NMS. The returned pred_masks stay dense bool masks.
+_C.MODEL.PACKED_MASKS = False
 
 # ---------------------------------------------------------------------------- #
 # FCOS Head
@@ -239,6 +242,9 @@ _C.MODEL.CONDINST.MASK_HEAD.CHANNELS = 8
 _C.MODEL.CONDINST.MASK_HEAD.NUM_LAYERS = 3
 _C.MODEL.CONDINST.MASK_HEAD.USE_FP16 = False
 _C.MODEL.CONDINST.MASK_HEAD.DISABLE_REL_COORDS = False
+# if > 0, at inference the dynamic mask head runs on chunks of this many instances and
+# the relative coordinates are folded into the first layer instead of being materialized
+_C.MODEL.CONDINST.MASK_HEAD.INFERENCE_CHUNK_SIZE = 0
 
 _C.MODEL.CONDINST.MASK_BRANCH = CN()
 _C.MODEL.CONDINST.MASK_BRANCH.OUT_CHANNELS = 8
@@ -1,6 +1,6 @@
 from . import builtin  # ensure the builtin datasets are registered
-from .dataset_mapper import DatasetMapperWithBasis
+from .dataset_mapper import DatasetMapperWithBasis, PackedDatasetMapper
 from .fcpose_dataset_mapper import FCPoseDatasetMapper
 
 
-__all__ = ["DatasetMapperWithBasis"]
+__all__ = ["DatasetMapperWithBasis", "PackedDatasetMapper"]
@@ -15,6 +15,7 @@ from detectron2.data.detection_utils import SizeMismatchError
 from detectron2.structures import BoxMode
 
 from .augmentation import RandomCropWithInstance
+from .datasets.packed import PackedImages
 from .detection_utils import (annotations_to_instances, build_augmentation,
                               transform_instance_annotations)
 
@@ -22,7 +23,7 @@ from .detection_utils import (annotations_to_instances, build_augmentation,
 This file contains the default mapping that's applied to "dataset dicts".
 """
 
-__all__ = ["DatasetMapperWithBasis"]
+__all__ = ["DatasetMapperWithBasis", "PackedDatasetMapper"]
 
 logger = logging.getLogger(__name__)
 
@@ -93,6 +94,12 @@ class DatasetMapperWithBasis(DatasetMapper):
             self.use_instance_mask = False
             self.recompute_boxes = False
 
+    def copy_dataset_dict(self, dataset_dict):
+        return copy.deepcopy(dataset_dict)
+
+    def load_image(self, dataset_dict):
+        return utils.read_image(dataset_dict["file_name"], format=self.image_format)
+
     def __call__(self, dataset_dict):
         """
         Args:
@@ -110,12 +117,10 @@ class DatasetMapperWithBasis(DatasetMapper):
             if pp1 < 0.5:
                 augmentation = [self.augmentation[1]] + augmentation
 
-        dataset_dict = copy.deepcopy(dataset_dict)  # it will be modified by code below
+        dataset_dict = self.copy_dataset_dict(dataset_dict)  # it will be modified by code below
         # USER: Write your own image loading if it's not from a file
         try:
-            image = utils.read_image(
-                dataset_dict["file_name"], format=self.image_format
-            )
+            image = self.load_image(dataset_dict)
         except Exception as e:
             print(dataset_dict["file_name"])
             print(e)
@@ -235,3 +240,35 @@ class DatasetMapperWithBasis(DatasetMapper):
             basis_sem_gt = torch.as_tensor(basis_sem_gt.astype("long"))
             dataset_dict["basis_sem"] = basis_sem_gt
         return dataset_dict
+
+
+class PackedDatasetMapper(DatasetMapperWithBasis):
+    """
+    Reads images from a packed dataset (see adet/data/datasets/packed.py) instead of
+    decoding them from disk. The image is a zero-copy view into the memory-mapped shard
+    and the dataset dict is shallow-copied, since only the annotation dicts are modified.
+    """
+
+    def __init__(self, cfg, is_train=True):
+        super().__init__(cfg, is_train)
+        self._packed_images = {}
+
+    def copy_dataset_dict(self, dataset_dict):
+        dataset_dict = dict(dataset_dict)
+        if "annotations" in dataset_dict:
+            dataset_dict["annotations"] = [dict(anno) for anno in dataset_dict["annotations"]]
+        return dataset_dict
+
+    def load_image(self, dataset_dict):
+        packed_dir = dataset_dict["packed_dir"]
+        images = self._packed_images.get(packed_dir)
+        if images is None:
+            images = PackedImages(packed_dir)
+            if images.image_format != self.image_format:
+                raise ValueError(
+                    "Packed dataset {} uses format {}, but INPUT.FORMAT is {}".format(
+                        packed_dir, images.image_format, self.image_format
+                    )
+                )
+            self._packed_images[packed_dir] = images
+        return images[dataset_dict["packed_index"]]
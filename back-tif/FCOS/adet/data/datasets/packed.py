@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import pickle
+
+import numpy as np
+
+from detectron2.data import DatasetCatalog, MetadataCatalog
+from detectron2.data import detection_utils as utils
+from detectron2.data import transforms as T
+from detectron2.structures import BoxMode
+
+"""
+This file contains a packed dataset format: images are decoded and resized once,
+offline, and stored back to back in raw uint8 shards that are read with np.memmap.
+
+Layout of a packed directory:
+    meta.json         image format, resize parameters, number of images and shards
+    index.npy         one row per image: shard, offset, height, width, channels
+    shard_XXXXX.bin   raw HWC uint8 images
+    dataset.pkl       dataset dicts; boxes already in XYXY_ABS, in packed image coordinates
+"""
+
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["pack_dataset_dicts", "PackedImages", "load_packed_dataset", "register_packed_instances"]
+
+INDEX_DTYPE = np.dtype(
+    [("shard", np.int32), ("offset", np.int64), ("height", np.int32), ("width", np.int32),
+     ("channels", np.int32)]
+)
+
+
+def pack_dataset_dicts(
+    dataset_dicts, output_dir, min_size, max_size, image_format="BGR", shard_bytes=2 << 30
+):
+    """
+    Decode, resize and write a list of dataset dicts into a packed directory.
+
+    Images are resized with the same ResizeShortestEdge used for training, so that with
+    a single MIN_SIZE_TRAIN the training-time resize becomes the identity.
+    Segmentations and keypoints are dropped: the packed format targets box detection.
+
+    Args:
+        dataset_dicts (list[dict]): dicts in Detectron2 Dataset format.
+        output_dir (str): directory to write to.
+        min_size (int): target length of the shortest edge.
+        max_size (int): maximum length of the longest edge.
+        image_format (str): format passed to `utils.read_image`; must match cfg.INPUT.FORMAT.
+        shard_bytes (int): approximate size of each shard file.
+
+    Returns:
+        int: number of packed images.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    resize = T.ResizeShortestEdge(min_size, max_size)
+
+    index = np.zeros(len(dataset_dicts), dtype=INDEX_DTYPE)
+    packed_dicts = []
+    shard_id, offset = 0, 0
+    shard = open(os.path.join(output_dir, "shard_{:05d}.bin".format(shard_id)), "wb")
+    try:
+        for i, dataset_dict in enumerate(dataset_dicts):
+            image = utils.read_image(dataset_dict["file_name"], format=image_format)
+            transform = resize.get_transform(image)
+            image = np.ascontiguousarray(transform.apply_image(image), dtype=np.uint8)
+
+            if offset > 0 and offset + image.nbytes > shard_bytes:
+                shard.close()
+                shard_id, offset = shard_id + 1, 0
+                shard = open(os.path.join(output_dir, "shard_{:05d}.bin".format(shard_id)), "wb")
+            shard.write(image.tobytes())
+            channels = image.shape[2] if image.ndim == 3 else 1
+            index[i] = (shard_id, offset, image.shape[0], image.shape[1], channels)
+            offset += image.nbytes
+
+            annotations = []
+            for anno in dataset_dict.get("annotations", []):
+                bbox = BoxMode.convert(anno["bbox"], anno["bbox_mode"], BoxMode.XYXY_ABS)
+                bbox = transform.apply_box(np.array([bbox]))[0]
+                packed_anno = {
+                    k: v for k, v in anno.items() if k not in ("segmentation", "keypoints")
+                }
+                packed_anno["bbox"] = bbox.tolist()
+                packed_anno["bbox_mode"] = BoxMode.XYXY_ABS
+                annotations.append(packed_anno)
+
+            packed_dicts.append(
+                {
+                    "file_name": dataset_dict["file_name"],
+                    "image_id": dataset_dict.get("image_id", i),
+                    "height": image.shape[0],
+                    "width": image.shape[1],
+                    "packed_index": i,
+                    "annotations": annotations,
+                }
+            )
+            if (i + 1) % 500 == 0:
+                logger.info("Packed {}/{} images".format(i + 1, len(dataset_dicts)))
+    finally:
+        shard.close()
+
+    np.save(os.path.join(output_dir, "index.npy"), index)
+    with open(os.path.join(output_dir, "dataset.pkl"), "wb") as f:
+        pickle.dump(packed_dicts, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(output_dir, "meta.json"), "w") as f:
+        json.dump(
+            {
+                "format": image_format,
+                "min_size": min_size,
+                "max_size": max_size,
+                "num_images": len(packed_dicts),
+                "num_shards": shard_id + 1,
+            },
+            f,
+            indent=2,
+        )
+    return len(packed_dicts)
+
+
+class PackedImages:
+    """
+    Random access to the images of a packed directory.
+
+    Shards are memory-mapped lazily, so the object is cheap to pickle into data-loader
+    workers and every worker shares the page cache instead of holding its own copy.
+    """
+
+    def __init__(self, packed_dir):
+        self.packed_dir = packed_dir
+        with open(os.path.join(packed_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.index = np.load(os.path.join(packed_dir, "index.npy"))
+        self._shards = {}
+
+    @property
+    def image_format(self):
+        return self.meta["format"]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        """
+        Returns:
+            np.ndarray: HWC uint8 image; a read-only view into the memory-mapped shard.
+        """
+        shard_id, offset, height, width, channels = self.index[i]
+        shard = self._shards.get(shard_id)
+        if shard is None:
+            path = os.path.join(self.packed_dir, "shard_{:05d}.bin".format(shard_id))
+            shard = self._shards[shard_id] = np.memmap(path, dtype=np.uint8, mode="r")
+        shape = (int(height), int(width), int(channels))
+        return shard[offset : offset + int(np.prod(shape))].reshape(shape)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+
+def load_packed_dataset(packed_dir):
+    """
+    Load the dataset dicts of a packed directory.
+
+    Each dict carries "packed_dir" and "packed_index", which `PackedDatasetMapper`
+    uses to read the image instead of "file_name".
+    """
+    with open(os.path.join(packed_dir, "dataset.pkl"), "rb") as f:
+        dataset_dicts = pickle.load(f)
+    for dataset_dict in dataset_dicts:
+        dataset_dict["packed_dir"] = packed_dir
+    logger.info("Loaded {} packed images from {}".format(len(dataset_dicts), packed_dir))
+    return dataset_dicts
+
+
+def register_packed_instances(name, metadata, packed_dir):
+    """
+    Register a packed dataset. Use it together with `PackedDatasetMapper`.
+
+    Args:
+        name (str): a name that identifies the dataset, e.g. "expiry_dates_train_packed".
+        metadata (dict): extra metadata associated with this dataset (e.g. thing_classes).
+        packed_dir (str): directory written by `pack_dataset_dicts`.
+    """
+    DatasetCatalog.register(name, lambda: load_packed_dataset(packed_dir))
+    MetadataCatalog.get(name).set(packed_dir=packed_dir, evaluator_type="coco", **metadata)
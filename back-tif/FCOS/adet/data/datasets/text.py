@@ -1,8 +1,10 @@
 # Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved
 import contextlib
+import hashlib
 import io
 import logging
 import os
+import pickle
 from fvcore.common.timer import Timer
 from fvcore.common.file_io import PathManager
 
@@ -19,6 +21,13 @@ logger = logging.getLogger(__name__)
 
 __all__ = ["load_text_json", "register_text_instances"]
 
+# Parsed dataset dicts are cached here, keyed on the json path and validated by its
+# mtime and size. Set ADET_DATASET_CACHE_DIR="" to disable the cache.
+_CACHE_DIR = os.environ.get(
+    "ADET_DATASET_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "adet", "datasets")
+)
+_CACHE_VERSION = 1
+
 
 def register_text_instances(name, metadata, json_file, image_root):
     """
@@ -36,7 +45,91 @@ def register_text_instances(name, metadata, json_file, image_root):
     )
 
 
+def _cache_file(json_file, image_root, dataset_name, extra_annotation_keys):
+    key = repr(
+        (
+            os.path.abspath(json_file),
+            os.path.abspath(image_root),
+            # category ids are only remapped when a dataset name is given
+            dataset_name is not None,
+            sorted(extra_annotation_keys or []),
+        )
+    )
+    name = os.path.splitext(os.path.basename(json_file))[0]
+    return os.path.join(_CACHE_DIR, "{}_{}.pkl".format(name, hashlib.sha1(key.encode()).hexdigest()[:16]))
+
+
+def _json_signature(json_file):
+    stat = os.stat(json_file)
+    return {"version": _CACHE_VERSION, "mtime": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _read_cache(cache_file, signature):
+    try:
+        with open(cache_file, "rb") as f:
+            cached_signature = pickle.load(f)
+            if cached_signature != signature:
+                return None
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Ignoring unreadable dataset cache {}: {}".format(cache_file, e))
+        return None
+
+
+def _write_cache(cache_file, signature, payload):
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+        with open(tmp_file, "wb") as f:
+            # the signature goes first so that a stale cache is rejected without
+            # unpickling the dataset dicts
+            pickle.dump(signature, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        logger.warning("Could not write dataset cache {}: {}".format(cache_file, e))
+
+
 def load_text_json(json_file, image_root, dataset_name=None, extra_annotation_keys=None):
+    """
+    Load a json file with totaltext annotation format, using a binary cache of the
+    parsed dataset dicts when the json file has not changed.
+
+    See `_load_text_json` for the arguments and the returned format.
+    """
+    json_file = PathManager.get_local_path(json_file)
+    if not _CACHE_DIR:
+        return _load_text_json(json_file, image_root, dataset_name, extra_annotation_keys)
+
+    timer = Timer()
+    cache_file = _cache_file(json_file, image_root, dataset_name, extra_annotation_keys)
+    signature = _json_signature(json_file)
+    cached = _read_cache(cache_file, signature)
+    if cached is not None:
+        if dataset_name is not None:
+            meta = MetadataCatalog.get(dataset_name)
+            meta.thing_classes = cached["thing_classes"]
+            meta.thing_dataset_id_to_contiguous_id = cached["id_map"]
+        logger.info(
+            "Loaded {} images from cache {} in {:.2f} seconds.".format(
+                len(cached["dataset_dicts"]), cache_file, timer.seconds()
+            )
+        )
+        return cached["dataset_dicts"]
+
+    dataset_dicts = _load_text_json(json_file, image_root, dataset_name, extra_annotation_keys)
+    payload = {"dataset_dicts": dataset_dicts, "thing_classes": None, "id_map": None}
+    if dataset_name is not None:
+        meta = MetadataCatalog.get(dataset_name)
+        payload["thing_classes"] = meta.thing_classes
+        payload["id_map"] = meta.thing_dataset_id_to_contiguous_id
+    _write_cache(cache_file, signature, payload)
+    return dataset_dicts
+
+
+def _load_text_json(json_file, image_root, dataset_name=None, extra_annotation_keys=None):
     """
     Load a json file with totaltext annotation format.
     Currently supports text detection and recognition.
@@ -2,4 +2,5 @@ from .text_evaluation_all import TextEvaluator
 from .text_eval_script import text_eval_main
 from .text_eval_script_ic15 import text_eval_main_ic15
 from . import rrc_evaluation_funcs
-from . import rrc_evaluation_funcs_ic15
\ No newline at end of file
+from . import rrc_evaluation_funcs_ic15
+from .parallel_evaluation import inference_on_dataset_async, inference_on_dataset_sharded
@@ -0,0 +1,62 @@
+import editdistance
+
+"""
+Lexicon index for the lexicon-constrained text evaluation.
+
+TextEvaluator only keeps a lexicon match when its edit distance to the recognized
+word is below 1.5, i.e. 0 or 1. Every word within distance 1 of a query shares with
+it either the full string or a single-character deletion, so indexing each word under
+itself and its deletions gives a small candidate set that is then verified with
+editdistance, instead of scanning the whole lexicon.
+"""
+
+__all__ = ["LexiconIndex"]
+
+
+def _deletions(word):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+class LexiconIndex:
+    """
+    Nearest lexicon word within edit distance 1.
+
+    Args:
+        lexicon (list[str]): lexicon words, in file order.
+        pairs (dict): uppercased lexicon word -> ground-truth spelling.
+    """
+
+    def __init__(self, lexicon, pairs):
+        self.pairs = pairs
+        self.words = [word.upper() for word in lexicon]
+        self._index = {}
+        for i, word in enumerate(self.words):
+            for key in _deletions(word) | {word}:
+                self._index.setdefault(key, []).append(i)
+
+    def __len__(self):
+        return len(self.words)
+
+    def match(self, rec_str):
+        """
+        Returns:
+            (str, int): the ground-truth spelling of the closest word and its distance.
+            Ties go to the word that comes first in the lexicon, as in a linear scan.
+            When no word is within distance 1, returns ('', 100); callers discard
+            matches at distance >= 1.5 anyway.
+        """
+        rec_str = rec_str.upper()
+        candidates = set(self._index.get(rec_str, ()))
+        for key in _deletions(rec_str):
+            candidates.update(self._index.get(key, ()))
+
+        match_word = ''
+        match_dist = 100
+        for i in sorted(candidates):
+            dist = editdistance.eval(rec_str, self.words[i])
+            if dist < match_dist:
+                match_dist = dist
+                match_word = self.pairs[self.words[i]]
+                if dist == 0:
+                    break
+        return match_word, match_dist
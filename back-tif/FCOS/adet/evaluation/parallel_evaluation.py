@@ -0,0 +1,227 @@
+import logging
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from detectron2.data import DatasetCatalog
+from detectron2.evaluation.evaluator import inference_context
+from detectron2.utils.logger import log_every_n_seconds
+
+"""
+Evaluation runners that overlap inference with the evaluator's output conversion, or
+shard a dataset across CPU processes.
+
+`inference_on_dataset_async` is a drop-in replacement for detectron2's
+`inference_on_dataset`. `inference_on_dataset_sharded` runs the model in several
+processes and feeds the outputs to the evaluator in dataset order, so the metrics
+match a single-process run.
+"""
+
+__all__ = ["inference_on_dataset_async", "inference_on_dataset_sharded"]
+
+logger = logging.getLogger(__name__)
+
+
+def _stage_report(num_images, timings, wall):
+    report = {"num_images": num_images, "wall_seconds": wall}
+    for stage, seconds in timings.items():
+        report["{}_seconds".format(stage)] = seconds
+        report["{}_images_per_s".format(stage)] = num_images / seconds if seconds > 0 else 0.0
+    report["images_per_s"] = num_images / wall if wall > 0 else 0.0
+    return report
+
+
+def _log_report(report):
+    stages = ", ".join(
+        "{}: {:.2f} img/s".format(key[: -len("_images_per_s")], value)
+        for key, value in report.items()
+        if key.endswith("_images_per_s")
+    )
+    logger.info(
+        "Evaluated {} images in {:.1f}s ({:.2f} img/s). Per stage: {}".format(
+            report["num_images"], report["wall_seconds"], report["images_per_s"], stages
+        )
+    )
+
+
+def _sort_predictions(evaluator, order):
+    """Restore dataset order in evaluators that keep a list of per-image predictions."""
+    predictions = getattr(evaluator, "_predictions", None)
+    if isinstance(predictions, list):
+        predictions.sort(key=lambda p: order.get(p.get("image_id"), len(order)))
+
+
+def inference_on_dataset_async(model, data_loader, evaluator, num_workers=1, max_pending=8):
+    """
+    Run the model on the data loader and call `evaluator.process` on a thread pool, so
+    that the conversion of the outputs overlaps with the next forward passes.
+
+    Args:
+        model (nn.Module): model to evaluate. It is temporarily put in eval mode,
+            like in detectron2's `inference_on_dataset`.
+        data_loader: an iterable of batches in detectron2's format.
+        evaluator (DatasetEvaluator): evaluator to feed.
+        num_workers (int): threads running `evaluator.process`. With more than one,
+            the evaluator's predictions are put back in dataset order at the end.
+        max_pending (int): maximum number of batches waiting for conversion.
+
+    Returns:
+        (dict, dict): the evaluator results and the per-stage timing report.
+    """
+    evaluator.reset()
+    timings = {"data": 0.0, "inference": 0.0, "process": 0.0}
+    order = {}
+    pending = []
+    num_images = 0
+
+    def process(inputs, outputs):
+        start = time.perf_counter()
+        evaluator.process(inputs, outputs)
+        return time.perf_counter() - start
+
+    start_wall = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="eval-process") as pool, \
+            inference_context(model), torch.no_grad():
+        start_data = time.perf_counter()
+        for idx, inputs in enumerate(data_loader):
+            timings["data"] += time.perf_counter() - start_data
+
+            start_inference = time.perf_counter()
+            outputs = model(inputs)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            timings["inference"] += time.perf_counter() - start_inference
+
+            for x in inputs:
+                order.setdefault(x.get("image_id"), len(order))
+            num_images += len(inputs)
+            pending.append(pool.submit(process, inputs, outputs))
+
+            # bound the number of outputs kept alive while the workers catch up
+            while len(pending) > max_pending:
+                timings["process"] += pending.pop(0).result()
+
+            log_every_n_seconds(
+                logging.INFO, "Inference done {}/{}".format(idx + 1, len(data_loader)), n=5
+            )
+            start_data = time.perf_counter()
+
+        for future in pending:
+            timings["process"] += future.result()
+
+    if num_workers > 1:
+        _sort_predictions(evaluator, order)
+
+    start_evaluate = time.perf_counter()
+    results = evaluator.evaluate()
+    timings["evaluate"] = time.perf_counter() - start_evaluate
+
+    report = _stage_report(num_images, timings, time.perf_counter() - start_wall)
+    _log_report(report)
+    return results if results is not None else {}, report
+
+
+def _outputs_to_cpu(outputs):
+    return {k: v.to("cpu") if hasattr(v, "to") else v for k, v in outputs.items()}
+
+
+def _run_shard(cfg, dataset_dicts, num_threads):
+    """
+    Worker of `inference_on_dataset_sharded`: build the model, run it on one shard and
+    return the per-image inputs (without the image tensor) and CPU outputs.
+    """
+    import adet.modeling  # noqa: F401, registers the AdelaiDet meta-architectures
+    from detectron2.data import DatasetMapper
+    from detectron2.modeling import build_model
+    from adet.checkpoint import AdetCheckpointer
+
+    torch.set_num_threads(num_threads)
+    model = build_model(cfg)
+    AdetCheckpointer(model).load(cfg.MODEL.WEIGHTS)
+    model.eval()
+    mapper = DatasetMapper(cfg, False)
+
+    results = []
+    timings = {"data": 0.0, "inference": 0.0}
+    with torch.no_grad():
+        for dataset_dict in dataset_dicts:
+            start = time.perf_counter()
+            inputs = mapper(dataset_dict)
+            timings["data"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            outputs = model([inputs])[0]
+            timings["inference"] += time.perf_counter() - start
+
+            inputs.pop("image", None)
+            results.append((inputs, _outputs_to_cpu(outputs)))
+    return results, timings
+
+
+def inference_on_dataset_sharded(cfg, dataset_name, evaluator, num_shards=None):
+    """
+    Evaluate on CPU by sharding the dataset across processes.
+
+    Each process builds the model from `cfg` and runs `num_threads = cores / shards`
+    intra-op threads. The outputs are fed to the evaluator in dataset order, so the
+    results are the same as with a single process.
+
+    Memory grows linearly with `num_shards`: every shard holds its own copy of the
+    model (about 1 GB for an R-50 FCOS, weights plus CPU activations at test size)
+    and keeps all the CPU outputs of its images until the end, so that the masks of
+    a mask model add up to a large share of the whole dataset's predictions.
+    Keep `num_shards * per-shard memory` below the available RAM.
+
+    Args:
+        cfg (CfgNode): config with MODEL.DEVICE "cpu" and MODEL.WEIGHTS set.
+        dataset_name (str): registered dataset to evaluate.
+        evaluator (DatasetEvaluator): evaluator to feed, in this process.
+        num_shards (int): number of processes (default: cores // 4, at least 1).
+
+    Returns:
+        (dict, dict): the evaluator results and the per-stage timing report. The data and
+        inference times are summed over the shards.
+    """
+    cpu_count = os.cpu_count() or 1
+    # one model plus activations per shard: a process per core runs out of memory
+    num_shards = num_shards or max(1, cpu_count // 4)
+    dataset_dicts = DatasetCatalog.get(dataset_name)
+    num_shards = max(1, min(num_shards, len(dataset_dicts)))
+    num_threads = max(1, cpu_count // num_shards)
+    shards = [dataset_dicts[i::num_shards] for i in range(num_shards)]
+
+    logger.info(
+        "Evaluating {} images of {} in {} shards x {} threads".format(
+            len(dataset_dicts), dataset_name, num_shards, num_threads
+        )
+    )
+    start_wall = time.perf_counter()
+    # spawn: the workers must not inherit OpenMP or CUDA state from this process
+    with mp.get_context("spawn").Pool(num_shards) as pool:
+        shard_results = pool.starmap(
+            _run_shard, [(cfg, shard, num_threads) for shard in shards]
+        )
+
+    timings = {"data": 0.0, "inference": 0.0, "process": 0.0}
+    for _, shard_timings in shard_results:
+        for stage, seconds in shard_timings.items():
+            timings[stage] += seconds
+
+    # interleave the shards back into dataset order
+    evaluator.reset()
+    start = time.perf_counter()
+    for i in range(len(dataset_dicts)):
+        inputs, outputs = shard_results[i % num_shards][0][i // num_shards]
+        evaluator.process([inputs], [outputs])
+    timings["process"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = evaluator.evaluate()
+    timings["evaluate"] = time.perf_counter() - start
+
+    report = _stage_report(len(dataset_dicts), timings, time.perf_counter() - start_wall)
+    _log_report(report)
+    return results if results is not None else {}, report
@@ -0,0 +1,98 @@
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+"""
+Batched helpers for the RRC text evaluation scripts: an axis-aligned bounding-box
+prefilter for the GT x detection IoU matrix, and a process pool that shards the
+per-image evaluation.
+"""
+
+__all__ = ["polygon_bounds", "overlapping_pairs", "iou_matrix", "map_samples"]
+
+# Number of processes used by `map_samples` (1 = serial, 0 = os.cpu_count()). Opt-in,
+# since forking a multithreaded torch process is only safe in simple setups.
+EVAL_NUM_WORKERS = int(os.environ.get("ADET_EVAL_WORKERS", "1"))
+
+_sample_fn = None
+
+
+def polygon_bounds(polygons):
+    """
+    Args:
+        polygons (list[Polygon.Polygon]): polygons as built by the evaluation scripts.
+
+    Returns:
+        ndarray: (N, 4) array of xmin, ymin, xmax, ymax.
+    """
+    if len(polygons) == 0:
+        return np.zeros((0, 4))
+    # Polygon.boundingBox() returns (xmin, xmax, ymin, ymax)
+    bounds = np.array([p.boundingBox() for p in polygons], dtype=np.float64)
+    return bounds[:, [0, 2, 1, 3]]
+
+
+def overlapping_pairs(bounds_a, bounds_b):
+    """
+    Returns:
+        ndarray: (N, M) bool mask of the box pairs that intersect or touch.
+    """
+    return (
+        (bounds_a[:, None, 0] <= bounds_b[None, :, 2])
+        & (bounds_b[None, :, 0] <= bounds_a[:, None, 2])
+        & (bounds_a[:, None, 1] <= bounds_b[None, :, 3])
+        & (bounds_b[None, :, 1] <= bounds_a[:, None, 3])
+    )
+
+
+def iou_matrix(gtPols, detPols, iou_fn):
+    """
+    GT x detection IoU matrix. The exact polygon IoU `iou_fn(pD, pG)` is only computed
+    for pairs whose bounding boxes overlap; every other pair has an empty intersection,
+    for which the scripts' IoU is 0 as well.
+    """
+    iouMat = np.zeros([len(gtPols), len(detPols)])
+    candidates = overlapping_pairs(polygon_bounds(gtPols), polygon_bounds(detPols))
+    for gtNum, detNum in zip(*np.nonzero(candidates)):
+        iouMat[gtNum, detNum] = iou_fn(detPols[detNum], gtPols[gtNum])
+    return iouMat
+
+
+def _call_sample_fn(key):
+    return _sample_fn(key)
+
+
+def _cuda_initialized():
+    # only look at torch if the caller already imported it
+    torch = sys.modules.get("torch")
+    return torch is not None and torch.cuda.is_initialized()
+
+
+def map_samples(fn, keys, num_workers=None):
+    """
+    Apply `fn` to every key, in order, sharding the keys across a process pool.
+
+    `fn` is usually a closure over the loaded zip files, which cannot be pickled, so the
+    pool is forked and the workers reach it through a module global. The keys are
+    evaluated serially when only one worker is requested (the default, see
+    `ADET_EVAL_WORKERS`), where fork is not available (Windows), or when CUDA has been
+    initialized in this process, since CUDA does not survive a fork.
+    """
+    global _sample_fn
+
+    keys = list(keys)
+    if num_workers is None:
+        num_workers = EVAL_NUM_WORKERS or os.cpu_count() or 1
+    num_workers = min(num_workers, len(keys))
+    if num_workers <= 1 or "fork" not in multiprocessing.get_all_start_methods() \
+            or _cuda_initialized():
+        return [fn(key) for key in keys]
+
+    _sample_fn = fn
+    try:
+        with multiprocessing.get_context("fork").Pool(num_workers) as pool:
+            return pool.map(_call_sample_fn, keys, chunksize=max(1, len(keys) // (num_workers * 4)))
+    finally:
+        _sample_fn = None
@@ -52,14 +52,20 @@ def load_zip_file(file,fileNameRegExp='',allEntries=False):
     Returns an array with the contents (filtered by fileNameRegExp) of a ZIP file.
     The key's are the names or the file or the capturing group definied in the fileNameRegExp
     allEntries validates that all entries in the ZIP file pass the fileNameRegExp
+    file can also be a dictionary {entry name: contents} with an in-memory submission
     """
-    try:
-        archive=zipfile.ZipFile(file, mode='r', allowZip64=True)
-    except :
-        raise Exception('Error loading the ZIP archive')    
+    if isinstance(file, dict):
+        archive = None
+        names = list(file.keys())
+    else:
+        try:
+            archive=zipfile.ZipFile(file, mode='r', allowZip64=True)
+        except :
+            raise Exception('Error loading the ZIP archive')    
+        names = archive.namelist()
 
     pairs = []
-    for name in archive.namelist():
+    for name in names:
         addFile = True
         keyName = name
         if fileNameRegExp!="":
@@ -71,7 +77,7 @@ def load_zip_file(file,fileNameRegExp='',allEntries=False):
                     keyName = m.group(1)
         
         if addFile:
-            pairs.append( [ keyName , archive.read(name)] )
+            pairs.append( [ keyName , file[name] if archive is None else archive.read(name)] )
         else:
             if allEntries:
                 raise Exception('ZIP entry not valid: %s' %name)             
@@ -3,6 +3,7 @@
 # encoding=utf8
 from collections import namedtuple
 from adet.evaluation import rrc_evaluation_funcs_ic15 as rrc_evaluation_funcs
+from adet.evaluation.polygon_matching import iou_matrix, map_samples
 import importlib
 import sys
 
@@ -264,7 +265,7 @@ def evaluate_method(gtFilePath, submFilePath, evaluationParams):
     arrGlobalConfidences = [];
     arrGlobalMatches = [];
 
-    for resFile in gt:
+    def evaluate_sample(resFile):
         
         gtFile = rrc_evaluation_funcs.decode_utf8(gt[resFile])
         if (gtFile is None) :
@@ -370,16 +371,12 @@ def evaluate_method(gtFilePath, submFilePath, evaluationParams):
             if len(gtPols)>0 and len(detPols)>0:
                 #Calculate IoU and precision matrixs
                 outputShape=[len(gtPols),len(detPols)]
-                iouMat = np.empty(outputShape)
+                # exact polygon IoU only for pairs whose bounding boxes overlap
+                iouMat = iou_matrix(gtPols, detPols, get_intersection_over_union)
                 gtRectMat = np.zeros(len(gtPols),np.int8)
                 detRectMat = np.zeros(len(detPols),np.int8)
                 det_only_gtRectMat = np.zeros(len(gtPols),np.int8)
                 det_only_detRectMat = np.zeros(len(detPols),np.int8)
-                for gtNum in range(len(gtPols)):
-                    for detNum in range(len(detPols)):
-                        pG = gtPols[gtNum]
-                        pD = detPols[detNum]
-                        iouMat[gtNum,detNum] = get_intersection_over_union(pD,pG)
 
                 for gtNum in range(len(gtPols)):
                     for detNum in range(len(detPols)):
@@ -416,9 +413,6 @@ def evaluate_method(gtFilePath, submFilePath, evaluationParams):
 
                         arrSampleConfidences.append(confidencesList[detNum])
                         arrSampleMatch.append(match)
-
-                        arrGlobalConfidences.append(confidencesList[detNum]);
-                        arrGlobalMatches.append(match);                                
                 
         numGtCare = (len(gtPols) - len(gtDontCarePolsNum))
         numDetCare = (len(detPols) - len(detDontCarePolsNum))
@@ -444,14 +438,7 @@ def evaluate_method(gtFilePath, submFilePath, evaluationParams):
         hmean = 0 if (precision + recall)==0 else 2.0 * precision * recall / (precision + recall)
         det_only_hmean = 0 if (det_only_precision + det_only_recall)==0 else 2.0 * det_only_precision * det_only_recall / (det_only_precision + det_only_recall)
 
-        matchedSum += detCorrect
-        det_only_matchedSum += detOnlyCorrect
-        numGlobalCareGt += numGtCare
-        numGlobalCareDet += numDetCare
-        det_only_numGlobalCareGt += det_only_numGtCare
-        det_only_numGlobalCareDet += det_only_numDetCare
-
-        perSampleMetrics[resFile] = {
+        sampleMetrics = {
                                         'precision':precision,
                                         'recall':recall,
                                         'hmean':hmean,
@@ -467,6 +454,29 @@ def evaluate_method(gtFilePath, submFilePath, evaluationParams):
                                         'evaluationParams': evaluationParams,
                                         'evaluationLog': evaluationLog     
                                     }
+        return {
+            'detCorrect': detCorrect,
+            'detOnlyCorrect': detOnlyCorrect,
+            'numGtCare': numGtCare,
+            'numDetCare': numDetCare,
+            'det_only_numGtCare': det_only_numGtCare,
+            'det_only_numDetCare': det_only_numDetCare,
+            'confidences': arrSampleConfidences,
+            'matches': arrSampleMatch,
+            'metrics': sampleMetrics,
+        }
+
+    # images are evaluated in a process pool; results come back in gt order
+    for resFile, sample in zip(gt, map_samples(evaluate_sample, gt)):
+        matchedSum += sample['detCorrect']
+        det_only_matchedSum += sample['detOnlyCorrect']
+        numGlobalCareGt += sample['numGtCare']
+        numGlobalCareDet += sample['numDetCare']
+        det_only_numGlobalCareGt += sample['det_only_numGtCare']
+        det_only_numGlobalCareDet += sample['det_only_numDetCare']
+        arrGlobalConfidences.extend(sample['confidences'])
+        arrGlobalMatches.extend(sample['matches'])
+        perSampleMetrics[resFile] = sample['metrics']
         
     # Compute AP
     AP = 0
@@ -16,14 +16,11 @@ from detectron2.utils import comm
 from detectron2.data import MetadataCatalog
 from detectron2.evaluation.evaluator import DatasetEvaluator
 
-import glob
-import shutil
 from shapely.geometry import Polygon, LinearRing
 from adet.evaluation import text_eval_script
 from adet.evaluation import text_eval_script_ic15
-import zipfile
+from adet.evaluation.lexicon_index import LexiconIndex
 import pickle
-import editdistance
 import cv2
 class TextEvaluator():
     """
@@ -76,6 +73,8 @@ class TextEvaluator():
             self._word_spotting = False
 
         self._text_eval_confidence = cfg.MODEL.FCOS.INFERENCE_TH_TEST
+        # lexicon indexes are built once and reused by every evaluation
+        self._lexicon_indexes = {}
     def reset(self):
         self._predictions = []
 
@@ -86,246 +85,189 @@ class TextEvaluator():
             prediction["instances"] = self.instances_to_coco_json(instances, input)
             self._predictions.append(prediction)
 
-    def to_eval_format(self, file_path, temp_dir="temp_det_results", cf_th=0.5):
-        def fis_ascii(s):
-            a = (ord(c) < 128 for c in s)
-            return all(a)
-
-        def de_ascii(s):
-            a = [c for c in s if ord(c) < 128]
-            outa = ''
-            for i in a:
-                outa +=i
-            return outa
-
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            with open('temp_all_det_cors.txt', 'w') as f2:
-                for ix in range(len(data)):
-                    if data[ix]['score'] > 0.1:
-                        outstr = '{}: '.format(data[ix]['image_id'])
-                        xmin = 1000000
-                        ymin = 1000000
-                        xmax = 0 
-                        ymax = 0
-                        for i in range(len(data[ix]['polys'])):
-                            outstr = outstr + str(int(data[ix]['polys'][i][0])) +','+str(int(data[ix]['polys'][i][1])) +','
-                        # ass = de_ascii(data[ix]['rec'])
-                        ass = str(data[ix]['rec'])
-                        if len(ass)>=0: # 
-                            outstr = outstr + str(round(data[ix]['score'], 3)) +',####'+ass+'\n'	
-                            f2.writelines(outstr)
-                f2.close()
-        dirn = temp_dir
-        lsc = [cf_th] 
-        fres = open('temp_all_det_cors.txt', 'r').readlines()
-        for isc in lsc:	
-            if not os.path.isdir(dirn):
-                os.mkdir(dirn)
-            for line in fres:
-                line = line.strip()
-                s = line.split(': ')
-                filename = '{:07d}.txt'.format(int(s[0]))
-                outName = os.path.join(dirn, filename)
-                with open(outName, 'a') as fout:
-                    ptr = s[1].strip().split(',####')
-                    score = ptr[0].split(',')[-1]
-                    if float(score) < isc:
-                        continue
-                    if "icdar2015" in self.dataset_name and float(score) < 0.45:
-                        continue
-                    cors = ','.join(e for e in ptr[0].split(',')[:-1])
-                    fout.writelines(cors+',####'+str(ptr[1])+'\n')
-        os.remove("temp_all_det_cors.txt")
-
-    def sort_detection(self, temp_dir):
-        origin_file = temp_dir
-        output_file = "final_"+temp_dir
-        output_file_full = "full_final_"+temp_dir
-        if not os.path.isdir(output_file_full):
-            os.mkdir(output_file_full)
-        if not os.path.isdir(output_file):
-            os.mkdir(output_file)
-        files = glob.glob(origin_file+'*.txt')
-        files.sort()
+    def to_eval_format(self, coco_results, cf_th=0.5):
+        """
+        Group the detections per image as "x1,y1,...,xn,yn,####rec" lines.
+
+        This used to go through a temporary text file and one appended .txt file per
+        image; the same line format and the same string parsing are applied in memory.
+
+        Returns:
+            dict: '{:07d}.txt' file name -> list of lines, for every image that has a
+            detection with score > 0.1 (possibly with no line left after filtering).
+        """
+        temp_lines = []
+        for det in coco_results:
+            if det['score'] > 0.1:
+                outstr = '{}: '.format(det['image_id'])
+                for i in range(len(det['polys'])):
+                    outstr = outstr + str(int(det['polys'][i][0])) +','+str(int(det['polys'][i][1])) +','
+                ass = str(det['rec'])
+                outstr = outstr + str(round(det['score'], 3)) +',####'+ass+'\n'
+                temp_lines.append(outstr)
+        # read the lines back with universal newlines, as the temporary file was
+        fres = io.StringIO(''.join(temp_lines), newline=None).readlines()
+
+        det_lines = {}
+        for line in fres:
+            line = line.strip()
+            s = line.split(': ')
+            filename = '{:07d}.txt'.format(int(s[0]))
+            image_lines = det_lines.setdefault(filename, [])
+            ptr = s[1].strip().split(',####')
+            score = ptr[0].split(',')[-1]
+            if float(score) < cf_th:
+                continue
+            if "icdar2015" in self.dataset_name and float(score) < 0.45:
+                continue
+            cors = ','.join(e for e in ptr[0].split(',')[:-1])
+            image_lines.append(cors+',####'+str(ptr[1])+'\n')
+        return det_lines
+
+    def load_lexicon(self):
+        """
+        Returns:
+            LexiconIndex: the dataset-wide lexicon, or None when no lexicon is used.
+        """
         if "totaltext" in self.dataset_name:
             if not self.lexicon_type == None:
-                lexicon_path = 'datasets/totaltext/weak_voc_new.txt'
-                lexicon_fid=open(lexicon_path, 'r')
-                pair_list = open('datasets/totaltext/weak_voc_pair_list.txt', 'r')
-                pairs = dict()
-                for line in pair_list.readlines():
-                    line=line.strip()
-                    word = line.split(' ')[0].upper()
-                    word_gt = line[len(word)+1:]
-                    pairs[word] = word_gt
-                lexicon_fid=open(lexicon_path, 'r')
-                lexicon=[]
-                for line in lexicon_fid.readlines():
-                    line=line.strip()
-                    lexicon.append(line)
+                return self._get_lexicon_index(
+                    'datasets/totaltext/weak_voc_new.txt', 'datasets/totaltext/weak_voc_pair_list.txt'
+                )
         elif "ctw1500" in self.dataset_name:
             if not self.lexicon_type == None:
-                lexicon_path = 'datasets/CTW1500/weak_voc_new.txt'
-                lexicon_fid=open(lexicon_path, 'r')
-                pair_list = open('datasets/CTW1500/weak_voc_pair_list.txt', 'r')
-                pairs = dict()
-                lexicon_fid=open(lexicon_path, 'r')
-                lexicon=[]
-                for line in lexicon_fid.readlines():
-                    line=line.strip()
-                    lexicon.append(line)
-                    pairs[line.upper()] = line
+                return self._get_lexicon_index('datasets/CTW1500/weak_voc_new.txt')
         elif "icdar2015" in self.dataset_name:
-            if self.lexicon_type==1: 
+            if self.lexicon_type==1:
                 # generic lexicon
-                lexicon_path = 'datasets/icdar2015/GenericVocabulary_new.txt'
-                lexicon_fid=open(lexicon_path, 'r')
-                pair_list = open('datasets/icdar2015/GenericVocabulary_pair_list.txt', 'r')
-                pairs = dict()
-                for line in pair_list.readlines():
-                    line=line.strip()
-                    word = line.split(' ')[0].upper()
-                    word_gt = line[len(word)+1:]
-                    pairs[word] = word_gt
-                lexicon_fid=open(lexicon_path, 'r')
-                lexicon=[]
-                for line in lexicon_fid.readlines():
-                    line=line.strip()
-                    lexicon.append(line)
+                return self._get_lexicon_index(
+                    'datasets/icdar2015/GenericVocabulary_new.txt',
+                    'datasets/icdar2015/GenericVocabulary_pair_list.txt',
+                )
             if self.lexicon_type==2:
                 # weak lexicon
-                lexicon_path = 'datasets/icdar2015/ch4_test_vocabulary_new.txt'
-                lexicon_fid=open(lexicon_path, 'r')
-                pair_list = open('datasets/icdar2015/ch4_test_vocabulary_pair_list.txt', 'r')
-                pairs = dict()
-                for line in pair_list.readlines():
-                    line=line.strip()
-                    word = line.split(' ')[0].upper()
-                    word_gt = line[len(word)+1:]
-                    pairs[word] = word_gt
-                lexicon_fid=open(lexicon_path, 'r')
-                lexicon=[]
-                for line in lexicon_fid.readlines():
-                    line=line.strip()
-                    lexicon.append(line)
-
-        def find_match_word(rec_str, pairs, lexicon=None):
-            rec_str = rec_str.upper()
-            dist_min = 100
-            dist_min_pre = 100
-            match_word = ''
-            match_dist = 100
-            for word in lexicon:
-                word = word.upper()
-                ed = editdistance.eval(rec_str, word)
-                length_dist = abs(len(word) - len(rec_str))
-                dist = ed
-                if dist<dist_min:
-                    dist_min = dist
-                    match_word = pairs[word]
-                    match_dist = dist
-            return match_word, match_dist
-        for i in files:
+                return self._get_lexicon_index(
+                    'datasets/icdar2015/ch4_test_vocabulary_new.txt',
+                    'datasets/icdar2015/ch4_test_vocabulary_pair_list.txt',
+                )
+        return None
+
+    def load_strong_lexicon(self, img_idx):
+        """Per-image strong lexicon of icdar2015"""
+        return self._get_lexicon_index(
+            'datasets/icdar2015/new_strong_lexicon/new_voc_img_' + str(img_idx) + '.txt',
+            'datasets/icdar2015/new_strong_lexicon/pair_voc_img_' + str(img_idx) + '.txt',
+        )
+
+    def _get_lexicon_index(self, lexicon_path, pair_list_path=None):
+        """
+        Read a lexicon and its pair list once and index it. Without a pair list each
+        word maps to itself (CTW1500).
+        """
+        key = (lexicon_path, pair_list_path)
+        index = self._lexicon_indexes.get(key)
+        if index is None:
+            lexicon = self._read_lexicon(lexicon_path)
+            if pair_list_path is None:
+                pairs = {line.upper(): line for line in lexicon}
+            else:
+                pairs = self._read_pair_list(pair_list_path)
+            index = self._lexicon_indexes[key] = LexiconIndex(lexicon, pairs)
+        return index
+
+    @staticmethod
+    def _read_lexicon(lexicon_path):
+        with open(lexicon_path, 'r') as lexicon_fid:
+            return [line.strip() for line in lexicon_fid.readlines()]
+
+    @staticmethod
+    def _read_pair_list(pair_list_path):
+        pairs = dict()
+        with open(pair_list_path, 'r') as pair_list:
+            for line in pair_list.readlines():
+                line=line.strip()
+                word = line.split(' ')[0].upper()
+                word_gt = line[len(word)+1:]
+                pairs[word] = word_gt
+        return pairs
+
+    def sort_lines(self, fin, source_name, lexicon):
+        """
+        Drop invalid polygons, orient them clockwise and, if a lexicon is used, replace
+        each transcription by its closest lexicon word.
+
+        Returns:
+            (list, list): output lines without and with the lexicon.
+        """
+        lines, lines_full = [], []
+        for iline, line in enumerate(fin):
+            ptr = line.strip().split(',####')
+            rec  = ptr[1]
+            cors = ptr[0].split(',')
+            assert(len(cors) %2 == 0), 'cors invalid.'
+            pts = [(int(cors[j]), int(cors[j+1])) for j in range(0,len(cors),2)]
+            try:
+                pgt = Polygon(pts)
+            except Exception as e:
+                print(e)
+                print('An invalid detection in {} line {} is removed ... '.format(source_name, iline))
+                continue
+
+            if not pgt.is_valid:
+                print('An invalid detection in {} line {} is removed ... '.format(source_name, iline))
+                continue
+
+            pRing = LinearRing(pts)
+            if not "icdar2015" in self.dataset_name:
+                if pRing.is_ccw:
+                    pts.reverse()
+            outstr = ''
+            for ipt in pts[:-1]:
+                outstr += (str(int(ipt[0]))+','+ str(int(ipt[1]))+',')
+            outstr += (str(int(pts[-1][0]))+','+ str(int(pts[-1][1])))
+            pts = outstr
+            if "icdar2015" in self.dataset_name:
+                outstr = outstr + ',' + rec
+            else:
+                outstr = outstr + ',####' + rec
+            lines.append(outstr+'\n')
+            if self.lexicon_type is None:
+                rec_full = rec
+            else:
+                match_word, match_dist = lexicon.match(rec)
+                if match_dist<1.5:
+                    rec_full = match_word
+                    if "icdar2015" in self.dataset_name:
+                        pts = pts + ',' + rec_full
+                    else:
+                        pts = pts + ',####' + rec_full
+                    lines_full.append(pts+'\n')
+        return lines, lines_full
+
+    def sort_detection(self, det_lines):
+        """
+        Build the submissions for the official evaluation code.
+
+        Returns:
+            (dict, dict): in-memory submissions without and with the lexicon, mapping the
+            file names that used to be zipped to their utf-8 contents. They are passed to
+            `rrc_evaluation_funcs.load_zip_file` in place of det.zip and det_full.zip.
+        """
+        lexicon = self.load_lexicon()
+        det, det_full = {}, {}
+        for filename in sorted(det_lines):
             if "icdar2015" in self.dataset_name:
-                out = output_file + 'res_img_' + str(int(i.split('/')[-1].split('.')[0])) + '.txt'
-                out_full = output_file_full + 'res_img_' + str(int(i.split('/')[-1].split('.')[0])) + '.txt'
+                img_idx = int(filename.split('.')[0])
+                out = 'res_img_' + str(img_idx) + '.txt'
                 if self.lexicon_type==3:
-                    lexicon_path = 'datasets/icdar2015/new_strong_lexicon/new_voc_img_' + str(int(i.split('/')[-1].split('.')[0])) + '.txt'
-                    lexicon_fid=open(lexicon_path, 'r')
-                    pair_list = open('datasets/icdar2015/new_strong_lexicon/pair_voc_img_' + str(int(i.split('/')[-1].split('.')[0])) + '.txt')
-                    pairs = dict()
-                    for line in pair_list.readlines():
-                        line=line.strip()
-                        word = line.split(' ')[0].upper()
-                        word_gt = line[len(word)+1:]
-                        pairs[word] = word_gt
-                    lexicon_fid=open(lexicon_path, 'r')
-                    lexicon=[]
-                    for line in lexicon_fid.readlines():
-                        line=line.strip()
-                        lexicon.append(line)
+                    lexicon = self.load_strong_lexicon(img_idx)
             else:
-                out = i.replace(origin_file, output_file)
-                out_full = i.replace(origin_file, output_file_full)
-            fin = open(i, 'r').readlines()
-            fout = open(out, 'w')
-            fout_full = open(out_full, 'w')
-            for iline, line in enumerate(fin):
-                ptr = line.strip().split(',####')
-                rec  = ptr[1]
-                cors = ptr[0].split(',')
-                assert(len(cors) %2 == 0), 'cors invalid.'
-                pts = [(int(cors[j]), int(cors[j+1])) for j in range(0,len(cors),2)]
-                try:
-                    pgt = Polygon(pts)
-                except Exception as e:
-                    print(e)
-                    print('An invalid detection in {} line {} is removed ... '.format(i, iline))
-                    continue
-                
-                if not pgt.is_valid:
-                    print('An invalid detection in {} line {} is removed ... '.format(i, iline))
-                    continue
-                    
-                pRing = LinearRing(pts)
-                if not "icdar2015" in self.dataset_name:
-                    if pRing.is_ccw:
-                        pts.reverse()
-                outstr = ''
-                for ipt in pts[:-1]:
-                    outstr += (str(int(ipt[0]))+','+ str(int(ipt[1]))+',')
-                outstr += (str(int(pts[-1][0]))+','+ str(int(pts[-1][1])))
-                pts = outstr
-                if "icdar2015" in self.dataset_name:
-                    outstr = outstr + ',' + rec
-                else:
-                    outstr = outstr + ',####' + rec
-                fout.writelines(outstr+'\n')
-                if self.lexicon_type is None:
-                    rec_full = rec
-                else:
-                    match_word, match_dist = find_match_word(rec,pairs,lexicon)
-                    if match_dist<1.5:
-                        rec_full = match_word
-                        if "icdar2015" in self.dataset_name:
-                            pts = pts + ',' + rec_full
-                        else:
-                            pts = pts + ',####' + rec_full
-                        fout_full.writelines(pts+'\n')
-            fout.close()
-            fout_full.close()
-        def zipdir(path, ziph):
-            # ziph is zipfile handle
-            for root, dirs, files in os.walk(path):
-                for file in files:
-                    ziph.write(os.path.join(root, file))
-        if "icdar2015" in self.dataset_name:
-            os.system('zip -r -q -j '+'det.zip'+' '+output_file+'/*')
-            os.system('zip -r -q -j '+'det_full.zip'+' '+output_file_full+'/*')
-            shutil.rmtree(origin_file)
-            shutil.rmtree(output_file)
-            shutil.rmtree(output_file_full)
-            return "det.zip", "det_full.zip"
-        else:
-            os.chdir(output_file)
-            zipf = zipfile.ZipFile('../det.zip', 'w', zipfile.ZIP_DEFLATED)
-            zipdir('./', zipf)
-            zipf.close()
-            os.chdir("../")
-
-            os.chdir(output_file_full)
-            zipf_full = zipfile.ZipFile('../det_full.zip', 'w', zipfile.ZIP_DEFLATED)
-            zipdir('./', zipf_full)
-            zipf_full.close()
-            os.chdir("../")
-            # clean temp files
-
-            shutil.rmtree(origin_file)
-            shutil.rmtree(output_file)
-            shutil.rmtree(output_file_full)
-            return "det.zip", "det_full.zip"
-    
+                out = filename
+            lines, lines_full = self.sort_lines(det_lines[filename], filename, lexicon)
+            det[out] = ''.join(lines).encode('utf-8')
+            det_full[out] = ''.join(lines_full).encode('utf-8')
+        return det, det_full
+
     def evaluate_with_official_code(self, result_path, gt_path):
         if "icdar2015" in self.dataset_name:
             return text_eval_script_ic15.text_eval_main_ic15(det_file=result_path, gt_file=gt_path, is_word_spotting=self._word_spotting)
@@ -358,16 +300,14 @@ class TextEvaluator():
         # eval text
         if not self._text_eval_gt_path:
             return copy.deepcopy(self._results)
-        temp_dir = "temp_det_results/"
-        self.to_eval_format(file_path, temp_dir, self._text_eval_confidence)
-        result_path, result_path_full = self.sort_detection(temp_dir)
+        # the detections go to the official code in memory, without temp files or zips
+        det_lines = self.to_eval_format(coco_results, self._text_eval_confidence)
+        result_path, result_path_full = self.sort_detection(det_lines)
         text_result = self.evaluate_with_official_code(result_path, self._text_eval_gt_path) # None 
         text_result["e2e_method"] = "None-" + text_result["e2e_method"]
         dict_lexicon = {"1": "Generic", "2": "Weak", "3": "Strong"}
         text_result_full = self.evaluate_with_official_code(result_path_full, self._text_eval_gt_path) # with lexicon
         text_result_full["e2e_method"] = dict_lexicon[str(self.lexicon_type)] + "-" + text_result_full["e2e_method"]
-        os.remove(result_path)
-        os.remove(result_path_full)
         # parse
         template = "(\S+): (\S+): (\S+), (\S+): (\S+), (\S+): (\S+)"
         result = text_result["det_only_method"]
@@ -13,7 +13,7 @@ from detectron2.modeling.matcher import Matcher
 from fvcore.nn import sigmoid_focal_loss_jit
 
 from adet.utils.comm import reduce_sum
-from adet.layers import ml_nms
+from adet.modeling.fcos.postprocessing import fcos_postprocess
 
 
 logger = logging.getLogger(__name__)
@@ -520,27 +520,16 @@ class MEInstOutputs(object):
         )
 
     def predict_proposals(self):
-        sampled_boxes = []
-
-        bundle = (
+        boxlists = fcos_postprocess(
             self.locations, self.logits_pred,
-            self.reg_pred, self.ctrness_pred,
-            self.strides, self.mask_regression
-        )
-
-        for i, (l, o, r, c, s, mr) in enumerate(zip(*bundle)):
             # recall that during training, we normalize regression targets with FPN's stride.
             # we denormalize them here.
-            r = r * s
-            sampled_boxes.append(
-                self.forward_for_single_feature_map(
-                    l, o, r, c, mr, self.image_sizes
-                )
-            )
-
-        boxlists = list(zip(*sampled_boxes))
-        boxlists = [Instances.cat(boxlist) for boxlist in boxlists]
-        boxlists = self.select_over_all_levels(boxlists)
+            [r * s for r, s in zip(self.reg_pred, self.strides)],
+            self.ctrness_pred, self.image_sizes,
+            self.pre_nms_thresh, self.pre_nms_top_n, self.fpn_post_nms_top_n,
+            self.nms_thresh, self.thresh_with_ctr,
+            extra_fields={"pred_masks": self.mask_regression}
+        )
 
         num_images = len(boxlists)
         for i in range(num_images):
@@ -550,96 +539,3 @@ class MEInstOutputs(object):
             boxlists[i].pred_masks = per_image_masks
 
         return boxlists
-
-    def forward_for_single_feature_map(
-            self, locations, box_cls,
-            reg_pred, ctrness, mask_regression, image_sizes
-    ):
-        N, C, H, W = box_cls.shape
-
-        # put in the same format as locations
-        box_cls = box_cls.view(N, C, H, W).permute(0, 2, 3, 1)
-        box_cls = box_cls.reshape(N, -1, C).sigmoid()
-        box_regression = reg_pred.view(N, 4, H, W).permute(0, 2, 3, 1)
-        box_regression = box_regression.reshape(N, -1, 4)
-        ctrness = ctrness.view(N, 1, H, W).permute(0, 2, 3, 1)
-        ctrness = ctrness.reshape(N, -1).sigmoid()
-        mask_regression = mask_regression.view(N, self.dim_mask, H, W).permute(0, 2, 3, 1)
-        mask_regression = mask_regression.reshape(N, -1, self.dim_mask)
-
-        # if self.thresh_with_ctr is True, we multiply the classification
-        # scores with centerness scores before applying the threshold.
-        if self.thresh_with_ctr:
-            box_cls = box_cls * ctrness[:, :, None]
-        candidate_inds = box_cls > self.pre_nms_thresh
-        pre_nms_top_n = candidate_inds.view(N, -1).sum(1)
-        pre_nms_top_n = pre_nms_top_n.clamp(max=self.pre_nms_top_n)
-
-        if not self.thresh_with_ctr:
-            box_cls = box_cls * ctrness[:, :, None]
-
-        results = []
-        for i in range(N):
-            per_box_cls = box_cls[i]
-            per_candidate_inds = candidate_inds[i]
-            per_box_cls = per_box_cls[per_candidate_inds]
-
-            per_candidate_nonzeros = per_candidate_inds.nonzero()
-            per_box_loc = per_candidate_nonzeros[:, 0]
-            per_class = per_candidate_nonzeros[:, 1]
-
-            per_box_regression = box_regression[i]
-            per_box_regression = per_box_regression[per_box_loc]
-            per_locations = locations[per_box_loc]
-
-            per_box_mask = mask_regression[i]
-            per_box_mask = per_box_mask[per_box_loc]
-
-            per_pre_nms_top_n = pre_nms_top_n[i]
-
-            if per_candidate_inds.sum().item() > per_pre_nms_top_n.item():
-                per_box_cls, top_k_indices = \
-                    per_box_cls.topk(per_pre_nms_top_n, sorted=False)
-                per_class = per_class[top_k_indices]
-                per_box_regression = per_box_regression[top_k_indices]
-                per_locations = per_locations[top_k_indices]
-                per_box_mask = per_box_mask[top_k_indices]
-
-            detections = torch.stack([
-                per_locations[:, 0] - per_box_regression[:, 0],
-                per_locations[:, 1] - per_box_regression[:, 1],
-                per_locations[:, 0] + per_box_regression[:, 2],
-                per_locations[:, 1] + per_box_regression[:, 3],
-            ], dim=1)
-
-            boxlist = Instances(image_sizes[i])
-            boxlist.pred_boxes = Boxes(detections)
-            boxlist.scores = torch.sqrt(per_box_cls)
-            boxlist.pred_classes = per_class
-            boxlist.locations = per_locations
-            boxlist.pred_masks = per_box_mask
-
-            results.append(boxlist)
-
-        return results
-
-    def select_over_all_levels(self, boxlists):
-        num_images = len(boxlists)
-        results = []
-        for i in range(num_images):
-            # multiclass nms
-            result = ml_nms(boxlists[i], self.nms_thresh)
-            number_of_detections = len(result)
-
-            # Limit to max_per_image detections **over all classes**
-            if number_of_detections > self.fpn_post_nms_top_n > 0:
-                cls_scores = result.scores
-                image_thresh, _ = torch.kthvalue(
-                    cls_scores.cpu(),
-                    number_of_detections - self.fpn_post_nms_top_n + 1
-                )
-                keep = cls_scores >= image_thresh.item()
-                keep = torch.nonzero(keep).squeeze(1)
-                result = result[keep]
-            results.append(result)
-        return results
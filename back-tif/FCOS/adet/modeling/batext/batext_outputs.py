@@ -3,12 +3,11 @@ import torch
 import torch.nn.functional as F
 
 from detectron2.layers import cat
-from detectron2.structures import Instances, Boxes
 from adet.utils.comm import get_world_size
 from fvcore.nn import sigmoid_focal_loss_jit
 
 from adet.utils.comm import reduce_sum, compute_ious
-from adet.layers import ml_nms
+from adet.modeling.fcos.postprocessing import fcos_postprocess
 
 
 logger = logging.getLogger(__name__)
@@ -399,134 +398,25 @@ class BATextOutputs(object):
         )
 
     def predict_proposals(self, top_feats):
-        sampled_boxes = []
-
-        bundle = {
-            "l": self.locations, "o": self.logits_pred,
-            "r": self.reg_pred, "c": self.ctrness_pred,
-            "s": self.strides,
-        }
-
+        # recall that during training, we normalize regression targets with FPN's stride.
+        # we denormalize them here.
+        extra_fields = None
         if len(top_feats) > 0:
-            bundle["t"] = top_feats
-
-        for i, instance in enumerate(zip(*bundle.values())):
-            instance_dict = dict(zip(bundle.keys(), instance))
-            # recall that during training, we normalize regression targets with FPN's stride.
-            # we denormalize them here.
-            l = instance_dict["l"]
-            o = instance_dict["o"]
-            r = instance_dict["r"] * instance_dict["s"]
-            c = instance_dict["c"]
             # top_feat is the bezier regression
-            t = instance_dict["t"] * instance_dict["s"] if "t" in bundle else None
-
-            sampled_boxes.append(
-                self.forward_for_single_feature_map(
-                    l, o, r, c, self.image_sizes, t
-                )
-            )
+            extra_fields = {"top_feat": [t * s for t, s in zip(top_feats, self.strides)]}
+
+        boxlists = fcos_postprocess(
+            self.locations, self.logits_pred,
+            [r * s for r, s in zip(self.reg_pred, self.strides)],
+            self.ctrness_pred, self.image_sizes,
+            self.pre_nms_thresh, self.pre_nms_top_n, self.fpn_post_nms_top_n,
+            self.nms_thresh, self.thresh_with_ctr,
+            extra_fields=extra_fields
+        )
 
-        boxlists = list(zip(*sampled_boxes))
-        boxlists = [Instances.cat(boxlist) for boxlist in boxlists]
-        boxlists = self.select_over_all_levels(boxlists)
+        if extra_fields is not None:
+            for boxlist in boxlists:
+                # decentralize the bezier offsets
+                bezier_detections = boxlist.locations.unsqueeze(1) + boxlist.top_feat.view(-1, 8, 2)
+                boxlist.top_feat = bezier_detections.view(-1, 16)
         return boxlists
-
-    def forward_for_single_feature_map(
-            self, locations, box_cls,
-            reg_pred, ctrness,
-            image_sizes, top_feat=None):
-        N, C, H, W = box_cls.shape
-
-        # put in the same format as locations
-        box_cls = box_cls.view(N, C, H, W).permute(0, 2, 3, 1)
-        box_cls = box_cls.reshape(N, -1, C).sigmoid()
-        box_regression = reg_pred.view(N, 4, H, W).permute(0, 2, 3, 1)
-        box_regression = box_regression.reshape(N, -1, 4)
-        ctrness = ctrness.view(N, 1, H, W).permute(0, 2, 3, 1)
-        ctrness = ctrness.reshape(N, -1).sigmoid()
-        if top_feat is not None:
-            top_feat = top_feat.view(N, -1, H, W).permute(0, 2, 3, 1)
-            top_feat = top_feat.reshape(N, H * W, -1)
-
-        # if self.thresh_with_ctr is True, we multiply the classification
-        # scores with centerness scores before applying the threshold.
-        if self.thresh_with_ctr:
-            box_cls = box_cls * ctrness[:, :, None]
-        candidate_inds = box_cls > self.pre_nms_thresh
-        pre_nms_top_n = candidate_inds.view(N, -1).sum(1)
-        pre_nms_top_n = pre_nms_top_n.clamp(max=self.pre_nms_top_n)
-
-        if not self.thresh_with_ctr:
-            box_cls = box_cls * ctrness[:, :, None]
-
-        results = []
-        for i in range(N):
-            per_box_cls = box_cls[i]
-            per_candidate_inds = candidate_inds[i]
-            per_box_cls = per_box_cls[per_candidate_inds]
-
-            per_candidate_nonzeros = per_candidate_inds.nonzero()
-            per_box_loc = per_candidate_nonzeros[:, 0]
-            per_class = per_candidate_nonzeros[:, 1]
-
-            per_box_regression = box_regression[i]
-            per_box_regression = per_box_regression[per_box_loc]
-            per_locations = locations[per_box_loc]
-            if top_feat is not None:
-                per_top_feat = top_feat[i]
-                per_top_feat = per_top_feat[per_box_loc]
-
-            per_pre_nms_top_n = pre_nms_top_n[i]
-
-            if per_candidate_inds.sum().item() > per_pre_nms_top_n.item():
-                per_box_cls, top_k_indices = \
-                    per_box_cls.topk(per_pre_nms_top_n, sorted=False)
-                per_class = per_class[top_k_indices]
-                per_box_regression = per_box_regression[top_k_indices]
-                per_locations = per_locations[top_k_indices]
-                if top_feat is not None:
-                    per_top_feat = per_top_feat[top_k_indices]
-
-            detections = torch.stack([
-                per_locations[:, 0] - per_box_regression[:, 0],
-                per_locations[:, 1] - per_box_regression[:, 1],
-                per_locations[:, 0] + per_box_regression[:, 2],
-                per_locations[:, 1] + per_box_regression[:, 3],
-            ], dim=1)
-
-            boxlist = Instances(image_sizes[i])
-            boxlist.pred_boxes = Boxes(detections)
-            boxlist.scores = torch.sqrt(per_box_cls)
-            boxlist.pred_classes = per_class
-            boxlist.locations = per_locations
-            if top_feat is not None:
-                # top_feat in batext is bezier regression
-                # decentralize
-                bezier_detections = per_locations.unsqueeze(1) + per_top_feat.view(-1, 8, 2) 
-                bezier_detections = bezier_detections.view(-1, 16)
-                boxlist.top_feat = bezier_detections
-            results.append(boxlist)
-
-        return results
-
-    def select_over_all_levels(self, boxlists):
-        num_images = len(boxlists)
-        results = []
-        for i in range(num_images):
-            # multiclass nms
-            result = ml_nms(boxlists[i], self.nms_thresh)
-            number_of_detections = len(result)
-
-            # Limit to max_per_image detections **over all classes**
-            if number_of_detections > self.fpn_post_nms_top_n > 0:
-                cls_scores = result.scores
-                image_thresh, _ = torch.kthvalue(
-                    cls_scores.cpu(),
-                    number_of_detections - self.fpn_post_nms_top_n + 1
-                )
-                keep = cls_scores >= image_thresh.item()
-                keep = torch.nonzero(keep).squeeze(1)
-                result = result[keep]
-            results.append(result)
-        return results
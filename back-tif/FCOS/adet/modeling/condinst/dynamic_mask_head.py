@@ -99,6 +99,7 @@ class DynamicMaskHead(nn.Module):
         self.in_channels = cfg.MODEL.CONDINST.MASK_BRANCH.OUT_CHANNELS
         self.mask_out_stride = cfg.MODEL.CONDINST.MASK_OUT_STRIDE
         self.disable_rel_coords = cfg.MODEL.CONDINST.MASK_HEAD.DISABLE_REL_COORDS
+        self.inference_chunk_size = cfg.MODEL.CONDINST.MASK_HEAD.INFERENCE_CHUNK_SIZE
 
         soi = cfg.MODEL.FCOS.SIZES_OF_INTEREST
         self.register_buffer("sizes_of_interest", torch.tensor(soi + [soi[-1] * 2]))
@@ -197,6 +198,62 @@ class DynamicMaskHead(nn.Module):
 
         return mask_logits
 
+    def mask_heads_forward_chunked(
+            self, mask_feats, mask_feat_stride, instances, chunk_size
+    ):
+        """
+        Same output as `mask_heads_forward_with_coords`, with a peak memory bounded by
+        `chunk_size` instead of the number of instances.
+
+        The relative coordinates are never materialized: for an instance at (cx, cy),
+        the first layer applies w_x * (cx - x) / soi + w_y * (cy - y) / soi, which is a
+        per-instance bias (w_x * cx + w_y * cy) / soi plus a term separable in x and y.
+        """
+        N, _, H, W = mask_feats.size()
+        locations = compute_locations(
+            H, W, stride=mask_feat_stride, device=mask_feats.device
+        ).to(dtype=mask_feats.dtype)
+        # the location grid is separable: x only depends on the column, y on the row
+        xs = locations[:W, 0].reshape(1, 1, 1, W)
+        ys = locations[::W, 1].reshape(1, 1, H, 1)
+
+        assert mask_feat_stride >= self.mask_out_stride
+        assert mask_feat_stride % self.mask_out_stride == 0
+        factor = int(mask_feat_stride / self.mask_out_stride)
+
+        mask_logits = []
+        for start in range(0, len(instances), chunk_size):
+            end = start + chunk_size
+            im_inds = instances.im_inds[start:end]
+            n_inst = len(im_inds)
+
+            weights, biases = parse_dynamic_params(
+                instances.mask_head_params[start:end], self.channels,
+                self.weight_nums, self.bias_nums
+            )
+            out_channels = weights[0].size(0) // n_inst
+
+            if not self.disable_rel_coords:
+                w0 = weights[0].reshape(n_inst, out_channels, self.in_channels + 2)
+                soi = self.sizes_of_interest[instances.fpn_levels[start:end]]
+                w_coords = w0[:, :, :2] / soi.to(dtype=w0.dtype).reshape(-1, 1, 1)
+                inst_locations = instances.locations[start:end].to(dtype=w0.dtype)
+                coord_bias = (w_coords * inst_locations.reshape(-1, 1, 2)).sum(dim=2)
+                weights[0] = w0[:, :, 2:].reshape(n_inst * out_channels, self.in_channels, 1, 1)
+                biases[0] = biases[0] + coord_bias.reshape(-1)
+
+            x = mask_feats[im_inds].reshape(1, -1, H, W)
+            x = F.conv2d(x, weights[0], bias=biases[0], groups=n_inst)
+            if not self.disable_rel_coords:
+                x = x - w_coords[:, :, 0].reshape(1, -1, 1, 1) * xs
+                x = x - w_coords[:, :, 1].reshape(1, -1, 1, 1) * ys
+            if len(weights) > 1:
+                x = self.mask_heads_forward(F.relu(x), weights[1:], biases[1:], n_inst)
+
+            mask_logits.append(aligned_bilinear(x.reshape(-1, 1, H, W), factor))
+
+        return torch.cat(mask_logits, dim=0)
+
     def __call__(self, mask_feats, mask_feat_stride, pred_instances, gt_instances=None):
         if self.training:
             self._iter += 1
@@ -251,9 +308,15 @@ class DynamicMaskHead(nn.Module):
             return losses
         else:
             if len(pred_instances) > 0:
-                mask_logits = self.mask_heads_forward_with_coords(
-                    mask_feats, mask_feat_stride, pred_instances
-                )
+                if self.inference_chunk_size > 0:
+                    mask_logits = self.mask_heads_forward_chunked(
+                        mask_feats, mask_feat_stride, pred_instances,
+                        self.inference_chunk_size
+                    )
+                else:
+                    mask_logits = self.mask_heads_forward_with_coords(
+                        mask_feats, mask_feat_stride, pred_instances
+                    )
                 pred_instances.pred_global_masks = mask_logits.sigmoid()
 
             return pred_instances
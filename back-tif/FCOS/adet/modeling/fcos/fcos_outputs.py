@@ -4,12 +4,14 @@ from torch import nn
 import torch.nn.functional as F
 
 from detectron2.layers import cat
-from detectron2.structures import Instances, Boxes
+from detectron2.structures import Instances
 from detectron2.utils.comm import get_world_size
 from fvcore.nn import sigmoid_focal_loss_jit
 
 from adet.utils.comm import reduce_sum, reduce_mean, compute_ious
-from adet.layers import ml_nms, IOULoss
+from adet.layers import IOULoss
+
+from .postprocessing import fcos_postprocess
 
 
 logger = logging.getLogger(__name__)
@@ -95,62 +97,54 @@ class FCOSOutputs(nn.Module):
     def _transpose(self, training_targets, num_loc_list):
         '''
         This function is used to transpose image first training targets to level first ones
-        :return: level first training targets
+        :param training_targets: (N, K, ...) image first training targets
+        :return: level first training targets, a (N * Hi * Wi, ...) tensor per level
         '''
-        for im_i in range(len(training_targets)):
-            training_targets[im_i] = torch.split(
-                training_targets[im_i], num_loc_list, dim=0
-            )
-
-        targets_level_first = []
-        for targets_per_level in zip(*training_targets):
-            targets_level_first.append(
-                torch.cat(targets_per_level, dim=0)
-            )
-        return targets_level_first
+        return [
+            targets_per_level.reshape(-1, *targets_per_level.shape[2:])
+            for targets_per_level in training_targets.split(num_loc_list, dim=1)
+        ]
 
     def _get_ground_truth(self, locations, gt_instances):
         num_loc_list = [len(loc) for loc in locations]
+        num_images = len(gt_instances)
 
-        # compute locations to size ranges
-        loc_to_size_range = []
-        for l, loc_per_level in enumerate(locations):
-            loc_to_size_range_per_level = loc_per_level.new_tensor(self.sizes_of_interest[l])
-            loc_to_size_range.append(
-                loc_to_size_range_per_level[None].expand(num_loc_list[l], -1)
-            )
-
-        loc_to_size_range = torch.cat(loc_to_size_range, dim=0)
+        # level of every location, to look up the per-level parameters
+        loc_levels = torch.cat([
+            loc.new_full((len(loc),), level, dtype=torch.long)
+            for level, loc in enumerate(locations)
+        ])
         locations = torch.cat(locations, dim=0)
 
         training_targets = self.compute_targets_for_locations(
-            locations, gt_instances, loc_to_size_range, num_loc_list
+            locations, gt_instances, loc_levels
         )
 
-        training_targets["locations"] = [locations.clone() for _ in range(len(gt_instances))]
-        training_targets["im_inds"] = [
-            locations.new_ones(locations.size(0), dtype=torch.long) * i for i in range(len(gt_instances))
-        ]
+        training_targets["locations"] = locations[None].expand(num_images, -1, -1)
+        training_targets["im_inds"] = torch.arange(
+            num_images, device=locations.device
+        )[:, None].expand(-1, len(locations))
+        training_targets["fpn_levels"] = loc_levels[None].expand(num_images, -1)
+
+        # we normalize reg_targets by FPN's strides here
+        strides = locations.new_tensor(self.strides)[loc_levels]
+        training_targets["reg_targets"] = training_targets["reg_targets"] / strides[None, :, None]
 
         # transpose im first training_targets to level first ones
         training_targets = {
             k: self._transpose(v, num_loc_list) for k, v in training_targets.items()
         }
 
-        training_targets["fpn_levels"] = [
-            loc.new_ones(len(loc), dtype=torch.long) * level
-            for level, loc in enumerate(training_targets["locations"])
-        ]
-
-        # we normalize reg_targets by FPN's strides here
-        reg_targets = training_targets["reg_targets"]
-        for l in range(len(reg_targets)):
-            reg_targets[l] = reg_targets[l] / float(self.strides[l])
-
         return training_targets
 
-    def get_sample_region(self, boxes, strides, num_loc_list, loc_xs, loc_ys, bitmasks=None, radius=1):
-        if bitmasks is not None:
+    @staticmethod
+    def _gt_centers(targets_per_im):
+        """
+        Centers used for center sampling: the center of mass of the masks when they are
+        available (CondInst), else the box centers.
+        """
+        if targets_per_im.has("gt_bitmasks_full"):
+            bitmasks = targets_per_im.gt_bitmasks_full
             _, h, w = bitmasks.size()
 
             ys = torch.arange(0, h, dtype=torch.float32, device=bitmasks.device)
@@ -159,106 +153,115 @@ class FCOSOutputs(nn.Module):
             m00 = bitmasks.sum(dim=-1).sum(dim=-1).clamp(min=1e-6)
             m10 = (bitmasks * xs).sum(dim=-1).sum(dim=-1)
             m01 = (bitmasks * ys[:, None]).sum(dim=-1).sum(dim=-1)
-            center_x = m10 / m00
-            center_y = m01 / m00
-        else:
-            center_x = boxes[..., [0, 2]].sum(dim=-1) * 0.5
-            center_y = boxes[..., [1, 3]].sum(dim=-1) * 0.5
-
-        num_gts = boxes.shape[0]
-        K = len(loc_xs)
-        boxes = boxes[None].expand(K, num_gts, 4)
-        center_x = center_x[None].expand(K, num_gts)
-        center_y = center_y[None].expand(K, num_gts)
-        center_gt = boxes.new_zeros(boxes.shape)
-        # no gt
-        if center_x.numel() == 0 or center_x[..., 0].sum() == 0:
-            return loc_xs.new_zeros(loc_xs.shape, dtype=torch.uint8)
-        beg = 0
-        for level, num_loc in enumerate(num_loc_list):
-            end = beg + num_loc
-            stride = strides[level] * radius
-            xmin = center_x[beg:end] - stride
-            ymin = center_y[beg:end] - stride
-            xmax = center_x[beg:end] + stride
-            ymax = center_y[beg:end] + stride
-            # limit sample region in gt
-            center_gt[beg:end, :, 0] = torch.where(xmin > boxes[beg:end, :, 0], xmin, boxes[beg:end, :, 0])
-            center_gt[beg:end, :, 1] = torch.where(ymin > boxes[beg:end, :, 1], ymin, boxes[beg:end, :, 1])
-            center_gt[beg:end, :, 2] = torch.where(xmax > boxes[beg:end, :, 2], boxes[beg:end, :, 2], xmax)
-            center_gt[beg:end, :, 3] = torch.where(ymax > boxes[beg:end, :, 3], boxes[beg:end, :, 3], ymax)
-            beg = end
-        left = loc_xs[:, None] - center_gt[..., 0]
-        right = center_gt[..., 2] - loc_xs[:, None]
-        top = loc_ys[:, None] - center_gt[..., 1]
-        bottom = center_gt[..., 3] - loc_ys[:, None]
-        center_bbox = torch.stack((left, top, right, bottom), -1)
-        inside_gt_bbox_mask = center_bbox.min(-1)[0] > 0
-        return inside_gt_bbox_mask
-
-    def compute_targets_for_locations(self, locations, targets, size_ranges, num_loc_list):
-        labels = []
-        reg_targets = []
-        target_inds = []
-        xs, ys = locations[:, 0], locations[:, 1]
-
-        num_targets = 0
-        for im_i in range(len(targets)):
-            targets_per_im = targets[im_i]
-            bboxes = targets_per_im.gt_boxes.tensor
-            labels_per_im = targets_per_im.gt_classes
+            return torch.stack([m10 / m00, m01 / m00], dim=1)
 
-            # no gt
-            if bboxes.numel() == 0:
-                labels.append(labels_per_im.new_zeros(locations.size(0)) + self.num_classes)
-                reg_targets.append(locations.new_zeros((locations.size(0), 4)))
-                target_inds.append(labels_per_im.new_zeros(locations.size(0)) - 1)
-                continue
+        boxes = targets_per_im.gt_boxes.tensor
+        return torch.stack([
+            boxes[:, [0, 2]].sum(dim=-1) * 0.5,
+            boxes[:, [1, 3]].sum(dim=-1) * 0.5,
+        ], dim=1)
 
-            area = targets_per_im.gt_boxes.area()
+    def compute_targets_for_locations(self, locations, targets, loc_levels):
+        """
+        Assign every location of every image to a ground-truth box, for all the images
+        at once.
 
-            l = xs[:, None] - bboxes[:, 0][None]
-            t = ys[:, None] - bboxes[:, 1][None]
-            r = bboxes[:, 2][None] - xs[:, None]
-            b = bboxes[:, 3][None] - ys[:, None]
-            reg_targets_per_im = torch.stack([l, t, r, b], dim=2)
+        The ground truths are padded to (N, G) tensors, padded entries having an
+        infinite area so that they are never chosen. The center sampling radius and the
+        size range of a location come from a lookup on its level. The regression
+        targets are only built for the assigned box, so the (N, K, G) intermediates
+        hold one value per (location, gt) pair instead of 4-vectors.
 
+        Returns:
+            dict[str, Tensor]: "labels", "reg_targets" and "target_inds", as (N, K) or
+            (N, K, 4) tensors.
+        """
+        num_images = len(targets)
+        num_gts = [len(targets_per_im) for targets_per_im in targets]
+        max_gts = max(num_gts, default=0)
+        K = len(locations)
+
+        if max_gts == 0:
+            # no gt
+            return {
+                "labels": loc_levels.new_full((num_images, K), self.num_classes),
+                "reg_targets": locations.new_zeros((num_images, K, 4)),
+                "target_inds": loc_levels.new_full((num_images, K), -1),
+            }
+
+        # padded ground truths
+        boxes = locations.new_zeros((num_images, max_gts, 4))
+        classes = loc_levels.new_full((num_images, max_gts), self.num_classes)
+        areas = locations.new_full((num_images, max_gts), INF)
+        centers = locations.new_zeros((num_images, max_gts, 2))
+        for im_i, targets_per_im in enumerate(targets):
+            n = num_gts[im_i]
+            if n == 0:
+                continue
+            boxes[im_i, :n] = targets_per_im.gt_boxes.tensor
+            classes[im_i, :n] = targets_per_im.gt_classes
+            areas[im_i, :n] = targets_per_im.gt_boxes.area()
             if self.center_sample:
-                if targets_per_im.has("gt_bitmasks_full"):
-                    bitmasks = targets_per_im.gt_bitmasks_full
-                else:
-                    bitmasks = None
-                is_in_boxes = self.get_sample_region(
-                    bboxes, self.strides, num_loc_list, xs, ys,
-                    bitmasks=bitmasks, radius=self.radius
-                )
-            else:
-                is_in_boxes = reg_targets_per_im.min(dim=2)[0] > 0
-
-            max_reg_targets_per_im = reg_targets_per_im.max(dim=2)[0]
-            # limit the regression range for each location
-            is_cared_in_the_level = \
-                (max_reg_targets_per_im >= size_ranges[:, [0]]) & \
-                (max_reg_targets_per_im <= size_ranges[:, [1]])
-
-            locations_to_gt_area = area[None].repeat(len(locations), 1)
-            locations_to_gt_area[is_in_boxes == 0] = INF
-            locations_to_gt_area[is_cared_in_the_level == 0] = INF
-
-            # if there are still more than one objects for a location,
-            # we choose the one with minimal area
-            locations_to_min_area, locations_to_gt_inds = locations_to_gt_area.min(dim=1)
-
-            reg_targets_per_im = reg_targets_per_im[range(len(locations)), locations_to_gt_inds]
-            target_inds_per_im = locations_to_gt_inds + num_targets
-            num_targets += len(targets_per_im)
-
-            labels_per_im = labels_per_im[locations_to_gt_inds]
-            labels_per_im[locations_to_min_area == INF] = self.num_classes
-
-            labels.append(labels_per_im)
-            reg_targets.append(reg_targets_per_im)
-            target_inds.append(target_inds_per_im)
+                centers[im_i, :n] = self._gt_centers(targets_per_im)
+
+        # (1, K, 1) locations against (N, 1, G) boxes
+        xs = locations[None, :, 0, None]
+        ys = locations[None, :, 1, None]
+        x0, y0, x1, y1 = boxes[:, None].unbind(dim=-1)
+
+        # max (and min) of the (l, t, r, b) distances, without keeping all four
+        max_reg_targets = torch.max(xs - x0, ys - y0)
+        max_reg_targets = torch.max(max_reg_targets, x1 - xs)
+        max_reg_targets = torch.max(max_reg_targets, y1 - ys)
+
+        if self.center_sample:
+            radius = (locations.new_tensor(self.strides)[loc_levels] * self.radius)[None, :, None]
+            center_x = centers[:, None, :, 0]
+            center_y = centers[:, None, :, 1]
+            # sample region: the box around the center, limited to the gt box
+            is_in_boxes = \
+                (xs > torch.max(center_x - radius, x0)) & \
+                (xs < torch.min(center_x + radius, x1)) & \
+                (ys > torch.max(center_y - radius, y0)) & \
+                (ys < torch.min(center_y + radius, y1))
+        else:
+            min_reg_targets = torch.min(xs - x0, ys - y0)
+            min_reg_targets = torch.min(min_reg_targets, x1 - xs)
+            is_in_boxes = torch.min(min_reg_targets, y1 - ys) > 0
+
+        # limit the regression range for each location
+        size_ranges = locations.new_tensor(self.sizes_of_interest)[loc_levels]
+        is_cared_in_the_level = \
+            (max_reg_targets >= size_ranges[None, :, 0, None]) & \
+            (max_reg_targets <= size_ranges[None, :, 1, None])
+
+        locations_to_gt_area = torch.where(
+            is_in_boxes & is_cared_in_the_level, areas[:, None], areas.new_full((), INF)
+        )
+
+        # if there are still more than one objects for a location,
+        # we choose the one with minimal area
+        locations_to_min_area, locations_to_gt_inds = locations_to_gt_area.min(dim=2)
+
+        gt_boxes = boxes.gather(1, locations_to_gt_inds[..., None].expand(-1, -1, 4))
+        reg_targets = torch.stack([
+            locations[None, :, 0] - gt_boxes[..., 0],
+            locations[None, :, 1] - gt_boxes[..., 1],
+            gt_boxes[..., 2] - locations[None, :, 0],
+            gt_boxes[..., 3] - locations[None, :, 1],
+        ], dim=2)
+
+        labels = classes.gather(1, locations_to_gt_inds)
+        labels = torch.where(
+            locations_to_min_area == INF, torch.full_like(labels, self.num_classes), labels
+        )
+
+        # indices into the gt instances of the whole batch; -1 for images without gt
+        num_gts = loc_levels.new_tensor(num_gts)
+        has_gt = (num_gts > 0)[:, None]
+        target_inds = locations_to_gt_inds + (num_gts.cumsum(0) - num_gts)[:, None]
+        target_inds = torch.where(has_gt, target_inds, torch.full_like(target_inds, -1))
+        reg_targets = torch.where(has_gt[..., None], reg_targets, torch.zeros_like(reg_targets))
 
         return {
             "labels": labels,
@@ -415,136 +418,13 @@ class FCOSOutputs(nn.Module):
             self.pre_nms_topk = self.pre_nms_topk_test
             self.post_nms_topk = self.post_nms_topk_test
 
-        sampled_boxes = []
-
-        bundle = {
-            "l": locations, "o": logits_pred,
-            "r": reg_pred, "c": ctrness_pred,
-            "s": self.strides,
-        }
-
-        if len(top_feats) > 0:
-            bundle["t"] = top_feats
-
-        for i, per_bundle in enumerate(zip(*bundle.values())):
-            # get per-level bundle
-            per_bundle = dict(zip(bundle.keys(), per_bundle))
+        return fcos_postprocess(
+            locations, logits_pred,
             # recall that during training, we normalize regression targets with FPN's stride.
             # we denormalize them here.
-            l = per_bundle["l"]
-            o = per_bundle["o"]
-            r = per_bundle["r"] * per_bundle["s"]
-            c = per_bundle["c"]
-            t = per_bundle["t"] if "t" in bundle else None
-
-            sampled_boxes.append(
-                self.forward_for_single_feature_map(
-                    l, o, r, c, image_sizes, t
-                )
-            )
-
-            for per_im_sampled_boxes in sampled_boxes[-1]:
-                per_im_sampled_boxes.fpn_levels = l.new_ones(
-                    len(per_im_sampled_boxes), dtype=torch.long
-                ) * i
-
-        boxlists = list(zip(*sampled_boxes))
-        boxlists = [Instances.cat(boxlist) for boxlist in boxlists]
-        boxlists = self.select_over_all_levels(boxlists)
-
-        return boxlists
-
-    def forward_for_single_feature_map(
-            self, locations, logits_pred, reg_pred,
-            ctrness_pred, image_sizes, top_feat=None
-    ):
-        N, C, H, W = logits_pred.shape
-
-        # put in the same format as locations
-        logits_pred = logits_pred.view(N, C, H, W).permute(0, 2, 3, 1)
-        logits_pred = logits_pred.reshape(N, -1, C).sigmoid()
-        box_regression = reg_pred.view(N, 4, H, W).permute(0, 2, 3, 1)
-        box_regression = box_regression.reshape(N, -1, 4)
-        ctrness_pred = ctrness_pred.view(N, 1, H, W).permute(0, 2, 3, 1)
-        ctrness_pred = ctrness_pred.reshape(N, -1).sigmoid()
-        if top_feat is not None:
-            top_feat = top_feat.view(N, -1, H, W).permute(0, 2, 3, 1)
-            top_feat = top_feat.reshape(N, H * W, -1)
-
-        # if self.thresh_with_ctr is True, we multiply the classification
-        # scores with centerness scores before applying the threshold.
-        if self.thresh_with_ctr:
-            logits_pred = logits_pred * ctrness_pred[:, :, None]
-        candidate_inds = logits_pred > self.pre_nms_thresh
-        pre_nms_top_n = candidate_inds.reshape(N, -1).sum(1)
-        pre_nms_top_n = pre_nms_top_n.clamp(max=self.pre_nms_topk)
-
-        if not self.thresh_with_ctr:
-            logits_pred = logits_pred * ctrness_pred[:, :, None]
-
-        results = []
-        for i in range(N):
-            per_box_cls = logits_pred[i]
-            per_candidate_inds = candidate_inds[i]
-            per_box_cls = per_box_cls[per_candidate_inds]
-
-            per_candidate_nonzeros = per_candidate_inds.nonzero()
-            per_box_loc = per_candidate_nonzeros[:, 0]
-            per_class = per_candidate_nonzeros[:, 1]
-
-            per_box_regression = box_regression[i]
-            per_box_regression = per_box_regression[per_box_loc]
-            per_locations = locations[per_box_loc]
-            if top_feat is not None:
-                per_top_feat = top_feat[i]
-                per_top_feat = per_top_feat[per_box_loc]
-
-            per_pre_nms_top_n = pre_nms_top_n[i]
-
-            if per_candidate_inds.sum().item() > per_pre_nms_top_n.item():
-                per_box_cls, top_k_indices = \
-                    per_box_cls.topk(per_pre_nms_top_n, sorted=False)
-                per_class = per_class[top_k_indices]
-                per_box_regression = per_box_regression[top_k_indices]
-                per_locations = per_locations[top_k_indices]
-                if top_feat is not None:
-                    per_top_feat = per_top_feat[top_k_indices]
-
-            detections = torch.stack([
-                per_locations[:, 0] - per_box_regression[:, 0],
-                per_locations[:, 1] - per_box_regression[:, 1],
-                per_locations[:, 0] + per_box_regression[:, 2],
-                per_locations[:, 1] + per_box_regression[:, 3],
-            ], dim=1)
-
-            boxlist = Instances(image_sizes[i])
-            boxlist.pred_boxes = Boxes(detections)
-            boxlist.scores = torch.sqrt(per_box_cls)
-            boxlist.pred_classes = per_class
-            boxlist.locations = per_locations
-            if top_feat is not None:
-                boxlist.top_feat = per_top_feat
-            results.append(boxlist)
-
-        return results
-
-    def select_over_all_levels(self, boxlists):
-        num_images = len(boxlists)
-        results = []
-        for i in range(num_images):
-            # multiclass nms
-            result = ml_nms(boxlists[i], self.nms_thresh)
-            number_of_detections = len(result)
-
-            # Limit to max_per_image detections **over all classes**
-            if number_of_detections > self.post_nms_topk > 0:
-                cls_scores = result.scores
-                image_thresh, _ = torch.kthvalue(
-                    cls_scores.cpu(),
-                    number_of_detections - self.post_nms_topk + 1
-                )
-                keep = cls_scores >= image_thresh.item()
-                keep = torch.nonzero(keep).squeeze(1)
-                result = result[keep]
-            results.append(result)
-        return results
+            [r * s for r, s in zip(reg_pred, self.strides)],
+            ctrness_pred, image_sizes,
+            self.pre_nms_thresh, self.pre_nms_topk, self.post_nms_topk,
+            self.nms_thresh, self.thresh_with_ctr,
+            extra_fields={"top_feat": top_feats} if len(top_feats) > 0 else None
+        )
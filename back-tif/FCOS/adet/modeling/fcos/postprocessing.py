@@ -0,0 +1,155 @@
+import torch
+import torch.nn.functional as F
+
+from detectron2.layers import batched_nms
+from detectron2.structures import Instances, Boxes
+
+"""
+Shared inference postprocessing of the FCOS family (FCOS, MEInst, BAText).
+
+Shape shorthand in this module:
+
+    N: number of images in the minibatch
+    L: number of feature maps per image
+    Hi, Wi: height and width of the i-th feature map
+    K: number of pre-NMS candidates of an image, over all the levels
+    M: number of candidates of the whole batch
+"""
+
+__all__ = ["fcos_postprocess"]
+
+
+def _flatten_level(x, N):
+    """(N, D, Hi, Wi) -> (N, Hi * Wi, D), in the same order as the locations."""
+    return x.permute(0, 2, 3, 1).reshape(N, -1, x.size(1))
+
+
+def fcos_postprocess(
+        locations, logits_pred, reg_pred, ctrness_pred, image_sizes,
+        pre_nms_thresh, pre_nms_topk, post_nms_topk, nms_thresh,
+        thresh_with_ctr=False, extra_fields=None
+):
+    """
+    Turn the dense per-level predictions of an FCOS-style head into detections.
+
+    Candidates are the top `pre_nms_topk` (location, class) pairs of every level and
+    image whose score is above `pre_nms_thresh`. All the images and levels then go
+    through box decoding, the gathering of the per-location payloads and a single
+    class- and image-aware NMS together, and the `post_nms_topk` limit is applied per
+    image on the device. The host only syncs a constant number of times per batch,
+    instead of once per image and level.
+
+    Args:
+        locations (list[Tensor]): per level, (Hi * Wi, 2) locations.
+        logits_pred (list[Tensor]): per level, (N, C, Hi, Wi) classification logits.
+        reg_pred (list[Tensor]): per level, (N, 4, Hi, Wi) (l, t, r, b) distances, in
+            image coordinates (already multiplied by the stride).
+        ctrness_pred (list[Tensor]): per level, (N, 1, Hi, Wi) centerness logits.
+        image_sizes (list[tuple]): (h, w) of every image.
+        pre_nms_thresh (float), pre_nms_topk (int), post_nms_topk (int),
+        nms_thresh (float), thresh_with_ctr (bool): same meaning as the cfg options.
+        extra_fields (dict[str, list[Tensor]]): per-location payloads, such as mask
+            coefficients, bezier offsets or top_feats. Each one maps a field name to
+            per-level (N, D, Hi, Wi) tensors, and is stored as a (#detections, D) field
+            of the results, gathered at the kept locations.
+
+    Returns:
+        list[Instances]: per image, the detections with fields `pred_boxes`, `scores`,
+        `pred_classes`, `locations`, `fpn_levels` and the extra fields, sorted by
+        decreasing score.
+    """
+    extra_fields = extra_fields or {}
+    N, C = logits_pred[0].shape[:2]
+    device = logits_pred[0].device
+
+    cand_scores, cand_locs, cand_classes, cand_levels = [], [], [], []
+    loc_offset = 0
+    for level, (o, c) in enumerate(zip(logits_pred, ctrness_pred)):
+        logits = _flatten_level(o, N).sigmoid()
+        ctrness = _flatten_level(c, N).sigmoid()
+
+        # if thresh_with_ctr is True, we multiply the classification
+        # scores with centerness scores before applying the threshold.
+        if thresh_with_ctr:
+            logits = logits * ctrness
+        candidate_inds = logits > pre_nms_thresh
+        if not thresh_with_ctr:
+            logits = logits * ctrness
+
+        # top pre_nms_topk candidates per image; non-candidates are marked with -1
+        scores = torch.where(candidate_inds, logits, logits.new_full((), -1.0)).flatten(1)
+        scores, inds = scores.topk(min(pre_nms_topk, scores.size(1)), dim=1, sorted=False)
+
+        cand_scores.append(scores)
+        cand_locs.append(inds // C + loc_offset)
+        cand_classes.append(inds % C)
+        cand_levels.append(torch.full_like(inds, level))
+        loc_offset += o.size(2) * o.size(3)
+
+    # (N, K) candidates over all the levels
+    cand_scores = torch.cat(cand_scores, dim=1)
+    cand_locs = torch.cat(cand_locs, dim=1)
+    cand_classes = torch.cat(cand_classes, dim=1)
+    cand_levels = torch.cat(cand_levels, dim=1)
+
+    # (M,) candidates of the whole batch
+    im_inds, k_inds = (cand_scores >= 0).nonzero(as_tuple=True)
+    loc_inds = cand_locs[im_inds, k_inds]
+    scores = cand_scores[im_inds, k_inds].sqrt()
+    classes = cand_classes[im_inds, k_inds]
+    levels = cand_levels[im_inds, k_inds]
+
+    per_locations = torch.cat(locations, dim=0)[loc_inds]
+    box_regression = torch.cat([_flatten_level(r, N) for r in reg_pred], dim=1)[im_inds, loc_inds]
+    detections = torch.stack([
+        per_locations[:, 0] - box_regression[:, 0],
+        per_locations[:, 1] - box_regression[:, 1],
+        per_locations[:, 0] + box_regression[:, 2],
+        per_locations[:, 1] + box_regression[:, 3],
+    ], dim=1)
+
+    # multiclass nms, with the images kept apart as different classes
+    if nms_thresh > 0:
+        keep = batched_nms(detections, scores, im_inds * C + classes, nms_thresh)
+    else:
+        keep = scores.argsort(descending=True)
+
+    # Limit to max_per_image detections **over all classes**. As with a kthvalue
+    # threshold, ties with the post_nms_topk-th score are kept.
+    if post_nms_topk > 0:
+        kept_scores = scores[keep]
+        kept_im_inds = im_inds[keep]
+        one_hot = F.one_hot(kept_im_inds, N)
+        rank = (one_hot.cumsum(dim=0) * one_hot).sum(dim=1) - 1
+        image_thresh = kept_scores.new_zeros(N).scatter_add_(
+            0, kept_im_inds,
+            torch.where(rank == post_nms_topk - 1, kept_scores, torch.zeros_like(kept_scores))
+        )
+        keep = keep[kept_scores >= image_thresh[kept_im_inds]]
+
+    # group by image, keeping the score order within each image
+    kept_im_inds = im_inds[keep]
+    order = torch.argsort(kept_im_inds * len(keep) + torch.arange(len(keep), device=device))
+    keep = keep[order]
+    num_per_image = torch.bincount(kept_im_inds, minlength=N).tolist()
+
+    fields = {
+        "pred_boxes": detections[keep],
+        "scores": scores[keep],
+        "pred_classes": classes[keep],
+        "locations": per_locations[keep],
+        "fpn_levels": levels[keep],
+    }
+    # the payloads are only gathered for the final detections
+    for name, per_level in extra_fields.items():
+        payload = torch.cat([_flatten_level(x, N) for x in per_level], dim=1)
+        fields[name] = payload[im_inds[keep], loc_inds[keep]]
+
+    results = []
+    splits = {name: value.split(num_per_image) for name, value in fields.items()}
+    for i, image_size in enumerate(image_sizes):
+        boxlist = Instances(image_size)
+        for name, value in splits.items():
+            boxlist.set(name, Boxes(value[i]) if name == "pred_boxes" else value[i])
+        results.append(boxlist)
+    return results
@@ -16,7 +16,9 @@ from detectron2.structures import Boxes, ImageList, Instances
 from detectron2.utils.logger import log_first_n
 from fvcore.nn import sigmoid_focal_loss_jit
 
-from .utils import imrescale, center_of_mass, point_nms, mask_nms, matrix_nms
+from adet.structures import PackedMasks
+
+from .utils import imrescale, center_of_mass, point_nms, mask_nms, matrix_nms, masks_to_boxes
 from .loss import dice_loss, FocalLoss
 
 __all__ = ["SOLOv2"]
@@ -65,6 +67,7 @@ class SOLOv2(nn.Module):
         self.nms_kernel = cfg.MODEL.SOLOV2.NMS_KERNEL
         self.nms_sigma = cfg.MODEL.SOLOV2.NMS_SIGMA
         self.nms_type = cfg.MODEL.SOLOV2.NMS_TYPE
+        self.packed_masks = cfg.MODEL.PACKED_MASKS
 
         # build the backbone.
         self.backbone = build_backbone(cfg)
@@ -347,160 +350,118 @@ class SOLOv2(nn.Module):
 
 
     def inference(self, pred_cates, pred_kernels, pred_masks, cur_sizes, images):
-        assert len(pred_cates) == len(pred_kernels)
-
-        results = []
-        num_ins_levels = len(pred_cates)
-        for img_idx in range(len(images)):
-            # image size.
-            ori_img = images[img_idx]
-            height, width = ori_img["height"], ori_img["width"]
-            ori_size = (height, width)
-
-            # prediction.
-            pred_cate = [pred_cates[i][img_idx].view(-1, self.num_classes).detach()
-                          for i in range(num_ins_levels)]
-            pred_kernel = [pred_kernels[i][img_idx].permute(1, 2, 0).view(-1, self.num_kernels).detach()
-                            for i in range(num_ins_levels)]
-            pred_mask = pred_masks[img_idx, ...].unsqueeze(0)
-
-            pred_cate = torch.cat(pred_cate, dim=0)
-            pred_kernel = torch.cat(pred_kernel, dim=0)
-
-            # inference for single image.
-            result = self.inference_single_image(pred_cate, pred_kernel, pred_mask,
-                                                 cur_sizes[img_idx], ori_size)
-            results.append({"instances": result})
-        return results
-
-    def inference_single_image(
-            self, cate_preds, kernel_preds, seg_preds, cur_size, ori_size
-    ):
-        # overall info.
-        h, w = cur_size
-        f_h, f_w = seg_preds.size()[-2:]
-        ratio = math.ceil(h/f_h)
-        upsampled_size_out = (int(f_h*ratio), int(f_w*ratio))
-
-        # process.
-        inds = (cate_preds > self.score_threshold)
-        cate_scores = cate_preds[inds]
-        if len(cate_scores) == 0:
-            results = Instances(ori_size)
-            results.scores = torch.tensor([])
-            results.pred_classes = torch.tensor([])
-            results.pred_masks = torch.tensor([])
-            results.pred_boxes = Boxes(torch.tensor([]))
-            return results
-
-        # cate_labels & kernel_preds
-        inds = inds.nonzero()
-        cate_labels = inds[:, 1]
-        kernel_preds = kernel_preds[inds[:, 0]]
-
-        # trans vector.
-        size_trans = cate_labels.new_tensor(self.num_grids).pow(2).cumsum(0)
-        strides = kernel_preds.new_ones(size_trans[-1])
-
-        n_stage = len(self.num_grids)
-        strides[:size_trans[0]] *= self.instance_strides[0]
-        for ind_ in range(1, n_stage):
-            strides[size_trans[ind_ - 1]:size_trans[ind_]] *= self.instance_strides[ind_]
-        strides = strides[inds[:, 0]]
+        """
+        Batched postprocess over all the images of the batch.
 
-        # mask encoding.
-        N, I = kernel_preds.shape
-        kernel_preds = kernel_preds.view(N, I, 1, 1)
-        seg_preds = F.conv2d(seg_preds, kernel_preds, stride=1).squeeze(0).sigmoid()
+        The candidates are the top NMS_PRE locations/classes by category score; masks are
+        only computed for those, at feature resolution, and only the final MAX_PER_IMG
+        masks of each image are upsampled. The whole path runs on fixed-size padded
+        tensors with a validity mask, so the only host sync is the final count of
+        detections per image needed to build the Instances.
+        """
+        assert len(pred_cates) == len(pred_kernels)
 
-        # mask.
+        num_images = len(images)
+        # (B, L, C) category scores and (B, L, I) kernels over all the levels
+        cate_preds = torch.cat([p.reshape(num_images, -1, self.num_classes) for p in pred_cates], dim=1)
+        kernel_preds = torch.cat([p.permute(0, 2, 3, 1).reshape(num_images, -1, self.num_kernels)
+                                  for p in pred_kernels], dim=1)
+        cate_preds = cate_preds.detach()
+        kernel_preds = kernel_preds.detach()
+
+        # stride of every location, to drop masks smaller than their level's stride
+        strides = torch.cat([cate_preds.new_full((g * g,), s)
+                             for g, s in zip(self.num_grids, self.instance_strides)])
+
+        # candidates: top nms_pre (location, class) pairs above the score threshold.
+        # The original path keeps every pair above the threshold and cuts at nms_pre
+        # after the maskness rescoring; both agree when fewer than nms_pre pairs pass.
+        flat_scores = cate_preds.flatten(1)
+        num_candidates = min(self.max_before_nms, flat_scores.size(1))
+        cate_scores, flat_inds = flat_scores.topk(num_candidates, dim=1)
+        valid = cate_scores > self.score_threshold
+        loc_inds = flat_inds // self.num_classes
+        cate_labels = flat_inds % self.num_classes
+        batch_inds = torch.arange(num_images, device=flat_inds.device)[:, None]
+
+        # mask encoding: a 1x1 dynamic conv per candidate is a batched matmul
+        f_h, f_w = pred_masks.shape[-2:]
+        kernels = kernel_preds[batch_inds, loc_inds]
+        seg_preds = torch.bmm(kernels, pred_masks.flatten(2)).sigmoid()
         seg_masks = seg_preds > self.mask_threshold
-        sum_masks = seg_masks.sum((1, 2)).float()
-
-        # filter.
-        keep = sum_masks > strides
-        if keep.sum() == 0:
-            results = Instances(ori_size)
-            results.scores = torch.tensor([])
-            results.pred_classes = torch.tensor([])
-            results.pred_masks = torch.tensor([])
-            results.pred_boxes = Boxes(torch.tensor([]))
-            return results
-
-        seg_masks = seg_masks[keep, ...]
-        seg_preds = seg_preds[keep, ...]
-        sum_masks = sum_masks[keep]
-        cate_scores = cate_scores[keep]
-        cate_labels = cate_labels[keep]
+        sum_masks = seg_masks.sum(2).float()
+        valid &= sum_masks > strides[loc_inds]
 
         # maskness.
-        seg_scores = (seg_preds * seg_masks.float()).sum((1, 2)) / sum_masks
-        cate_scores *= seg_scores
-
-        # sort and keep top nms_pre
-        sort_inds = torch.argsort(cate_scores, descending=True)
-        if len(sort_inds) > self.max_before_nms:
-            sort_inds = sort_inds[:self.max_before_nms]
-        seg_masks = seg_masks[sort_inds, :, :]
-        seg_preds = seg_preds[sort_inds, :, :]
-        sum_masks = sum_masks[sort_inds]
-        cate_scores = cate_scores[sort_inds]
-        cate_labels = cate_labels[sort_inds]
+        seg_scores = (seg_preds * seg_masks.float()).sum(2) / sum_masks.clamp(min=1)
+        cate_scores = torch.where(valid, cate_scores * seg_scores, torch.zeros_like(cate_scores))
+
+        # sort so that invalid candidates (score 0) come last and cannot suppress valid ones
+        cate_scores, sort_inds = cate_scores.sort(dim=1, descending=True)
+        valid = valid[batch_inds, sort_inds]
+        cate_labels = cate_labels[batch_inds, sort_inds]
+        seg_preds = seg_preds[batch_inds, sort_inds]
+        seg_masks = seg_masks[batch_inds, sort_inds]
+        sum_masks = sum_masks[batch_inds, sort_inds]
+
+        seg_masks = seg_masks.view(num_images, -1, f_h, f_w)
+        if self.packed_masks:
+            # 1 bit per pixel instead of the float copy made for the pairwise overlaps
+            seg_masks = PackedMasks.from_masks(seg_masks)
 
         if self.nms_type == "matrix":
             # matrix nms & filter.
             cate_scores = matrix_nms(cate_labels, seg_masks, sum_masks, cate_scores,
-                                          sigma=self.nms_sigma, kernel=self.nms_kernel)
-            keep = cate_scores >= self.update_threshold
+                                     sigma=self.nms_sigma, kernel=self.nms_kernel)
+            keep = valid & (cate_scores >= self.update_threshold)
         elif self.nms_type == "mask":
             # original mask nms.
-            keep = mask_nms(cate_labels, seg_masks, sum_masks, cate_scores,
-                                 nms_thr=self.mask_threshold)
+            if self.packed_masks:
+                per_image_masks = [PackedMasks(m, (f_h, f_w)) for m in seg_masks.tensor]
+            else:
+                per_image_masks = list(seg_masks)
+            keep = valid & torch.stack([
+                mask_nms(cate_labels[i], per_image_masks[i], sum_masks[i], cate_scores[i],
+                         nms_thr=self.mask_threshold)
+                for i in range(num_images)
+            ])
         else:
             raise NotImplementedError
 
-        if keep.sum() == 0:
-            results = Instances(ori_size)
-            results.scores = torch.tensor([])
-            results.pred_classes = torch.tensor([])
-            results.pred_masks = torch.tensor([])
-            results.pred_boxes = Boxes(torch.tensor([]))
-            return results
+        # keep top_k, kept candidates first
+        top_scores = torch.where(keep, cate_scores, cate_scores.new_full((), -1.0))
+        top_scores, top_inds = top_scores.topk(min(self.max_per_img, num_candidates), dim=1)
+        keep = top_scores >= 0
+        cate_scores = cate_scores[batch_inds, top_inds]
+        cate_labels = cate_labels[batch_inds, top_inds]
+        seg_preds = seg_preds[batch_inds, top_inds].view(num_images, -1, f_h, f_w)
 
-        seg_preds = seg_preds[keep, :, :]
-        cate_scores = cate_scores[keep]
-        cate_labels = cate_labels[keep]
-
-        # sort and keep top_k
-        sort_inds = torch.argsort(cate_scores, descending=True)
-        if len(sort_inds) > self.max_per_img:
-            sort_inds = sort_inds[:self.max_per_img]
-        seg_preds = seg_preds[sort_inds, :, :]
-        cate_scores = cate_scores[sort_inds]
-        cate_labels = cate_labels[sort_inds]
-
-        # reshape to original size.
-        seg_preds = F.interpolate(seg_preds.unsqueeze(0),
-                                  size=upsampled_size_out,
-                                  mode='bilinear')[:, :, :h, :w]
-        seg_masks = F.interpolate(seg_preds,
-                                  size=ori_size,
-                                  mode='bilinear').squeeze(0)
-        seg_masks = seg_masks > self.mask_threshold
-
-        results = Instances(ori_size)
-        results.pred_classes = cate_labels
-        results.scores = cate_scores
-        results.pred_masks = seg_masks
-
-        # get bbox from mask
-        pred_boxes = torch.zeros(seg_masks.size(0), 4)
-        #for i in range(seg_masks.size(0)):
-        #    mask = seg_masks[i].squeeze()
-        #    ys, xs = torch.where(mask)
-        #    pred_boxes[i] = torch.tensor([xs.min(), ys.min(), xs.max(), ys.max()]).float()
-        results.pred_boxes = Boxes(pred_boxes)        
+        results = []
+        num_keep = keep.sum(1).tolist()
+        for img_idx, n in enumerate(num_keep):
+            h, w = cur_sizes[img_idx]
+            ori_size = (images[img_idx]["height"], images[img_idx]["width"])
+            ratio = math.ceil(h / f_h)
+            upsampled_size_out = (int(f_h * ratio), int(f_w * ratio))
+
+            # reshape to original size, only the kept masks.
+            if n > 0:
+                seg_masks = F.interpolate(seg_preds[img_idx, :n].unsqueeze(0),
+                                          size=upsampled_size_out,
+                                          mode='bilinear')[:, :, :h, :w]
+                seg_masks = F.interpolate(seg_masks,
+                                          size=ori_size,
+                                          mode='bilinear').squeeze(0)
+                seg_masks = seg_masks > self.mask_threshold
+            else:
+                seg_masks = seg_preds.new_zeros((0,) + ori_size, dtype=torch.bool)
 
+            result = Instances(ori_size)
+            result.pred_classes = cate_labels[img_idx, :n]
+            result.scores = cate_scores[img_idx, :n]
+            result.pred_boxes = Boxes(masks_to_boxes(seg_masks))
+            result.pred_masks = seg_masks
+            results.append({"instances": result})
         return results
 
 
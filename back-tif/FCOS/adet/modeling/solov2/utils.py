@@ -2,6 +2,8 @@ import cv2
 import torch
 import torch.nn.functional as F
 
+from adet.structures import PackedMasks
+
 
 def _scale_size(size, scale):
     """Rescale a size by a ratio.
@@ -144,24 +146,32 @@ def point_nms(heat, kernel=2):
     return heat * keep
 
 def matrix_nms(cate_labels, seg_masks, sum_masks, cate_scores, sigma=2.0, kernel='gaussian'):
-    n_samples = len(cate_labels)
+    """
+    Matrix NMS. The inputs are sorted by descending score and may carry a leading
+    batch dimension: cate_labels, sum_masks and cate_scores of shape (..., N) and
+    seg_masks of shape (..., N, H, W) or (..., N, H * W), or PackedMasks.
+    """
+    n_samples = cate_labels.size(-1)
     if n_samples == 0:
         return []
 
-    seg_masks = seg_masks.reshape(n_samples, -1).float()
     # inter.
-    inter_matrix = torch.mm(seg_masks, seg_masks.transpose(1, 0))
+    if isinstance(seg_masks, PackedMasks):
+        inter_matrix = seg_masks.intersection().float()
+    else:
+        seg_masks = seg_masks.reshape(*cate_labels.shape, -1).float()
+        inter_matrix = torch.matmul(seg_masks, seg_masks.transpose(-1, -2))
     # union.
-    sum_masks_x = sum_masks.expand(n_samples, n_samples)
+    sum_masks_x = sum_masks.unsqueeze(-2)
     # iou.
-    iou_matrix = (inter_matrix / (sum_masks_x + sum_masks_x.transpose(1, 0) - inter_matrix)).triu(diagonal=1)
+    iou_matrix = (inter_matrix / (sum_masks_x + sum_masks_x.transpose(-1, -2) - inter_matrix)).triu(diagonal=1)
     # label_specific matrix.
-    cate_labels_x = cate_labels.expand(n_samples, n_samples)
-    label_matrix = (cate_labels_x == cate_labels_x.transpose(1, 0)).float().triu(diagonal=1)
+    cate_labels_x = cate_labels.unsqueeze(-2)
+    label_matrix = (cate_labels_x == cate_labels_x.transpose(-1, -2)).float().triu(diagonal=1)
 
     # IoU compensation
-    compensate_iou, _ = (iou_matrix * label_matrix).max(0)
-    compensate_iou = compensate_iou.expand(n_samples, n_samples).transpose(1, 0)
+    compensate_iou, _ = (iou_matrix * label_matrix).max(-2)
+    compensate_iou = compensate_iou.unsqueeze(-1)
 
     # IoU decay / soft nms
     delay_iou = iou_matrix * label_matrix
@@ -169,11 +179,11 @@ def matrix_nms(cate_labels, seg_masks, sum_masks, cate_scores, sigma=2.0, kernel
     # matrix nms
     if kernel == 'linear':
         delay_matrix = (1 - delay_iou) / (1 - compensate_iou)
-        delay_coefficient, _ = delay_matrix.min(0)
+        delay_coefficient, _ = delay_matrix.min(-2)
     else:
         delay_matrix = torch.exp(-1 * sigma * (delay_iou ** 2))
         compensate_matrix = torch.exp(-1 * sigma * (compensate_iou ** 2))
-        delay_coefficient, _ = (delay_matrix / compensate_matrix).min(0)
+        delay_coefficient, _ = (delay_matrix / compensate_matrix).min(-2)
 
     # update the score.
     cate_scores_update = cate_scores * delay_coefficient
@@ -182,31 +192,52 @@ def matrix_nms(cate_labels, seg_masks, sum_masks, cate_scores, sigma=2.0, kernel
 
 
 def mask_nms(cate_labels, seg_masks, sum_masks, cate_scores, nms_thr=0.5):
+    """
+    Greedy mask NMS over candidates sorted by descending score. All the pairwise
+    intersections come from a single matmul of the flattened masks (or popcounts of
+    PackedMasks); only the greedy pass over the resulting suppression matrix is
+    sequential.
+    """
     n_samples = len(cate_scores)
     if n_samples == 0:
         return []
 
-    keep = seg_masks.new_ones(cate_scores.shape)
-    seg_masks = seg_masks.float()
-
+    # overlaps
+    if isinstance(seg_masks, PackedMasks):
+        inter_matrix = seg_masks.intersection().float()
+    else:
+        seg_masks = seg_masks.reshape(n_samples, -1).float()
+        inter_matrix = torch.mm(seg_masks, seg_masks.transpose(1, 0))
+    union_matrix = sum_masks[:, None] + sum_masks[None, :] - inter_matrix
+    label_matrix = cate_labels[:, None] == cate_labels[None, :]
+    order = torch.arange(n_samples, device=label_matrix.device)
+    # empty unions (two empty masks) suppress as well
+    suppress = (inter_matrix / union_matrix > nms_thr) | (union_matrix <= 0)
+    suppress = (suppress & label_matrix & (order[:, None] < order[None, :])).cpu()
+
+    keep = torch.ones(n_samples, dtype=torch.bool)
     for i in range(n_samples - 1):
-        if not keep[i]:
-            continue
-        mask_i = seg_masks[i]
-        label_i = cate_labels[i]
-        for j in range(i + 1, n_samples, 1):
-            if not keep[j]:
-                continue
-            mask_j = seg_masks[j]
-            label_j = cate_labels[j]
-            if label_i != label_j:
-                continue
-            # overlaps
-            inter = (mask_i * mask_j).sum()
-            union = sum_masks[i] + sum_masks[j] - inter
-            if union > 0:
-                if inter / union > nms_thr:
-                    keep[j] = False
-            else:
-                keep[j] = False
-    return keep
+        if keep[i]:
+            keep[i + 1:] &= ~suppress[i, i + 1:]
+    return keep.to(cate_scores.device)
+
+
+def masks_to_boxes(masks):
+    """
+    Tight XYXY_ABS boxes of (N, H, W) boolean masks, from row and column any-reductions.
+    Empty masks get an all-zero box.
+    """
+    n, h, w = masks.shape
+    if n == 0:
+        return torch.zeros(0, 4, device=masks.device)
+    rows = masks.any(dim=2)
+    cols = masks.any(dim=1)
+    ys = torch.arange(h, device=masks.device)
+    xs = torch.arange(w, device=masks.device)
+
+    x0 = torch.where(cols, xs, xs.new_full((), w)).min(dim=1)[0]
+    y0 = torch.where(rows, ys, ys.new_full((), h)).min(dim=1)[0]
+    x1 = torch.where(cols, xs + 1, xs.new_zeros(())).max(dim=1)[0]
+    y1 = torch.where(rows, ys + 1, ys.new_zeros(())).max(dim=1)[0]
+    boxes = torch.stack([x0, y0, x1, y1], dim=1).float()
+    return boxes * rows.any(dim=1, keepdim=True)
@@ -1 +1,2 @@
-from .beziers import Beziers
\ No newline at end of file
+from .beziers import Beziers
+from .packed_masks import PackedMasks
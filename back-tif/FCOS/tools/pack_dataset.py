@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Empaquetar un dataset COCO en shards memory-mapped para entrenar FCOS
+
+Decodifica cada imagen una sola vez, la redimensiona con el mismo
+ResizeShortestEdge del entrenamiento (INPUT.MIN_SIZE_TRAIN / MAX_SIZE_TRAIN de
+la config) y escribe los píxeles crudos en shards junto con las anotaciones ya
+convertidas a XYXY_ABS. Para entrenar con el resultado:
+
+    from adet.data import PackedDatasetMapper
+    from adet.data.datasets.packed import register_packed_instances
+
+    register_packed_instances("expiry_dates_train_packed", {"thing_classes": [...]}, "datasets/expiry_packed/train")
+    cfg.DATASETS.TRAIN = ("expiry_dates_train_packed",)
+    build_detection_train_loader(cfg, mapper=PackedDatasetMapper(cfg, True))
+
+Uso:
+    python tools/pack_dataset.py --json datasets/expiry/annotations/train.json \\
+        --image-root datasets/expiry/train --output datasets/expiry_packed/train
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+FCOS_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(FCOS_DIR))
+
+from detectron2.data.datasets.coco import load_coco_json
+from adet.config import get_cfg
+from adet.data.datasets.packed import pack_dataset_dicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Empaquetar un dataset COCO para FCOS")
+    parser.add_argument("--json", required=True, help="Anotaciones COCO")
+    parser.add_argument("--image-root", required=True, help="Directorio de imágenes")
+    parser.add_argument("--output", required=True, help="Directorio de salida")
+    parser.add_argument("--config", default=str(FCOS_DIR / "configs" / "FCOS-Detection" / "expiry_dates_R_50_1x.yaml"))
+    parser.add_argument("--shard-gb", type=float, default=2.0, help="Tamaño aproximado de cada shard")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    cfg = get_cfg()
+    cfg.merge_from_file(args.config)
+    min_size = max(cfg.INPUT.MIN_SIZE_TRAIN)
+    max_size = cfg.INPUT.MAX_SIZE_TRAIN
+
+    dataset_dicts = load_coco_json(args.json, args.image_root)
+    print(f"📦 Empaquetando {len(dataset_dicts)} imágenes (lado corto {min_size}, máx {max_size}, {cfg.INPUT.FORMAT})...")
+
+    start = time.perf_counter()
+    count = pack_dataset_dicts(
+        dataset_dicts, args.output, min_size, max_size,
+        image_format=cfg.INPUT.FORMAT, shard_bytes=int(args.shard_gb * (1 << 30)),
+    )
+    elapsed = time.perf_counter() - start
+    print(f"✅ {count} imágenes empaquetadas en {args.output} ({elapsed:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
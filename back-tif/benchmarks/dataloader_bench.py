@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Throughput del data loader de entrenamiento de FCOS: JPEG en disco vs dataset empaquetado
+
+Construye el mismo build_detection_train_loader dos veces, una con
+DatasetMapperWithBasis sobre las imágenes originales y otra con
+PackedDatasetMapper sobre el directorio generado por FCOS/tools/pack_dataset.py,
+y mide imágenes/s tras unas iteraciones de calentamiento. Guarda el resultado
+en JSON.
+
+Resultados: todavía sin medir. El formato empaquetado se añadió en un entorno
+sin torch, detectron2 ni el dataset de entrenamiento, así que no hay cifras de
+JPEG vs empaquetado; anotarlas aquí (imágenes/s con el mismo --num-workers)
+tras la primera ejecución en la máquina de entrenamiento.
+
+Uso:
+    python benchmarks/dataloader_bench.py --json datasets/expiry/annotations/train.json \\
+        --image-root datasets/expiry/train --packed-dir datasets/expiry_packed/train
+    python benchmarks/dataloader_bench.py ... --num-workers 4 --iterations 200
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR / "FCOS"))
+
+from detectron2.data import build_detection_train_loader
+from detectron2.data.datasets import register_coco_instances
+from adet.config import get_cfg
+from adet.data import DatasetMapperWithBasis, PackedDatasetMapper
+from adet.data.datasets.packed import register_packed_instances
+
+
+def measure(cfg, mapper, warmup, iterations):
+    """Imágenes/s del loader tras `warmup` batches"""
+    loader = iter(build_detection_train_loader(cfg, mapper=mapper))
+    for _ in range(warmup):
+        next(loader)
+
+    images = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        images += len(next(loader))
+    elapsed = time.perf_counter() - start
+    return {"images": images, "seconds": elapsed, "images_per_s": images / elapsed if elapsed else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput del data loader de FCOS")
+    parser.add_argument("--json", required=True, help="Anotaciones COCO originales")
+    parser.add_argument("--image-root", required=True, help="Directorio de imágenes originales")
+    parser.add_argument("--packed-dir", required=True, help="Salida de FCOS/tools/pack_dataset.py")
+    parser.add_argument("--config", default=str(BACKEND_DIR / "FCOS" / "configs" / "FCOS-Detection" / "expiry_dates_R_50_1x.yaml"))
+    parser.add_argument("--num-workers", type=int, default=2)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--output", default="dataloader_bench_results.json")
+    args = parser.parse_args()
+
+    register_coco_instances("bench_raw", {}, args.json, args.image_root)
+    register_packed_instances("bench_packed", {}, args.packed_dir)
+
+    cfg = get_cfg()
+    cfg.merge_from_file(args.config)
+    cfg.DATALOADER.NUM_WORKERS = args.num_workers
+
+    results = {}
+    for name, dataset, mapper_cls in [
+        ("raw", "bench_raw", DatasetMapperWithBasis),
+        ("packed", "bench_packed", PackedDatasetMapper),
+    ]:
+        run_cfg = cfg.clone()
+        run_cfg.DATASETS.TRAIN = (dataset,)
+        results[name] = measure(run_cfg, mapper_cls(run_cfg, True), args.warmup, args.iterations)
+        print(f"⏱️  {name:<7} {results[name]['images_per_s']:8.1f} imágenes/s "
+              f"({results[name]['images']} imágenes en {results[name]['seconds']:.1f}s)")
+
+    speedup = results["packed"]["images_per_s"] / results["raw"]["images_per_s"] if results["raw"]["images_per_s"] else 0.0
+    print(f"\n🚀 Speedup del dataset empaquetado: {speedup:.2f}x")
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "num_workers": args.num_workers,
+        "ims_per_batch": cfg.SOLVER.IMS_PER_BATCH,
+        "results": results,
+        "speedup": speedup,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Resultados guardados en: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Benchmark end-to-end de la API de escaneo
+
+Levanta la app FastAPI en un hilo con uvicorn, sustituye MongoDB por mongomock
+(o un mongod efímero vía --mongodb-url) y la API de productos por un stub, y
+reproduce un corpus de imágenes con la concurrencia indicada. Reporta
+p50/p95/p99, RPS y memoria por endpoint, y guarda el resultado en JSON para
+comparar entre versiones.
+
+El corpus por defecto es benchmarks/corpus, un conjunto fijo que el benchmark
+solo lee. Las imágenes de depuración que escribe /scan (DEBUG_IMAGES_DIR y
+FCOS_CROPS_DIR) se redirigen a un directorio temporal que se borra al terminar,
+así que cada ejecución ve el mismo corpus y no ensucia el repositorio.
+
+Uso:
+    pip install mongomock
+    python benchmarks/load_test.py --concurrency 4 --requests 50
+    python benchmarks/load_test.py --endpoints scan,products --output bench_v1.json
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+STUB_PRODUCT = {
+    "result": [{
+        "codebar": "7791293044507",
+        "productName": "Producto de prueba",
+        "lab": "Laboratorio",
+        "price": 100.0,
+        "matnr": "000000",
+    }]
+}
+
+
+def read_rss_mb():
+    """RSS actual y pico del proceso en MB"""
+    try:
+        with open("/proc/self/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return peak, peak
+
+
+def percentile(values, pct):
+    """Percentil con interpolación lineal"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def patch_backend(mongodb_url, debug_dir):
+    """Sustituir MongoDB, la API externa de productos y los directorios de depuración"""
+    import database
+
+    if mongodb_url:
+        from pymongo import MongoClient
+        client = MongoClient(mongodb_url)
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit("❌ Falta mongomock: pip install mongomock (o usa --mongodb-url)")
+        client = mongomock.MongoClient()
+
+    database.use_client(client, "productos_farmacia_bench")
+
+    import main
+    main.DEBUG_IMAGES_DIR = os.path.join(debug_dir, "debug_images")
+    main.FCOS_CROPS_DIR = os.path.join(debug_dir, "fcos_crops")
+    main.BEARER = main.BEARER or "bench"
+    main.fetch_product = lambda url, bearer_token: STUB_PRODUCT
+    return main
+
+
+def start_server(app, port):
+    """Arrancar uvicorn en un hilo y esperar a que la app esté lista"""
+    import uvicorn
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.1)
+    return server, thread
+
+
+def load_corpus(corpus_dir, limit):
+    """Cargar las imágenes del corpus en base64"""
+    paths = sorted(p for p in Path(corpus_dir).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    if limit:
+        paths = paths[:limit]
+    if not paths:
+        raise SystemExit(f"❌ No hay imágenes en {corpus_dir}")
+    return [base64.b64encode(p.read_bytes()).decode("utf-8") for p in paths]
+
+
+def build_requests(endpoint, corpus, index):
+    """Devuelve (método, ruta, json) para la petición número `index`"""
+    image = corpus[index % len(corpus)]
+    barcode = "7791293044507"
+    if endpoint == "scan":
+        return "POST", "/scan-expiration-date", {"barcode": barcode, "image_base64": image}
+    if endpoint == "detect":
+        return "POST", "/detect-expiry-fcos", {"image_base64": image}
+    if endpoint == "product":
+        return "POST", "/get-product-by-barcode", {"barcode": barcode}
+    if endpoint == "save":
+        return "POST", "/confirm-and-save-product", {
+            "barcode": barcode, "expiration_date": f"{index % 12 + 1:02d}/2030", "quantity": 1
+        }
+    if endpoint == "products":
+        return "GET", "/products", None
+    raise ValueError(f"Endpoint desconocido: {endpoint}")
+
+
+async def run_endpoint(base_url, endpoint, corpus, total, concurrency):
+    """Lanzar `total` peticiones con `concurrency` en vuelo y medir latencias"""
+    import aiohttp
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+
+    async with aiohttp.ClientSession(base_url, timeout=timeout) as session:
+        async def one(index):
+            nonlocal errors
+            method, path, payload = build_requests(endpoint, corpus, index)
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    async with session.request(method, path, json=payload) as response:
+                        await response.read()
+                        if response.status >= 400:
+                            errors += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        rss_before, _ = read_rss_mb()
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        wall = time.perf_counter() - start
+        rss_after, rss_peak = read_rss_mb()
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "rps": total / wall if wall else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50) * 1000,
+            "p95": percentile(latencies, 95) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "mean": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+            "max": max(latencies) * 1000 if latencies else 0.0,
+        },
+        "memory_mb": {
+            "rss_before": rss_before,
+            "rss_after": rss_after,
+            "rss_peak": rss_peak,
+        },
+    }
+
+
+async def wait_until_ready(base_url, timeout_s):
+    """Esperar a que /ready responda 200 (warm-up terminado)"""
+    import aiohttp
+
+    deadline = time.perf_counter() + timeout_s
+    async with aiohttp.ClientSession(base_url) as session:
+        while time.perf_counter() < deadline:
+            try:
+                async with session.get("/ready") as response:
+                    if response.status == 200:
+                        return True
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    return False
+
+
+def compare_with_baseline(results, baseline_path):
+    """Imprimir la variación de p95 y RPS respecto de un resultado anterior"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\n📊 Comparación con {baseline_path} (versión {baseline.get('version')}):")
+    for endpoint, stats in results.items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if not previous:
+            continue
+        p95_delta = stats["latency_ms"]["p95"] / previous["latency_ms"]["p95"] - 1 if previous["latency_ms"]["p95"] else 0.0
+        rps_delta = stats["rps"] / previous["rps"] - 1 if previous["rps"] else 0.0
+        print(f"   {endpoint}: p95 {p95_delta:+.1%}, rps {rps_delta:+.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end de la API de escaneo")
+    parser.add_argument("--corpus", default=str(BACKEND_DIR / "benchmarks" / "corpus"), help="Directorio de imágenes (solo lectura)")
+    parser.add_argument("--corpus-limit", type=int, default=0, help="Máximo de imágenes a usar (0 = todas)")
+    parser.add_argument("--endpoints", default="scan,detect,product,save,products",
+                        help="Lista separada por comas: scan, detect, product, save, products")
+    parser.add_argument("--requests", type=int, default=50, help="Peticiones por endpoint")
+    parser.add_argument("--concurrency", type=int, default=4, help="Peticiones simultáneas")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mongodb-url", default=None, help="Usar un mongod real/efímero en lugar de mongomock")
+    parser.add_argument("--ready-timeout", type=float, default=600, help="Segundos máximos esperando /ready")
+    parser.add_argument("--version", default=os.getenv("BENCH_VERSION", "dev"), help="Etiqueta de la versión medida")
+    parser.add_argument("--output", default="bench_results.json", help="Archivo JSON de salida")
+    parser.add_argument("--baseline", default=None, help="JSON de una ejecución anterior para comparar")
+    args = parser.parse_args()
+
+    os.chdir(BACKEND_DIR)
+    corpus = load_corpus(args.corpus, args.corpus_limit)
+    debug_dir = tempfile.mkdtemp(prefix="bench-debug-")
+    main_module = patch_backend(args.mongodb_url, debug_dir)
+
+    print(f"🚀 Levantando API en el puerto {args.port}...")
+    server, thread = start_server(main_module.app, args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    results = {}
+    try:
+        if not asyncio.run(wait_until_ready(base_url, args.ready_timeout)):
+            print("⚠️  /ready no respondió a tiempo, se mide igualmente")
+
+        for endpoint in [e.strip() for e in args.endpoints.split(",") if e.strip()]:
+            print(f"⏱️  {endpoint}: {args.requests} peticiones, concurrencia {args.concurrency}")
+            stats = asyncio.run(run_endpoint(base_url, endpoint, corpus, args.requests, args.concurrency))
+            results[endpoint] = stats
+            lat = stats["latency_ms"]
+            print(f"   p50={lat['p50']:.1f}ms p95={lat['p95']:.1f}ms p99={lat['p99']:.1f}ms "
+                  f"rps={stats['rps']:.2f} errores={stats['errors']} rss_pico={stats['memory_mb']['rss_peak']:.0f}MB")
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+        shutil.rmtree(debug_dir, ignore_errors=True)
+
+    report = {
+        "version": args.version,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus_size": len(corpus),
+        "endpoints": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Resultados guardados en: {args.output}")
+
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
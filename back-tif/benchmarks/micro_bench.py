@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks de los componentes de DAN y FCOS
+
+Mide cada función caliente por separado, en CPU, con pesos aleatorios y
+tamaños de entrada fijos, barriendo tamaños de batch. Reporta latencia,
+throughput (items/s) y memoria pico por componente y batch, y guarda el
+resultado en JSON.
+
+Componentes:
+    dan_feature_extractor, dan_cam, dan_dtd_decode, dan_encdec_decode,
+    fcos_head, fcos_predict_proposals, fcos_ml_nms, fcos_compute_locations,
+    fcos_targets
+
+Uso:
+    python benchmarks/micro_bench.py
+    python benchmarks/micro_bench.py --components dan_cam,fcos_head --batch-sizes 1,4 --repeats 20
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import torch
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(BACKEND_DIR / "DAN"))
+sys.path.append(str(BACKEND_DIR / "FCOS"))
+
+# Tamaños fijos de entrada
+DAN_INPUT = (1, 192, 2048)
+FCOS_IMAGE = (800, 1344)  # 800x1333 con padding a múltiplo de 32
+FCOS_CONFIG = BACKEND_DIR / "FCOS" / "configs" / "FCOS-Detection" / "expiry_dates_R_50_1x.yaml"
+NMS_CANDIDATES = 1000
+TARGET_GTS = 60  # cajas GT por imagen en fcos_targets (etiquetas densas)
+DECODE_LENGTH = 8  # "09/2027" + fin de secuencia
+
+
+def reset_peak_rss():
+    """Reiniciar el pico de RSS (VmHWM) del proceso, solo en Linux"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def read_peak_rss_mb():
+    """Pico de RSS del proceso en MB"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# --------------------------------------------------------------------------- #
+# DAN
+# --------------------------------------------------------------------------- #
+def build_dan_models():
+    from DAN import Feature_Extractor, CAM_transposed, DTD
+
+    model_fe = Feature_Extractor(
+        strides=[(2, 2), (2, 2), (2, 1), (2, 2), (2, 2), (2, 1)],
+        compress_layer=True,
+        input_shape=list(DAN_INPUT),
+    )
+    model_cam = CAM_transposed(maxT=150, depth=14, num_channels=128, scales=model_fe.Iwantshapes())
+    model_dtd = DTD(nclass=80, nchannel=256, dropout=0.7)
+    return model_fe.eval(), model_cam.eval(), model_dtd.eval()
+
+
+def setup_dan_feature_extractor(batch_size, models):
+    model_fe, _, _ = models["dan"]
+    images = torch.rand(batch_size, *DAN_INPUT)
+    return lambda: model_fe(images)
+
+
+def setup_dan_cam(batch_size, models):
+    model_fe, model_cam, _ = models["dan"]
+    features = model_fe(torch.rand(batch_size, *DAN_INPUT))
+    return lambda: model_cam(features)
+
+
+def setup_dan_dtd_decode(batch_size, models):
+    model_fe, model_cam, model_dtd = models["dan"]
+    features = model_fe(torch.rand(batch_size, *DAN_INPUT))
+    attention_maps = model_cam(features)
+    max_length = attention_maps.size(1)
+    dummy_target = torch.zeros(batch_size, max_length).long()
+    dummy_length = torch.ones(batch_size).int() * max_length
+    return lambda: model_dtd(features[-1], attention_maps, dummy_target, dummy_length, test=True)
+
+
+def setup_dan_encdec_decode(batch_size, models):
+    from utils import cha_encdec
+
+    encdec = cha_encdec(str(BACKEND_DIR / "DAN" / "dict" / "dic_79.txt"), case_sensitive=True)
+    net_out = torch.randn(batch_size * DECODE_LENGTH, 80)
+    length = torch.full((batch_size,), DECODE_LENGTH)
+    return lambda: encdec.decode(net_out, length)
+
+
+# --------------------------------------------------------------------------- #
+# FCOS
+# --------------------------------------------------------------------------- #
+def build_fcos_cfg():
+    from adet.config import get_cfg
+
+    cfg = get_cfg()
+    cfg.merge_from_file(str(FCOS_CONFIG))
+    cfg.MODEL.DEVICE = "cpu"
+    cfg.MODEL.FCOS.INFERENCE_TH_TEST = 0.3
+    cfg.freeze()
+    return cfg
+
+
+def fcos_feature_shapes(cfg):
+    height, width = FCOS_IMAGE
+    return [((height + s - 1) // s, (width + s - 1) // s) for s in cfg.MODEL.FCOS.FPN_STRIDES]
+
+
+def random_head_outputs(cfg, batch_size):
+    """Salidas sintéticas del head; los logits se generan con randn para que haya candidatos"""
+    num_classes = cfg.MODEL.FCOS.NUM_CLASSES
+    logits, regs, ctrness = [], [], []
+    for h, w in fcos_feature_shapes(cfg):
+        logits.append(torch.randn(batch_size, num_classes, h, w))
+        regs.append(torch.rand(batch_size, 4, h, w) * 8)
+        ctrness.append(torch.randn(batch_size, 1, h, w))
+    return logits, regs, ctrness
+
+
+def setup_fcos_head(batch_size, models):
+    from detectron2.layers import ShapeSpec
+    from adet.modeling.fcos.fcos import FCOSHead
+
+    cfg = models["fcos_cfg"]
+    head = FCOSHead(cfg, [ShapeSpec(channels=256, stride=s) for s in cfg.MODEL.FCOS.FPN_STRIDES]).eval()
+    features = [torch.randn(batch_size, 256, h, w) for h, w in fcos_feature_shapes(cfg)]
+    return lambda: head(features)
+
+
+def setup_fcos_predict_proposals(batch_size, models):
+    from adet.modeling.fcos.fcos_outputs import FCOSOutputs
+    from adet.utils.comm import compute_locations
+
+    cfg = models["fcos_cfg"]
+    outputs = FCOSOutputs(cfg).eval()
+    logits, regs, ctrness = random_head_outputs(cfg, batch_size)
+    locations = [
+        compute_locations(h, w, s, torch.device("cpu"))
+        for (h, w), s in zip(fcos_feature_shapes(cfg), cfg.MODEL.FCOS.FPN_STRIDES)
+    ]
+    image_sizes = [FCOS_IMAGE] * batch_size
+    return lambda: outputs.predict_proposals(logits, regs, ctrness, locations, image_sizes, [])
+
+
+def setup_fcos_ml_nms(batch_size, models):
+    from detectron2.structures import Boxes, Instances
+    from adet.layers import ml_nms
+
+    cfg = models["fcos_cfg"]
+    height, width = FCOS_IMAGE
+    boxlists = []
+    for _ in range(batch_size):
+        xy = torch.rand(NMS_CANDIDATES, 2) * torch.tensor([width, height])
+        wh = torch.rand(NMS_CANDIDATES, 2) * 200 + 10
+        boxlist = Instances(FCOS_IMAGE)
+        boxlist.pred_boxes = Boxes(torch.cat([xy, xy + wh], dim=1))
+        boxlist.scores = torch.rand(NMS_CANDIDATES)
+        boxlist.pred_classes = torch.randint(0, cfg.MODEL.FCOS.NUM_CLASSES, (NMS_CANDIDATES,))
+        boxlists.append(boxlist)
+    return lambda: [ml_nms(boxlist, cfg.MODEL.FCOS.NMS_TH) for boxlist in boxlists]
+
+
+def setup_fcos_compute_locations(batch_size, models):
+    from adet.utils.comm import compute_locations
+
+    cfg = models["fcos_cfg"]
+    shapes = list(zip(fcos_feature_shapes(cfg), cfg.MODEL.FCOS.FPN_STRIDES))
+    # las ubicaciones no dependen del batch; se repite batch_size veces para comparar por item
+    return lambda: [
+        compute_locations(h, w, s, torch.device("cpu"))
+        for _ in range(batch_size) for (h, w), s in shapes
+    ]
+
+
+def setup_fcos_targets(batch_size, models):
+    """Asignación de targets del loss de FCOS (_get_ground_truth) con TARGET_GTS cajas por imagen"""
+    from detectron2.structures import Boxes, Instances
+    from adet.modeling.fcos.fcos_outputs import FCOSOutputs
+    from adet.utils.comm import compute_locations
+
+    cfg = models["fcos_cfg"]
+    outputs = FCOSOutputs(cfg)
+    height, width = FCOS_IMAGE
+    locations = [
+        compute_locations(h, w, s, torch.device("cpu"))
+        for (h, w), s in zip(fcos_feature_shapes(cfg), cfg.MODEL.FCOS.FPN_STRIDES)
+    ]
+    gt_instances = []
+    for _ in range(batch_size):
+        xy = torch.rand(TARGET_GTS, 2) * torch.tensor([width - 400, height - 200])
+        wh = torch.rand(TARGET_GTS, 2) * torch.tensor([400, 200]) + 8
+        gt = Instances(FCOS_IMAGE)
+        gt.gt_boxes = Boxes(torch.cat([xy, xy + wh], dim=1))
+        gt.gt_classes = torch.randint(0, cfg.MODEL.FCOS.NUM_CLASSES, (TARGET_GTS,))
+        gt_instances.append(gt)
+    return lambda: outputs._get_ground_truth(locations, gt_instances)
+
+
+COMPONENTS = {
+    "dan_feature_extractor": ("dan", setup_dan_feature_extractor),
+    "dan_cam": ("dan", setup_dan_cam),
+    "dan_dtd_decode": ("dan", setup_dan_dtd_decode),
+    "dan_encdec_decode": ("dan", setup_dan_encdec_decode),
+    "fcos_head": ("fcos", setup_fcos_head),
+    "fcos_predict_proposals": ("fcos", setup_fcos_predict_proposals),
+    "fcos_ml_nms": ("fcos", setup_fcos_ml_nms),
+    "fcos_compute_locations": ("fcos", setup_fcos_compute_locations),
+    "fcos_targets": ("fcos", setup_fcos_targets),
+}
+
+
+def bench(fn, batch_size, warmup, repeats):
+    """Ejecutar fn y devolver estadísticas de latencia, throughput y memoria"""
+    for _ in range(warmup):
+        fn()
+
+    can_reset = reset_peak_rss()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    mean = statistics.fmean(times)
+    return {
+        "batch_size": batch_size,
+        "mean_ms": mean * 1000,
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "stdev_ms": statistics.stdev(times) * 1000 if len(times) > 1 else 0.0,
+        "throughput_items_s": batch_size / mean if mean else 0.0,
+        "peak_rss_mb": read_peak_rss_mb(),
+        "peak_rss_is_per_component": can_reset,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de DAN y FCOS")
+    parser.add_argument("--components", default=",".join(COMPONENTS), help="Lista separada por comas")
+    parser.add_argument("--batch-sizes", default="1,2,4", help="Tamaños de batch a barrer")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=0, help="torch.set_num_threads (0 = por defecto)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="micro_bench_results.json")
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    selected = [c.strip() for c in args.components.split(",") if c.strip()]
+    unknown = [c for c in selected if c not in COMPONENTS]
+    if unknown:
+        raise SystemExit(f"❌ Componentes desconocidos: {', '.join(unknown)}")
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+
+    os.chdir(BACKEND_DIR)
+    models = {}
+    if any(COMPONENTS[c][0] == "dan" for c in selected):
+        models["dan"] = build_dan_models()
+    if any(COMPONENTS[c][0] == "fcos" for c in selected):
+        models["fcos_cfg"] = build_fcos_cfg()
+
+    results = {}
+    with torch.no_grad():
+        for component in selected:
+            _, setup = COMPONENTS[component]
+            results[component] = []
+            for batch_size in batch_sizes:
+                stats = bench(setup(batch_size, models), batch_size, args.warmup, args.repeats)
+                results[component].append(stats)
+                print(f"⏱️  {component:<24} batch={batch_size:<3} "
+                      f"{stats['mean_ms']:9.2f}ms  {stats['throughput_items_s']:9.1f} items/s  "
+                      f"pico={stats['peak_rss_mb']:.0f}MB")
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "torch": torch.__version__,
+        "threads": torch.get_num_threads(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "inputs": {"dan": DAN_INPUT, "fcos_image": FCOS_IMAGE, "nms_candidates": NMS_CANDIDATES,
+                   "target_gts": TARGET_GTS},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Resultados guardados en: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Chequeo de regresión del modo de inferencia rápido (autocast + channels_last)
+
+Compara, en CPU, las salidas en fp32 contra autocast bf16 (lo que simula el
+modo fp16/bf16 de la GPU) para DAN y FCOS con los pesos de producción y fotos
+reales: el corpus fijo de benchmarks/corpus, que solo se lee. Los crops de DAN
+salen de la mejor caja "date"/"due" de FCOS en fp32 (o de --dan-crops). Sale
+con código 1 si FCOS no detecta nada en fp32, si las cajas superan la
+tolerancia o si las fechas predichas difieren.
+
+Uso:
+    python benchmarks/precision_check.py
+    python benchmarks/precision_check.py --dan-prefix models/dates/exp1_E1_I2000-2560 --box-tol 4
+    python benchmarks/precision_check.py --skip-fcos --dan-crops datasets/date_crops
+
+Con --bucket además compara las fechas del preprocesado "bucket" (relación de
+aspecto + relleno) contra "stretch" en los mismos crops reales; el modo bucket
+solo puede activarse en el servicio si este chequeo pasa.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import torch
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.append(str(BACKEND_DIR / "FCOS"))
+
+from inference_mode import autocast_context, apply_memory_format
+
+# Mismo orden de clases que main.py
+FCOS_CLASS_NAMES = ["due", "production", "code", "date"]
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+
+def load_images(directory, limit):
+    """Rutas de las imágenes de un directorio, ordenadas (limit=0: todas)"""
+    paths = sorted(p for p in Path(directory).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    if limit:
+        paths = paths[:limit]
+    if not paths:
+        raise SystemExit(f"❌ No hay imágenes en {directory}")
+    return paths
+
+
+def check_dan(prefix, crops):
+    """Comprueba que las fechas leídas de crops reales coinciden entre fp32 y bf16"""
+    from date_ocr_service import DateOCRService
+
+    if not crops:
+        print("🔤 DAN: no hay crops reales para comparar")
+        return False
+
+    service_fp32 = DateOCRService(model_path_prefix=prefix, precision="fp32")
+    service_fast = DateOCRService(model_path_prefix=prefix, precision="bf16")
+    service_fast.models = tuple(
+        apply_memory_format(model, "cpu", channels_last=True) if i < 2 else model
+        for i, model in enumerate(service_fast.models)
+    )
+
+    mismatches = []
+    readings = 0
+    for name, crop in crops:
+        text_fp32, conf_fp32 = service_fp32.predict_date(crop)
+        text_fast, conf_fast = service_fast.predict_date(crop)
+        readings += bool(text_fp32)
+        if text_fp32 != text_fast:
+            mismatches.append((name, text_fp32, text_fast, conf_fp32, conf_fast))
+
+    print(f"🔤 DAN: {len(crops) - len(mismatches)}/{len(crops)} fechas idénticas "
+          f"({readings} crops con lectura en fp32)")
+    for name, text_fp32, text_fast, conf_fp32, conf_fast in mismatches:
+        print(f"   {name}: fp32='{text_fp32}' ({conf_fp32:.3f}) vs bf16='{text_fast}' ({conf_fast:.3f})")
+    if readings == 0:
+        # Sin ninguna lectura la comparación no demuestra nada
+        print("   DAN no leyó ninguna fecha en fp32: revisar los pesos o los crops")
+        return False
+    return not mismatches
+
+
+def check_dan_bucket(prefix, crops):
+    """Comprueba que el preprocesado bucket lee las mismas fechas que stretch"""
+    from date_ocr_service import DateOCRService
+
+    if not crops:
+        print("🪣 DAN bucket: no hay crops reales para comparar")
+        return False
+
+    service_stretch = DateOCRService(model_path_prefix=prefix, preprocess_mode="stretch", precision="fp32")
+    service_bucket = DateOCRService(model_path_prefix=prefix, preprocess_mode="bucket", precision="fp32")
+
+    mismatches = []
+    for name, crop in crops:
+        text_stretch, conf_stretch = service_stretch.predict_date(crop)
+        text_bucket, conf_bucket = service_bucket.predict_date(crop)
+        if text_stretch != text_bucket:
+            mismatches.append((name, text_stretch, text_bucket, conf_stretch, conf_bucket))
+
+    print(f"🪣 DAN bucket: {len(crops) - len(mismatches)}/{len(crops)} fechas idénticas a stretch")
+    for name, text_stretch, text_bucket, conf_stretch, conf_bucket in mismatches:
+        print(f"   {name}: stretch='{text_stretch}' ({conf_stretch:.3f}) vs bucket='{text_bucket}' ({conf_bucket:.3f})")
+    return not mismatches
+
+
+def check_fcos(config_path, weights, image_paths, box_tol):
+    """
+    Compara las cajas fp32 y bf16 en fotos reales
+
+    Returns:
+        (ok, crops): crops es una lista (nombre, imagen PIL) con la mejor caja
+        "date"/"due" de cada foto en fp32, para el chequeo de DAN
+    """
+    import cv2
+    from PIL import Image
+    import detectron2.data.transforms as T
+    from detectron2.checkpoint import DetectionCheckpointer
+    from detectron2.modeling import build_model
+    from adet.config import get_cfg
+
+    cfg = get_cfg()
+    cfg.merge_from_file(config_path)
+    cfg.MODEL.DEVICE = "cpu"
+    cfg.freeze()
+
+    model = build_model(cfg).eval()
+    DetectionCheckpointer(model).load(weights)
+    aug = T.ResizeShortestEdge([cfg.INPUT.MIN_SIZE_TEST, cfg.INPUT.MIN_SIZE_TEST], cfg.INPUT.MAX_SIZE_TEST)
+    target_ids = [i for i, name in enumerate(FCOS_CLASS_NAMES) if name in ("date", "due")]
+
+    ok = True
+    crops = []
+    for path in image_paths:
+        original = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        height, width = original.shape[:2]
+        image = original[:, :, ::-1] if cfg.INPUT.FORMAT == "RGB" else original
+        resized = aug.get_transform(image).apply_image(image)
+        tensor = torch.as_tensor(resized.astype("float32").transpose(2, 0, 1))
+        inputs = [{"image": tensor, "height": height, "width": width}]
+
+        with torch.no_grad():
+            ref = model(inputs)[0]["instances"]
+            model.backbone = apply_memory_format(model.backbone, "cpu", channels_last=True)
+            with autocast_context("cpu", "bf16"):
+                fast = model(inputs)[0]["instances"]
+            model.backbone = model.backbone.to(memory_format=torch.contiguous_format)
+
+        if len(ref) == 0:
+            # Con pesos entrenados y fotos reales fp32 debe detectar algo
+            print(f"📦 FCOS {path.name}: sin detecciones en fp32")
+            ok = False
+            continue
+
+        top = min(len(ref), 10)
+        ref_boxes = ref.pred_boxes.tensor[:top].float()
+        fast_boxes = fast.pred_boxes.tensor.float()
+        # Emparejar cada caja fp32 con la caja bf16 más cercana de la misma clase
+        diffs = []
+        for box, cls in zip(ref_boxes, ref.pred_classes[:top]):
+            candidates = fast_boxes[fast.pred_classes == cls]
+            if len(candidates) == 0:
+                diffs.append(float("inf"))
+                continue
+            diffs.append((candidates - box).abs().max(dim=1)[0].min().item())
+        max_diff = max(diffs)
+        print(f"📦 FCOS {path.name}: {top} cajas comparadas (bf16: {len(fast)}), diferencia máxima {max_diff:.2f}px")
+        ok = ok and max_diff <= box_tol
+
+        # Las detecciones vienen ordenadas por score: la primera date/due es la mejor
+        for box, cls in zip(ref.pred_boxes.tensor, ref.pred_classes.tolist()):
+            if cls in target_ids:
+                x1, y1, x2, y2 = [int(v) for v in box.tolist()]
+                crop = original[max(0, y1):y2, max(0, x1):x2]
+                if crop.size:
+                    crops.append((path.name, Image.fromarray(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB))))
+                break
+    return ok, crops
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chequeo fp32 vs autocast en CPU")
+    parser.add_argument("--corpus", default=str(BACKEND_DIR / "benchmarks" / "corpus"),
+                        help="Fotos reales para FCOS (solo lectura)")
+    parser.add_argument("--dan-prefix", default=None, help="Prefijo de los checkpoints DAN (por defecto autodetectado)")
+    parser.add_argument("--dan-crops", default=None,
+                        help="Directorio de crops de fecha reales (por defecto, los de FCOS sobre el corpus)")
+    parser.add_argument("--fcos-config", default=str(BACKEND_DIR / "FCOS" / "configs" / "FCOS-Detection" / "expiry_dates_R_50_1x.yaml"))
+    parser.add_argument("--fcos-weights", default=str(BACKEND_DIR / "FCOS" / "output" / "fcos" / "expiry_dates_R_50_1x" / "model_final.pth"),
+                        help="Pesos FCOS de producción (.pth)")
+    parser.add_argument("--samples", type=int, default=0, help="Máximo de imágenes a usar (0 = todas)")
+    parser.add_argument("--box-tol", type=float, default=2.0, help="Tolerancia en píxeles para las cajas FCOS")
+    parser.add_argument("--skip-dan", action="store_true")
+    parser.add_argument("--skip-fcos", action="store_true")
+    parser.add_argument("--bucket", action="store_true", help="Comparar también el preprocesado bucket contra stretch")
+    args = parser.parse_args()
+
+    results = []
+    crops = []
+    if not args.skip_fcos:
+        if not Path(args.fcos_weights).exists():
+            raise SystemExit(f"❌ Pesos FCOS no encontrados: {args.fcos_weights}")
+        fcos_ok, crops = check_fcos(args.fcos_config, args.fcos_weights,
+                                    load_images(args.corpus, args.samples), args.box_tol)
+        results.append(fcos_ok)
+    if not args.skip_dan:
+        if args.dan_crops:
+            from PIL import Image
+            crops = [(path.name, Image.open(path)) for path in load_images(args.dan_crops, args.samples)]
+        elif args.skip_fcos:
+            raise SystemExit("❌ Sin FCOS hace falta --dan-crops con crops reales")
+        results.append(check_dan(args.dan_prefix, crops))
+        if args.bucket:
+            results.append(check_dan_bucket(args.dan_prefix, crops))
+
+    if all(results):
+        print("\n✅ El modo rápido está dentro de la tolerancia")
+    else:
+        print("\n❌ El modo rápido se desvía de fp32")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
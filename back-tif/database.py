@@ -6,21 +6,60 @@ from pymongo.results import DeleteResult, UpdateResult, InsertOneResult
 from dotenv import load_dotenv
 import os
 import asyncio
+import threading
 from typing import Optional, List
+from metrics import DB_OPERATION_SECONDS
 
 load_dotenv()
 
 # MongoDB connection string from environment variable
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 
-# Create MongoDB client
-client = MongoClient(MONGODB_URL)
-db: Database = client.productos_farmacia
-products_collection: Collection = db.products
+DATABASE_NAME = "productos_farmacia"
+
+# MongoClient is not fork-safe (serve.py forks its workers after importing main),
+# so the client is created on first use, and again in every forked process
+_client: Optional[MongoClient] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
+def get_client() -> MongoClient:
+    """MongoDB client of the current process, created lazily"""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = MongoClient(MONGODB_URL)
+                _client_pid = os.getpid()
+    return _client
+
+def use_client(client: MongoClient, database_name: str = None):
+    """Use an already created client for this process (e.g. mongomock in benchmarks)"""
+    global _client, _client_pid, DATABASE_NAME
+    with _client_lock:
+        _client = client
+        _client_pid = os.getpid()
+        if database_name is not None:
+            DATABASE_NAME = database_name
+
+def get_db() -> Database:
+    return get_client()[DATABASE_NAME]
+
+class ProcessLocalCollection:
+    """Collection proxy that resolves to the client of the current process on every access"""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_db()[self._name], attr)
+
+products_collection = ProcessLocalCollection("products")
 
 # Ensure database and collection exist
 def init_db():
     try:
+        db = get_db()
         # Create collection if it doesn't exist
         collections = db.list_collection_names()
         if "products" not in collections:
@@ -35,37 +74,43 @@ def init_db():
 async def find_one_async(collection: Collection, filter_dict: dict) -> Optional[dict]:
     """Async wrapper for find_one operation"""
     loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, collection.find_one, filter_dict)
+    with DB_OPERATION_SECONDS.labels(operation="find_one").time():
+        return await loop.run_in_executor(None, collection.find_one, filter_dict)
 
 async def insert_one_async(collection: Collection, document: dict) -> InsertOneResult:
     """Async wrapper for insert_one operation"""
     loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, collection.insert_one, document)
+    with DB_OPERATION_SECONDS.labels(operation="insert_one").time():
+        return await loop.run_in_executor(None, collection.insert_one, document)
 
 async def update_one_async(collection: Collection, filter_dict: dict, update_dict: dict) -> UpdateResult:
     """Async wrapper for update_one operation"""
     loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, collection.update_one, filter_dict, update_dict)
+    with DB_OPERATION_SECONDS.labels(operation="update_one").time():
+        return await loop.run_in_executor(None, collection.update_one, filter_dict, update_dict)
 
 async def delete_one_async(collection: Collection, filter_dict: dict) -> DeleteResult:
     """Async wrapper for delete_one operation"""
     loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, collection.delete_one, filter_dict)
+    with DB_OPERATION_SECONDS.labels(operation="delete_one").time():
+        return await loop.run_in_executor(None, collection.delete_one, filter_dict)
 
 async def find_async(collection: Collection, filter_dict: dict = None) -> List[dict]:
     """Async wrapper for find operation - returns list instead of cursor"""
     loop = asyncio.get_event_loop()
     if filter_dict is None:
         filter_dict = {}
-    cursor = await loop.run_in_executor(None, collection.find, filter_dict)
-    # Convert cursor to list
-    return await loop.run_in_executor(None, list, cursor)
+    with DB_OPERATION_SECONDS.labels(operation="find").time():
+        cursor = await loop.run_in_executor(None, collection.find, filter_dict)
+        # Convert cursor to list
+        return await loop.run_in_executor(None, list, cursor)
 
 async def count_documents_async(collection: Collection, filter_dict: dict = None) -> int:
     """Async wrapper for count_documents operation"""
     loop = asyncio.get_event_loop()
     if filter_dict is None:
         filter_dict = {}
-    return await loop.run_in_executor(None, collection.count_documents, filter_dict)
+    with DB_OPERATION_SECONDS.labels(operation="count_documents").time():
+        return await loop.run_in_executor(None, collection.count_documents, filter_dict)
 
 # No ejecutamos init_db() aquí, lo haremos en el evento de inicio de FastAPI
\ No newline at end of file
@@ -6,6 +6,7 @@ from PIL import Image
 import cv2
 import base64
 import io
+import time
 from typing import Optional, Tuple, Dict, Any
 import json
 
@@ -14,16 +15,29 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'DAN'))
 
 from DAN import Feature_Extractor, CAM_transposed, DTD
 from utils import cha_encdec
+from inference_mode import INFERENCE_PRECISION, autocast_context, apply_memory_format, describe_inference_mode
+from profiling import profile_section
+
+# Modo de preprocesado: "stretch" (redimensionado fijo a 2048x192) o "bucket"
+# (mantiene la relación de aspecto y rellena hasta el bucket de ancho más cercano).
+# "bucket" es experimental: los deconvs de CAM se entrenaron a ancho completo y el
+# relleno queda fuera de distribución, así que main.py no lo usa hasta que
+# benchmarks/precision_check.py --bucket confirme las mismas fechas que "stretch"
+DAN_PREPROCESS_MODE = os.getenv("DAN_PREPROCESS_MODE", "stretch")
+DAN_WIDTH_BUCKETS = [int(w) for w in os.getenv("DAN_WIDTH_BUCKETS", "256,512,1024,2048").split(",")]
 
 class DateOCRService:
-    def __init__(self, model_path_prefix: str = None):
+    def __init__(self, model_path_prefix: str = None, preprocess_mode: str = None, precision: str = None):
         """
         Servicio de OCR para fechas usando el modelo DAN
         
         Args:
             model_path_prefix: Ruta base a los modelos entrenados (opcional)
+            preprocess_mode: "stretch" o "bucket" (por defecto DAN_PREPROCESS_MODE)
+            precision: "fp32", "fp16" o "bf16" (por defecto INFERENCE_PRECISION)
         """
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.precision = precision or INFERENCE_PRECISION
         
         # Determinar rutas automáticamente basándose en el directorio actual
         current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -65,15 +79,27 @@ class DateOCRService:
         # Configuración del modelo
         self.img_height = 192
         self.img_width = 2048
+        self.preprocess_mode = preprocess_mode or DAN_PREPROCESS_MODE
+        if self.preprocess_mode not in ("stretch", "bucket"):
+            raise ValueError(f"Modo de preprocesado no soportado: {self.preprocess_mode}")
+        # Los anchos deben ser múltiplos de 16 (reducción horizontal del ResNet-45)
+        self.width_buckets = sorted(w for w in DAN_WIDTH_BUCKETS if w % 16 == 0 and w <= self.img_width)
+        if not self.width_buckets or self.width_buckets[-1] != self.img_width:
+            self.width_buckets.append(self.img_width)
         
         print(f"🚀 Inicializando DateOCRService en dispositivo: {self.device}")
         print(f"📁 Cargando modelos desde: {self.model_path_prefix}")
         print(f"📚 Diccionario encontrado en: {self.dict_path}")
+        print(f"📐 Modo de preprocesado: {self.preprocess_mode}")
+        print(f"⚡ Modo de inferencia: {describe_inference_mode()}")
         self._load_models()
     
     def _load_models(self):
         """Cargar los modelos DAN entrenados"""
         try:
+            self.startup_timings = {}
+            phase_start = time.perf_counter()
+            
             # Configuración de la red
             fe_args = {
                 'strides': [(2,2), (2,2), (2,1), (2,2), (2,2), (2,1)],
@@ -95,33 +121,91 @@ class DateOCRService:
                 'dropout': 0.7,
             }
             model_dtd = DTD(**dtd_args)
+            self.startup_timings["build_models"] = time.perf_counter() - phase_start
             
-            # Cargar pesos entrenados
-            model_fe.load_state_dict(torch.load(f"{self.model_path_prefix}_M0.pth", map_location=self.device))
-            model_cam.load_state_dict(torch.load(f"{self.model_path_prefix}_M1.pth", map_location=self.device))
-            model_dtd.load_state_dict(torch.load(f"{self.model_path_prefix}_M2.pth", map_location=self.device))
+            # Cargar pesos entrenados (archivo consolidado con memory-mapping)
+            phase_start = time.perf_counter()
+            state_dicts = self._load_state_dicts()
+            model_fe.load_state_dict(state_dicts["M0"])
+            model_cam.load_state_dict(state_dicts["M1"])
+            model_dtd.load_state_dict(state_dicts["M2"])
+            self.startup_timings["load_weights"] = time.perf_counter() - phase_start
             
             # Mover modelos al dispositivo
+            phase_start = time.perf_counter()
             model_fe = model_fe.to(self.device)
             model_cam = model_cam.to(self.device)
             model_dtd = model_dtd.to(self.device)
             
+            # channels_last para los backbones convolucionales y cudnn.benchmark
+            # (la entrada de DAN tiene forma fija en el modo "stretch")
+            model_fe = apply_memory_format(model_fe, self.device.type)
+            model_cam = apply_memory_format(model_cam, self.device.type)
+            
             # Poner en modo evaluación
             model_fe.eval()
             model_cam.eval()
             model_dtd.eval()
+            self.startup_timings["to_device"] = time.perf_counter() - phase_start
             
             self.models = (model_fe, model_cam, model_dtd)
             
             # Inicializar codificador/decodificador
+            phase_start = time.perf_counter()
             self.encdec = cha_encdec(self.dict_path, case_sensitive=True)
+            self.startup_timings["load_dictionary"] = time.perf_counter() - phase_start
             
             print("✅ Modelos DAN cargados correctamente")
+            print("⏱️ Tiempos de arranque DAN: " + ", ".join(
+                f"{phase}={elapsed * 1000:.1f}ms" for phase, elapsed in self.startup_timings.items()
+            ))
             
         except Exception as e:
             print(f"❌ Error cargando modelos: {e}")
             raise
     
+    def _load_state_dicts(self) -> Dict[str, Dict[str, torch.Tensor]]:
+        """
+        Cargar los state dicts M0/M1/M2 desde un único archivo consolidado
+        
+        Si el archivo consolidado no existe se generan a partir de los tres
+        checkpoints originales y se guarda junto a ellos para los siguientes arranques.
+        
+        Returns:
+            Diccionario {"M0": ..., "M1": ..., "M2": ...}
+        """
+        consolidated_path = f"{self.model_path_prefix}_consolidated.pth"
+        checkpoint_paths = [f"{self.model_path_prefix}_{key}.pth" for key in ("M0", "M1", "M2")]
+        
+        # Regenerar si algún checkpoint original es más reciente que el consolidado
+        is_fresh = os.path.exists(consolidated_path) and all(
+            os.path.getmtime(consolidated_path) >= os.path.getmtime(path)
+            for path in checkpoint_paths if os.path.exists(path)
+        )
+        
+        if is_fresh:
+            try:
+                # mmap evita copiar los pesos a memoria hasta que se usan
+                return torch.load(consolidated_path, map_location="cpu", mmap=True, weights_only=True)
+            except TypeError:
+                # Versiones de torch sin soporte de mmap
+                return torch.load(consolidated_path, map_location="cpu", weights_only=True)
+            except Exception as e:
+                print(f"⚠️ Archivo consolidado inválido ({e}), usando checkpoints individuales")
+        
+        state_dicts = {
+            key: torch.load(path, map_location="cpu", weights_only=True)
+            for key, path in zip(("M0", "M1", "M2"), checkpoint_paths)
+        }
+        
+        try:
+            torch.save(state_dicts, consolidated_path)
+            print(f"💾 Pesos DAN consolidados en: {consolidated_path}")
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar el archivo consolidado: {e}")
+        
+        return state_dicts
+    
     def crop_image_to_scan_rectangle(self, image: Image.Image, scan_rect: Dict[str, Any], screen_dimensions: Dict[str, int]) -> Image.Image:
         """
         Recortar imagen según las coordenadas del recuadro de escaneo
@@ -183,22 +267,52 @@ class DateOCRService:
         if image.mode != 'L':
             image = image.convert('L')
         
-        # Redimensionar
-        image = image.resize((self.img_width, self.img_height), Image.Resampling.LANCZOS)
+        if self.preprocess_mode == "bucket":
+            img_array = self._resize_to_width_bucket(image)
+        else:
+            # Redimensionar
+            image = image.resize((self.img_width, self.img_height), Image.Resampling.LANCZOS)
+            img_array = np.array(image)
         
         # Convertir a tensor y normalizar
-        img_array = np.array(image)
         img_tensor = torch.from_numpy(img_array).float() / 255.0
         img_tensor = img_tensor.unsqueeze(0).unsqueeze(0)  # [1, 1, H, W]
         
         return img_tensor.to(self.device)
     
-    def predict_date(self, image: Image.Image) -> Tuple[str, float]:
+    def _resize_to_width_bucket(self, image: Image.Image) -> np.ndarray:
+        """
+        Redimensionar a la altura del modelo manteniendo la relación de aspecto
+        y rellenar a la derecha hasta el bucket de ancho más pequeño que la contenga
+        
+        Args:
+            image: Imagen PIL en escala de grises
+            
+        Returns:
+            Array [img_height, bucket_width] en uint8
+        """
+        width, height = image.size
+        target_width = max(1, round(width * self.img_height / max(height, 1)))
+        target_width = min(target_width, self.img_width)
+        bucket_width = next(w for w in self.width_buckets if w >= target_width)
+        
+        image = image.resize((target_width, self.img_height), Image.Resampling.BILINEAR)
+        img_array = np.array(image)
+        
+        # Rellenar replicando el borde para no introducir un fondo artificial
+        if target_width < bucket_width:
+            img_array = np.pad(img_array, ((0, 0), (0, bucket_width - target_width)), mode='edge')
+        
+        return img_array
+    
+    def predict_date(self, image: Image.Image, profile: bool = False, profile_tag: str = "") -> Tuple[str, float]:
         """
         Predecir fecha de vencimiento desde una imagen
         
         Args:
             image: Imagen PIL con la fecha
+            profile: Si True, captura el forward de los modelos con torch.profiler
+            profile_tag: Identificador de la petición para el nombre de la traza
             
         Returns:
             Tuple con (fecha_predicha, confianza)
@@ -210,7 +324,8 @@ class DateOCRService:
             # Preprocesar imagen
             input_tensor = self.preprocess_image(image)
             
-            with torch.no_grad():
+            with torch.no_grad(), autocast_context(self.device.type, self.precision), \
+                    profile_section("dan", profile, profile_tag):
                 # Forward pass
                 features = self.models[0](input_tensor)
                 attention_maps = self.models[1](features)
@@ -226,8 +341,8 @@ class DateOCRService:
                     features[-1], attention_maps, dummy_target, dummy_length, test=True
                 )
                 
-                # Decodificar resultado
-                decoded_texts, decoded_probs = self.encdec.decode(output, output_length)
+                # Decodificar resultado (en fp32 para no perder precisión en el softmax)
+                decoded_texts, decoded_probs = self.encdec.decode(output.float(), output_length)
                 
                 predicted_date = decoded_texts[0] if decoded_texts else ""
                 confidence = float(decoded_probs[0]) if decoded_probs else 0.0
@@ -238,8 +353,40 @@ class DateOCRService:
             print(f"❌ Error en predicción: {e}")
             return "", 0.0
     
+    def warmup(self, crop_sizes=((200, 40), (600, 120), (1200, 200)), iterations: int = 2) -> Dict[str, float]:
+        """
+        Ejecutar entradas sintéticas para inicializar kernels y el allocator
+        
+        Args:
+            crop_sizes: Tamaños (ancho, alto) representativos de los crops de fecha
+            iterations: Pasadas adicionales tras la primera
+            
+        Returns:
+            Diccionario con la latencia de la primera y la última inferencia (segundos)
+        """
+        rng = np.random.default_rng(0)
+        crops = [
+            Image.fromarray(rng.integers(0, 256, size=(height, width), dtype=np.uint8), mode='L')
+            for width, height in crop_sizes
+        ]
+        
+        start = time.perf_counter()
+        self.predict_date(crops[0])
+        first_latency = time.perf_counter() - start
+        
+        for _ in range(iterations):
+            for crop in crops:
+                self.predict_date(crop)
+        
+        start = time.perf_counter()
+        self.predict_date(crops[0])
+        warm_latency = time.perf_counter() - start
+        
+        return {"first_latency": first_latency, "warm_latency": warm_latency}
+    
     def process_base64_image(self, base64_string: str, scan_rect: Optional[Dict[str, Any]] = None, 
-                           screen_dimensions: Optional[Dict[str, int]] = None) -> Tuple[str, float]:
+                           screen_dimensions: Optional[Dict[str, int]] = None,
+                           profile: bool = False, profile_tag: str = "") -> Tuple[str, float]:
         """
         Procesar imagen en formato base64 con opción de recorte
         
@@ -247,6 +394,8 @@ class DateOCRService:
             base64_string: Imagen codificada en base64
             scan_rect: Coordenadas del recuadro de escaneo (opcional)
             screen_dimensions: Dimensiones de la pantalla (opcional)
+            profile: Si True, perfila solo el forward de DAN (ver predict_date)
+            profile_tag: Identificador de la petición para el nombre de la traza
             
         Returns:
             Tuple con (fecha_predicha, confianza)
@@ -260,7 +409,7 @@ class DateOCRService:
             if scan_rect and screen_dimensions:
                 image = self.crop_image_to_scan_rectangle(image, scan_rect, screen_dimensions)
             
-            return self.predict_date(image)
+            return self.predict_date(image, profile, profile_tag)
             
         except Exception as e:
             print(f"❌ Error procesando imagen base64: {e}")
@@ -0,0 +1,60 @@
+import os
+from contextlib import nullcontext
+
+# Modo de inferencia rápido para nodos con GPU:
+#   INFERENCE_PRECISION: "fp32" (por defecto), "fp16" o "bf16" (autocast)
+#   INFERENCE_CHANNELS_LAST: usar memory format channels_last en los backbones
+#   INFERENCE_CUDNN_BENCHMARK: activar cudnn.benchmark (útil con la entrada fija de DAN)
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION", "fp32").lower()
+INFERENCE_CHANNELS_LAST = os.getenv("INFERENCE_CHANNELS_LAST", "false").lower() in ("1", "true", "yes")
+INFERENCE_CUDNN_BENCHMARK = os.getenv("INFERENCE_CUDNN_BENCHMARK", "false").lower() in ("1", "true", "yes")
+
+if INFERENCE_PRECISION not in ("fp32", "fp16", "bf16"):
+    raise ValueError(f"INFERENCE_PRECISION no soportado: {INFERENCE_PRECISION}")
+
+
+def get_autocast_dtype(device_type: str, precision: str = None):
+    """
+    Tipo de autocast para el dispositivo, o None si se ejecuta en fp32
+
+    En CPU el autocast solo es fiable con bfloat16, así que fp16 se degrada a bf16.
+    """
+    import torch
+
+    precision = precision or INFERENCE_PRECISION
+    if precision == "fp32":
+        return None
+    if precision == "bf16" or device_type == "cpu":
+        return torch.bfloat16
+    return torch.float16
+
+
+def autocast_context(device_type: str, precision: str = None):
+    """Contexto de autocast según la configuración (nullcontext en fp32)"""
+    import torch
+
+    dtype = get_autocast_dtype(device_type, precision)
+    if dtype is None:
+        return nullcontext()
+    return torch.autocast(device_type=device_type, dtype=dtype)
+
+
+def apply_memory_format(module, device_type: str, channels_last: bool = None):
+    """Convertir los pesos a channels_last si está habilitado y configurar cudnn"""
+    import torch
+
+    if channels_last is None:
+        channels_last = INFERENCE_CHANNELS_LAST
+    if channels_last:
+        module = module.to(memory_format=torch.channels_last)
+    if INFERENCE_CUDNN_BENCHMARK and device_type == "cuda":
+        torch.backends.cudnn.benchmark = True
+    return module
+
+
+def describe_inference_mode() -> str:
+    """Resumen legible de la configuración activa"""
+    return (
+        f"precision={INFERENCE_PRECISION}, channels_last={INFERENCE_CHANNELS_LAST}, "
+        f"cudnn_benchmark={INFERENCE_CUDNN_BENCHMARK}"
+    )
@@ -2,21 +2,40 @@
 
 import io
 import re
+import json
+import hmac
+import sys
+import time
+import asyncio
+import threading
+from pathlib import Path
 from typing import List, Optional, Dict
 import requests
-from fastapi import FastAPI, File, UploadFile, HTTPException, Body, Request
+import cv2
+import numpy as np
+from fastapi import FastAPI, File, UploadFile, HTTPException, Body, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware # Para permitir peticiones del frontend
+from fastapi.responses import JSONResponse, Response
 from product import ProductData
 import os
 from dotenv import load_dotenv
 from database import products_collection, init_db, find_one_async, insert_one_async, update_one_async, find_async, count_documents_async, delete_one_async
 from pymongo.results import DeleteResult, UpdateResult, InsertOneResult
+from profiling import should_profile, profile_section
+from inference_mode import autocast_context, apply_memory_format, describe_inference_mode
+from model_registry import ModelRegistry, BUILTIN_VERSION
+from metrics import (
+    StageTimings, render_metrics, REQUEST_SECONDS, INFERENCE_QUEUE_DEPTH,
+    MODEL_LOADED, MODEL_LOAD_SECONDS, SCANS_TOTAL
+)
 from datetime import datetime, timezone
 import base64
 from PIL import Image
 
 load_dotenv()
 BEARER = os.getenv('BEARER')
+# Token para los endpoints /admin (si no se define, los endpoints quedan deshabilitados)
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
 
 # Variable global para el servicio OCR
 ocr_service = None
@@ -24,10 +43,40 @@ ocr_service = None
 # Variable global para el predictor FCOS
 fcos_predictor = None
 
+# Directorios donde /scan y FCOS guardan imágenes de depuración (el benchmark los
+# redirige a un directorio temporal)
+DEBUG_IMAGES_DIR = os.getenv("DEBUG_IMAGES_DIR", "debug_images")
+FCOS_CROPS_DIR = os.getenv("FCOS_CROPS_DIR", "FCOS/fcos_crops")
+
 # Configuración de rutas FCOS
 FCOS_MODEL_PATH = "FCOS/output/fcos/expiry_dates_R_50_1x/model_final.pth"
 FCOS_CONFIG_PATH = "FCOS/configs/FCOS-Detection/expiry_dates_R_50_1x.yaml"
 
+# Inferencia FCOS multi-resolución: primero una pasada barata a baja resolución
+# y solo si ninguna caja "date"/"due" supera el umbral se repite a resolución completa
+FCOS_MULTIRES_ENABLED = os.getenv("FCOS_MULTIRES_ENABLED", "false").lower() in ("1", "true", "yes")
+FCOS_FAST_MIN_SIZE = int(os.getenv("FCOS_FAST_MIN_SIZE", "480"))
+FCOS_FAST_MAX_SIZE = int(os.getenv("FCOS_FAST_MAX_SIZE", "800"))
+FCOS_FAST_SCORE_THRESH = float(os.getenv("FCOS_FAST_SCORE_THRESH", "0.5"))
+
+# Transformación de la pasada rápida (se crea al construir el primer predictor FCOS)
+fcos_fast_aug = None
+
+# Estadísticas de la inferencia multi-resolución
+# (se actualizan desde los hilos del executor, siempre bajo el lock)
+fcos_multires_stats = {"total": 0, "fast_path": 0}
+fcos_multires_lock = threading.Lock()
+
+# Warm-up de los modelos antes de aceptar tráfico (ver /ready)
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+WARMUP_ITERATIONS = int(os.getenv("WARMUP_ITERATIONS", "2"))
+# Tamaños (ancho, alto) representativos de las fotos enviadas por la app
+WARMUP_IMAGE_SIZES = [(1080, 1920), (720, 1280)]
+
+# Estado de preparación del servicio
+service_ready = False
+warmup_report = {}
+
 def parse_expiration_date(date_string: str) -> datetime:
     """
     Parsear fecha de vencimiento en diferentes formatos
@@ -104,12 +153,10 @@ def parse_expiration_date(date_string: str) -> datetime:
 def get_adet_cfg(config_path: str, model_path: str):
     """Configurar AdelaiDet para FCOS"""
     try:
-        import sys
-        from pathlib import Path
-        
         # Agregar el directorio FCOS al path para importar adet
-        fcos_dir = Path(__file__).parent / "FCOS"
-        sys.path.append(str(fcos_dir))
+        fcos_dir = str(Path(__file__).parent / "FCOS")
+        if fcos_dir not in sys.path:
+            sys.path.append(fcos_dir)
         
         from adet.config import get_cfg as get_adet_cfg
         cfg = get_adet_cfg()
@@ -123,6 +170,41 @@ def get_adet_cfg(config_path: str, model_path: str):
         print(f"❌ Error configurando AdelaiDet: {e}")
         raise
 
+def ensure_fcos_fast_aug():
+    """Crear la transformación de la pasada rápida si está habilitada (una sola vez)"""
+    global fcos_fast_aug
+    
+    if not FCOS_MULTIRES_ENABLED or fcos_fast_aug is not None:
+        return fcos_fast_aug
+    import detectron2.data.transforms as T
+    fcos_fast_aug = T.ResizeShortestEdge(
+        [FCOS_FAST_MIN_SIZE, FCOS_FAST_MIN_SIZE], FCOS_FAST_MAX_SIZE
+    )
+    print(f"[FCOS] Inferencia multi-resolución activa (pasada rápida: {FCOS_FAST_MIN_SIZE}px)")
+    return fcos_fast_aug
+
+def build_fcos_predictor(config_path: str, model_path: str):
+    """Construir un DefaultPredictor FCOS a partir de una configuración y unos pesos"""
+    import torch
+    from detectron2.checkpoint import DetectionCheckpointer
+    from detectron2.engine import DefaultPredictor
+    
+    # Sin pesos en la configuración: DefaultPredictor los cargaría con torch.load sin
+    # weights_only, y un checkpoint del registro podría ejecutar código al deserializarse
+    cfg = get_adet_cfg(config_path, "")
+    predictor = DefaultPredictor(cfg)
+    checkpoint = torch.load(model_path, map_location="cpu", weights_only=True)
+    if "model" not in checkpoint:
+        checkpoint = {"model": checkpoint}
+    DetectionCheckpointer(predictor.model)._load_model(checkpoint)
+    # También para versiones del registro cargadas sin el modelo de arranque
+    ensure_fcos_fast_aug()
+    
+    # Modo rápido opcional: channels_last en el backbone R-50 y cudnn.benchmark
+    device_type = torch.device(cfg.MODEL.DEVICE).type
+    predictor.model.backbone = apply_memory_format(predictor.model.backbone, device_type)
+    return predictor
+
 def initialize_fcos_service():
     """Inicializar el servicio FCOS para inferencia"""
     global fcos_predictor
@@ -140,10 +222,8 @@ def initialize_fcos_service():
     try:
         # Configurar modelo directamente
         print("[FCOS] Configurando modelo...")
-        cfg = get_adet_cfg(FCOS_CONFIG_PATH, FCOS_MODEL_PATH)
-        
-        from detectron2.engine import DefaultPredictor
-        fcos_predictor = DefaultPredictor(cfg)
+        fcos_predictor = build_fcos_predictor(FCOS_CONFIG_PATH, FCOS_MODEL_PATH)
+        print(f"[FCOS] Modo de inferencia: {describe_inference_mode()}")
         
         print("[FCOS] Modelo cargado exitosamente")
         print(f"[FCOS] Modelo: {FCOS_MODEL_PATH}")
@@ -154,37 +234,126 @@ def initialize_fcos_service():
         print(f"[FCOS] Error inicializando: {e}")
         return False
 
-def detect_expiry_dates_with_fcos(image_base64: str) -> dict:
+def run_fcos_predictor(image, aug=None, predictor=None):
+    """
+    Ejecutar el predictor FCOS con una transformación de entrada opcional
+    
+    Replica DefaultPredictor.__call__ pero permite cambiar el redimensionado,
+    de modo que la pasada rápida reutiliza el mismo modelo con menor resolución.
+    
+    Args:
+        image: Imagen BGR como array numpy
+        aug: Transformación de detectron2 (por defecto la del predictor)
+        predictor: Predictor a usar (por defecto el activo)
+        
+    Returns:
+        Instancias detectadas en coordenadas de la imagen original (CPU)
+    """
+    import torch
+    
+    if predictor is None:
+        predictor = fcos_predictor
+    device_type = torch.device(predictor.cfg.MODEL.DEVICE).type
+    
+    with torch.no_grad(), autocast_context(device_type):
+        if aug is None:
+            instances = predictor(image)["instances"].to("cpu")
+        else:
+            original_image = image
+            if predictor.input_format == "RGB":
+                original_image = original_image[:, :, ::-1]
+            height, width = original_image.shape[:2]
+            resized = aug.get_transform(original_image).apply_image(original_image)
+            tensor = torch.as_tensor(resized.astype("float32").transpose(2, 0, 1))
+            inputs = {"image": tensor, "height": height, "width": width}
+            instances = predictor.model([inputs])[0]["instances"].to("cpu")
+    
+    # Con autocast las cajas y scores pueden venir en media precisión
+    instances.pred_boxes.tensor = instances.pred_boxes.tensor.float()
+    instances.scores = instances.scores.float()
+    return instances
+
+def has_confident_due_date(instances, class_names: List[str], score_thresh: float) -> bool:
+    """Indica si alguna caja "date" o "due" supera el umbral de confianza"""
+    if len(instances) == 0:
+        return False
+    target_ids = [i for i, name in enumerate(class_names) if name in ("date", "due")]
+    classes = instances.pred_classes.tolist()
+    scores = instances.scores.tolist()
+    return any(cls in target_ids and score >= score_thresh for cls, score in zip(classes, scores))
+
+def get_fcos_multires_stats() -> dict:
+    """Instantánea coherente de las estadísticas de la inferencia multi-resolución"""
+    with fcos_multires_lock:
+        total, fast_path = fcos_multires_stats["total"], fcos_multires_stats["fast_path"]
+    return {
+        "total_requests": total,
+        "fast_path_requests": fast_path,
+        "fast_path_ratio": fast_path / total if total else 0.0
+    }
+
+def record_fcos_multires(fast_path: bool):
+    """Contabilizar una petición con pasada rápida (thread-safe)"""
+    with fcos_multires_lock:
+        fcos_multires_stats["total"] += 1
+        if fast_path:
+            fcos_multires_stats["fast_path"] += 1
+
+def detect_expiry_dates_with_fcos(image_base64: Optional[str], timings: Optional[StageTimings] = None,
+                                  profile: bool = False, profile_tag: str = "",
+                                  image_data: Optional[bytes] = None, save_crops: bool = True) -> dict:
     """
     Detectar fechas de vencimiento usando FCOS
     
     Args:
         image_base64: Imagen en formato base64
+        timings: Acumulador de tiempos por etapa (opcional)
+        profile: Si True, captura la inferencia con torch.profiler
+        profile_tag: Identificador para los archivos de traza
+        image_data: Bytes JPEG ya decodificados (en lugar de image_base64)
+        save_crops: Si False, no escribe los crops en disco
         
     Returns:
         Resultado de la detección FCOS
     """
-    global fcos_predictor
+    # Tomar la referencia una sola vez: una recarga en caliente no afecta a esta petición
+    predictor = fcos_predictor
     
-    if fcos_predictor is None:
+    if predictor is None:
         return {"success": False, "message": "Servicio FCOS no disponible"}
     
+    if timings is None:
+        timings = StageTimings()
+    start_time = time.perf_counter()
+    
     try:
-        import cv2
-        import numpy as np
-        from datetime import datetime
-        
         # Decodificar imagen
-        image_data = base64.b64decode(image_base64)
-        nparr = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        with timings.stage("fcos_decode"):
+            if image_data is None:
+                image_data = base64.b64decode(image_base64)
+            nparr = np.frombuffer(image_data, np.uint8)
+            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
         if image is None:
             return {"success": False, "message": "No se pudo decodificar la imagen"}
         
-        # Realizar predicción
-        outputs = fcos_predictor(image)
-        instances = outputs["instances"].to("cpu")
+        class_names = ["due", "production", "code", "date"]
+        
+        # Realizar predicción (pasada rápida primero si está habilitada)
+        resolution_pass = "full"
+        if fcos_fast_aug is not None:
+            with timings.stage("fcos_inference_fast"), profile_section("fcos_fast", profile, profile_tag):
+                instances = run_fcos_predictor(image, fcos_fast_aug, predictor)
+            fast_path = has_confident_due_date(instances, class_names, FCOS_FAST_SCORE_THRESH)
+            record_fcos_multires(fast_path)
+            if fast_path:
+                resolution_pass = "fast"
+            else:
+                with timings.stage("fcos_inference"), profile_section("fcos", profile, profile_tag):
+                    instances = run_fcos_predictor(image, predictor=predictor)
+        else:
+            with timings.stage("fcos_inference"), profile_section("fcos", profile, profile_tag):
+                instances = run_fcos_predictor(image, predictor=predictor)
         
         if len(instances) == 0:
             return {"success": False, "message": "No se detectaron regiones de fecha"}
@@ -194,12 +363,12 @@ def detect_expiry_dates_with_fcos(image_base64: str) -> dict:
         classes = instances.pred_classes.numpy()
         scores = instances.scores.numpy()
         
-        class_names = ["due", "production", "code", "date"]
         detections = []
         
         # Crear directorio para crops si no existe
-        crops_dir = "FCOS/fcos_crops"
-        os.makedirs(crops_dir, exist_ok=True)
+        crops_dir = FCOS_CROPS_DIR
+        if save_crops:
+            os.makedirs(crops_dir, exist_ok=True)
         
         # Procesar cada detección
         for i, (box, cls, score) in enumerate(zip(boxes, classes, scores)):
@@ -223,14 +392,18 @@ def detect_expiry_dates_with_fcos(image_base64: str) -> dict:
                 continue
             
             # Convertir crop a base64
-            _, buffer = cv2.imencode('.jpg', crop)
-            crop_base64 = base64.b64encode(buffer).decode('utf-8')
+            with timings.stage("crop_encode"):
+                _, buffer = cv2.imencode('.jpg', crop)
+                crop_base64 = base64.b64encode(buffer).decode('utf-8')
             
             # Guardar crop como archivo
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             class_name = class_names[cls] if cls < len(class_names) else f"class_{cls}"
-            crop_filename = f"{crops_dir}/crop_{i:03d}_{class_name}_score_{score:.2f}_{timestamp}.jpg"
-            cv2.imwrite(crop_filename, crop)
+            crop_filename = None
+            if save_crops:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                crop_filename = f"{crops_dir}/crop_{i:03d}_{class_name}_score_{score:.2f}_{timestamp}.jpg"
+                with timings.stage("crop_write"):
+                    cv2.imwrite(crop_filename, crop)
             
             # Crear resultado de detección
             detection = {
@@ -270,13 +443,182 @@ def detect_expiry_dates_with_fcos(image_base64: str) -> dict:
                 "height": image.shape[0],
                 "channels": image.shape[2] if len(image.shape) > 2 else 1
             },
-            "processing_time": 0.0  # Se puede calcular si es necesario
+            "resolution_pass": resolution_pass,
+            "processing_time": time.perf_counter() - start_time,
+            "timings_ms": timings.as_ms()
         }
         
     except Exception as e:
         print(f"[FCOS] Error en detección: {e}")
         return {"success": False, "message": f"Error en detección FCOS: {str(e)}"}
 
+def warmup_fcos(image_sizes, iterations: int, predictor=None) -> dict:
+    """
+    Ejecutar imágenes sintéticas por FCOS (pasada rápida y completa)
+    
+    Args:
+        image_sizes: Lista de tamaños (ancho, alto)
+        iterations: Pasadas adicionales tras la primera
+        predictor: Predictor a calentar (por defecto el activo)
+        
+    Returns:
+        Diccionario con la latencia de la primera y la última inferencia (segundos)
+    """
+    rng = np.random.default_rng(0)
+    images = [
+        rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        for width, height in image_sizes
+    ]
+    augs = [None] if fcos_fast_aug is None else [fcos_fast_aug, None]
+    
+    start = time.perf_counter()
+    run_fcos_predictor(images[0], predictor=predictor)
+    first_latency = time.perf_counter() - start
+    
+    for _ in range(iterations):
+        for image in images:
+            for aug in augs:
+                run_fcos_predictor(image, aug, predictor)
+    
+    start = time.perf_counter()
+    run_fcos_predictor(images[0], predictor=predictor)
+    warm_latency = time.perf_counter() - start
+    
+    return {"first_latency": first_latency, "warm_latency": warm_latency}
+
+def warmup_models():
+    """Calentar DAN y FCOS y marcar el servicio como listo si ambos están operativos"""
+    global service_ready, warmup_report
+    
+    report = {}
+    errors = {}
+    if ocr_service is None:
+        errors["dan"] = "Modelo no cargado"
+    if fcos_predictor is None:
+        errors["fcos"] = "Modelo no cargado"
+    
+    if WARMUP_ENABLED:
+        print("[WARMUP] Iniciando warm-up de modelos...")
+        if ocr_service is not None:
+            try:
+                report["dan"] = ocr_service.warmup(iterations=WARMUP_ITERATIONS)
+            except Exception as e:
+                print(f"[WARMUP] Error en warm-up DAN: {e}")
+                errors["dan"] = f"Error en warm-up: {e}"
+        if fcos_predictor is not None:
+            try:
+                report["fcos"] = warmup_fcos(WARMUP_IMAGE_SIZES, WARMUP_ITERATIONS)
+            except Exception as e:
+                print(f"[WARMUP] Error en warm-up FCOS: {e}")
+                errors["fcos"] = f"Error en warm-up: {e}"
+        
+        for model_name, latencies in report.items():
+            print(
+                f"[WARMUP] {model_name.upper()}: primera inferencia {latencies['first_latency'] * 1000:.1f}ms, "
+                f"tras warm-up {latencies['warm_latency'] * 1000:.1f}ms"
+            )
+    
+    if errors:
+        report["errors"] = errors
+        warmup_report = report
+        print(f"[WARMUP] Servicio no listo, /ready seguirá en 503: {errors}")
+        return
+    
+    warmup_report = report
+    service_ready = True
+    print("[WARMUP] Servicio listo para recibir escaneos")
+
+def resolve_warmup_error(model_name: str):
+    """
+    Una versión cargada (y calentada) desde el registro resuelve el error de
+    warm-up de su modelo; sin errores pendientes el servicio pasa a estar listo
+    """
+    global service_ready
+    errors = warmup_report.get("errors")
+    if not errors or model_name not in errors:
+        return
+    del errors[model_name]
+    if not errors:
+        del warmup_report["errors"]
+        service_ready = True
+        print(f"[WARMUP] Servicio listo tras cargar {model_name.upper()} desde el registro")
+
+def load_dan_service() -> bool:
+    """Cargar los modelos DAN (se ejecuta en un hilo en segundo plano)"""
+    global ocr_service
+    
+    print("[STARTUP] Cargando modelos DAN...")
+    try:
+        from date_ocr_service import DateOCRService
+        # El API sirve siempre en modo "stretch": "bucket" no tiene aún una
+        # comparación de fechas en crops reales (benchmarks/precision_check.py --bucket)
+        ocr_service = DateOCRService(preprocess_mode="stretch")
+        print("[STARTUP] Modelos DAN cargados exitosamente")
+        return True
+    except Exception as e:
+        print(f"[STARTUP] Error cargando modelos DAN: {e}")
+        print("[STARTUP] El servicio continuará sin modelos DAN")
+        ocr_service = None
+        return False
+
+def load_dan_version(version_dir: str):
+    """Cargar y calentar una versión de DAN del registro (<versión>/dan_M0.pth, ...)"""
+    from date_ocr_service import DateOCRService
+    service = DateOCRService(model_path_prefix=os.path.join(version_dir, "dan"), preprocess_mode="stretch")
+    service.warmup(iterations=1)
+    return service
+
+def load_fcos_version(version_dir: str):
+    """Cargar y calentar una versión de FCOS del registro (<versión>/model_final.pth y config.yaml)"""
+    config_path = os.path.join(version_dir, "config.yaml")
+    if not os.path.exists(config_path):
+        config_path = FCOS_CONFIG_PATH
+    if not os.path.exists(config_path):
+        raise FileNotFoundError(f"Sin config.yaml en {version_dir} ni configuración por defecto")
+    predictor = build_fcos_predictor(config_path, os.path.join(version_dir, "model_final.pth"))
+    warmup_fcos(WARMUP_IMAGE_SIZES, 1, predictor)
+    return predictor
+
+def set_ocr_service(service):
+    global ocr_service
+    ocr_service = service
+    MODEL_LOADED.labels(model="dan").set(1)
+    resolve_warmup_error("dan")
+
+def set_fcos_predictor(predictor):
+    global fcos_predictor
+    fcos_predictor = predictor
+    MODEL_LOADED.labels(model="fcos").set(1)
+    resolve_warmup_error("fcos")
+
+# Registros de versiones con recarga en caliente
+dan_registry = ModelRegistry("dan", load_dan_version, set_ocr_service)
+fcos_registry = ModelRegistry("fcos", load_fcos_version, set_fcos_predictor)
+model_registries = {"dan": dan_registry, "fcos": fcos_registry}
+
+# Modelos ya cargados por el proceso padre en modo multiproceso (ver serve.py)
+models_preloaded = False
+# En modo multiproceso serve.py fija aquí la función que reenvía las órdenes de
+# /admin/models a todos los workers; sin ella se aplican solo en este proceso
+admin_broadcast = None
+# Se marca al terminar el arranque, cuando los modelos iniciales ya están registrados
+startup_complete = threading.Event()
+preloaded_times = {"dan": 0.0, "fcos": 0.0}
+
+def preload_models():
+    """Cargar DAN y FCOS antes de crear los workers para que compartan los pesos"""
+    global models_preloaded
+    dan_loaded, preloaded_times["dan"] = timed_call(load_dan_service)
+    fcos_loaded, preloaded_times["fcos"] = timed_call(initialize_fcos_service)
+    models_preloaded = True
+    return dan_loaded, fcos_loaded
+
+def timed_call(func):
+    """Ejecutar func y devolver (resultado, segundos transcurridos)"""
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
 from contextlib import asynccontextmanager
 
 @asynccontextmanager
@@ -285,33 +627,57 @@ async def lifespan(app: FastAPI):
     global ocr_service, fcos_predictor
     
     print("[STARTUP] Iniciando servicio de API...")
+    startup_start = time.perf_counter()
+    loop = asyncio.get_event_loop()
+    
+    if models_preloaded:
+        # Worker de serve.py: los pesos se heredaron del proceso padre
+        print("[STARTUP] Usando modelos precargados por el proceso padre")
+        dan_future = asyncio.sleep(0, result=(ocr_service is not None, preloaded_times["dan"]))
+        fcos_future = asyncio.sleep(0, result=(fcos_predictor is not None, preloaded_times["fcos"]))
+    else:
+        # Cargar DAN y FCOS en hilos en segundo plano mientras se inicializa la base de datos
+        print("[STARTUP] Cargando DAN y FCOS en paralelo...")
+        dan_future = loop.run_in_executor(None, timed_call, load_dan_service)
+        fcos_future = loop.run_in_executor(None, timed_call, initialize_fcos_service)
     
     # Inicializar base de datos
     print("[STARTUP] Inicializando base de datos...")
-    init_db()
+    _, db_time = await loop.run_in_executor(None, timed_call, init_db)
     print("[STARTUP] Base de datos inicializada")
     
-    # Cargar modelos DAN
-    print("[STARTUP] Cargando modelos DAN...")
-    try:
-        from date_ocr_service import DateOCRService
-        ocr_service = DateOCRService()
-        print("[STARTUP] Modelos DAN cargados exitosamente")
-    except Exception as e:
-        print(f"[STARTUP] Error cargando modelos DAN: {e}")
-        print("[STARTUP] El servicio continuará sin modelos DAN")
-        ocr_service = None
+    (dan_loaded, dan_time), (fcos_loaded, fcos_time) = await asyncio.gather(dan_future, fcos_future)
+    MODEL_LOADED.labels(model="dan").set(1 if dan_loaded else 0)
+    MODEL_LOADED.labels(model="fcos").set(1 if fcos_loaded else 0)
+    MODEL_LOAD_SECONDS.labels(model="dan").set(dan_time)
+    MODEL_LOAD_SECONDS.labels(model="fcos").set(fcos_time)
     
-    # Inicializar servicio FCOS
-    print("[STARTUP] Inicializando servicio FCOS...")
-    fcos_loaded = initialize_fcos_service()
+    # Registrar los modelos del arranque como versión inicial
+    if ocr_service is not None:
+        dan_registry.register(BUILTIN_VERSION, ocr_service, dan_time)
+    if fcos_predictor is not None:
+        fcos_registry.register(BUILTIN_VERSION, fcos_predictor, fcos_time)
     if fcos_loaded:
         print("[STARTUP] Servicio FCOS inicializado exitosamente")
     else:
         print("[STARTUP] El servicio continuará sin FCOS")
     
+    total_time = time.perf_counter() - startup_start
+    print(
+        f"[STARTUP] Tiempos: db={db_time:.2f}s, dan={dan_time:.2f}s, fcos={fcos_time:.2f}s, "
+        f"total={total_time:.2f}s (secuencial: {db_time + dan_time + fcos_time:.2f}s)"
+    )
+    
+    # Warm-up en segundo plano: /health responde mientras /ready sigue en 503
+    warmup_task = loop.run_in_executor(None, warmup_models)
+    
+    startup_complete.set()
+    
     yield
     
+    if not warmup_task.done():
+        warmup_task.cancel()
+    
     # Cleanup (opcional)
     print("[SHUTDOWN] Cerrando servicio de API...")
 
@@ -333,6 +699,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Registrar la latencia de cada petición por endpoint en Prometheus"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Usar la plantilla de la ruta para no crear una serie por barcode
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        REQUEST_SECONDS.labels(
+            method=request.method, endpoint=endpoint, status=str(status)
+        ).observe(time.perf_counter() - start)
+
 # --- Patrones Regex para Fechas (mantener) ---
 DATE_PATTERNS = [
     r'\b\d{2}\s+(?:ENE|FEB|MAR|ABR|MAY|JUN|JUL|AGO|SEP|OCT|NOV|DIC)\s+\d{4}\b',  # DD MMM YYYY
@@ -427,7 +810,10 @@ async def root():
             "get_product_by_barcode": "/get-product-by-barcode",
             "scan_expiration_date": "/scan-expiration-date",
             "detect_expiry_fcos": "/detect-expiry-fcos",
-            "confirm_and_save_product": "/confirm-and-save-product"
+            "scan_stream": "/ws/scan",
+            "confirm_and_save_product": "/confirm-and-save-product",
+            "ready": "/ready",
+            "metrics": "/metrics"
         },
         "services": {
             "database": "Conectado",
@@ -445,14 +831,117 @@ async def health_check():
     
     return {
         "status": "healthy",
+        "ready": service_ready,
         "timestamp": datetime.now(timezone.utc).isoformat(),
         "services": {
             "database": "ok",
             "ocr_service": "ok" if ocr_service is not None else "error",
             "fcos_service": "ok" if fcos_predictor is not None else "error"
+        },
+        "fcos_multires": {
+            "enabled": fcos_fast_aug is not None,
+            **get_fcos_multires_stats()
         }
     }
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Métricas en formato Prometheus"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/ready")
+async def readiness_check():
+    """Endpoint de readiness: 200 solo con DAN y FCOS cargados y calentados (si no, 503 con los errores)"""
+    body = {
+        "ready": service_ready,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "warmup": warmup_report
+    }
+    if not service_ready:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+def check_admin_token(request: Request):
+    """Validar X-Admin-Token; sin ADMIN_TOKEN configurado los endpoints /admin no existen"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Endpoints /admin deshabilitados (ADMIN_TOKEN no configurado)")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Token de administración inválido")
+
+def apply_model_command(command: dict):
+    """
+    Aplicar en este proceso una orden reenviada por serve.py y esperar a que termine
+    
+    Args:
+        command: {"action": "load", "model": ..., "version": ...} o {"action": "rollback", "model": ...}
+    """
+    registry = model_registries[command["model"]]
+    if command["action"] == "load":
+        registry.load_async(command["version"]).result()
+    elif command["action"] == "rollback":
+        registry.rollback()
+    else:
+        raise ValueError(f"Orden desconocida: {command['action']}")
+
+def get_model_registry(model_name: str) -> ModelRegistry:
+    registry = model_registries.get(model_name)
+    if registry is None:
+        raise HTTPException(status_code=404, detail=f"Modelo desconocido: {model_name}")
+    return registry
+
+@app.get("/admin/models")
+async def list_model_versions(request: Request):
+    """Estado del registro de modelos: versión activa, anterior, en carga y disponibles"""
+    check_admin_token(request)
+    return {name: registry.status() for name, registry in model_registries.items()}
+
+@app.post("/admin/models/{model_name}/load")
+async def load_model_version(request: Request, model_name: str, version: str = Body(..., embed=True)):
+    """
+    Cargar una versión en segundo plano; se activa sola cuando está lista
+    
+    Las peticiones en curso terminan con la versión anterior. Con serve.py la
+    orden se reenvía a todos los workers, que cargan la versión por su cuenta.
+    """
+    check_admin_token(request)
+    registry = get_model_registry(model_name)
+    try:
+        if admin_broadcast is not None:
+            registry.resolve_version(version)
+            admin_broadcast({"action": "load", "model": model_name, "version": version})
+        else:
+            registry.load_async(version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return JSONResponse(
+        status_code=202,
+        content={"message": f"Cargando {model_name} versión '{version}'", "status": registry.status()}
+    )
+
+@app.post("/admin/models/{model_name}/rollback")
+async def rollback_model_version(request: Request, model_name: str):
+    """Volver a la versión anterior del modelo"""
+    check_admin_token(request)
+    registry = get_model_registry(model_name)
+    if admin_broadcast is not None:
+        if registry.previous is None:
+            raise HTTPException(status_code=409, detail=f"No hay versión anterior de {model_name} para volver atrás")
+        admin_broadcast({"action": "rollback", "model": model_name})
+        return JSONResponse(
+            status_code=202,
+            content={"message": f"{model_name} volviendo a la versión '{registry.previous.version}'", "status": registry.status()}
+        )
+    try:
+        version = registry.rollback()
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"message": f"{model_name} volvió a la versión '{version}'", "status": registry.status()}
+
 @app.post("/get-product-by-barcode")
 async def get_product_by_barcode_endpoint(barcode: str = Body(..., embed=True)):
     """
@@ -695,6 +1184,7 @@ async def create_product(product: dict = Body(...)):
 
 @app.post("/scan-expiration-date")
 async def scan_expiration_date(
+    request: Request,
     barcode: str = Body(..., embed=True), 
     image_base64: str = Body(..., embed=True),
     use_fcos_detection: bool = Body(True, embed=True),  # Nuevo parámetro
@@ -719,32 +1209,47 @@ async def scan_expiration_date(
     print(f"[SCAN] Iniciando escaneo de fecha para barcode: {barcode}")
     print(f"[SCAN] Usando detección automática: {use_fcos_detection}")
     
+    loop = asyncio.get_event_loop()
+    timings = StageTimings()
+    profile = should_profile(request.headers)
+    INFERENCE_QUEUE_DEPTH.inc()
     try:
-        global ocr_service
+        # Tomar la referencia una sola vez: una recarga en caliente no afecta a esta petición
+        service = ocr_service
         
         # Verificar que el servicio OCR esté disponible
-        if ocr_service is None:
+        if service is None:
             raise HTTPException(
                 status_code=503, 
                 detail="Servicio OCR no disponible. Los modelos DAN no se pudieron cargar al inicio del servicio."
             )
         
+        def run_dan(dan_image_base64, dan_scan_rectangle, dan_screen_dimensions):
+            """Paso DAN completo (se ejecuta en un hilo del executor)"""
+            with timings.stage("dan"):
+                return service.process_base64_image(
+                    dan_image_base64, dan_scan_rectangle, dan_screen_dimensions, profile, profile_tag
+                )
+        
         # Crear directorio para guardar imágenes si no existe
-        images_dir = "debug_images"
+        images_dir = DEBUG_IMAGES_DIR
         if not os.path.exists(images_dir):
             os.makedirs(images_dir)
         
         # Generar nombre único para la imagen
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"{images_dir}/barcode_{barcode}_{timestamp}.jpg"
+        profile_tag = f"{barcode}_{timestamp}"
         cropped_filename = None
         fcos_result = None
         
         # Decodificar y guardar la imagen original
         try:
-            image_data = base64.b64decode(image_base64)
-            with open(filename, "wb") as f:
-                f.write(image_data)
+            with timings.stage("base64_decode"):
+                image_data = base64.b64decode(image_base64)
+            with timings.stage("save_original"):
+                with open(filename, "wb") as f:
+                    f.write(image_data)
             print(f"[SCAN] Imagen original guardada: {filename}")
             
         except Exception as save_error:
@@ -754,7 +1259,9 @@ async def scan_expiration_date(
         if use_fcos_detection:
             print("[SCAN] Paso 1: Detectando región con FCOS...")
             try:
-                fcos_result = detect_expiry_dates_with_fcos(image_base64)
+                fcos_result = await loop.run_in_executor(
+                    None, detect_expiry_dates_with_fcos, image_base64, timings, profile, profile_tag
+                )
                 if fcos_result and fcos_result.get("success") and fcos_result.get("best_due_date"):
                     best_detection = fcos_result["best_due_date"]
                     print(f"[SCAN] FCOS detectó fecha de vencimiento con confianza: {best_detection['confidence']:.3f}")
@@ -765,7 +1272,8 @@ async def scan_expiration_date(
                     
                     # Paso 2: Procesar crop con DAN
                     print("[SCAN] Paso 2: Extrayendo texto con DAN...")
-                    predicted_date, confidence = ocr_service.process_base64_image(
+                    predicted_date, confidence = await loop.run_in_executor(
+                        None, run_dan,
                         crop_base64, 
                         None,  # No usar scan_rectangle con FCOS
                         None   # No usar screen_dimensions con FCOS
@@ -774,19 +1282,15 @@ async def scan_expiration_date(
                 else:
                     print("[SCAN] FCOS no detectó fecha de vencimiento, usando método manual")
                     # Fallback al método manual
-                    predicted_date, confidence = ocr_service.process_base64_image(
-                        image_base64, 
-                        scan_rectangle, 
-                        screen_dimensions
+                    predicted_date, confidence = await loop.run_in_executor(
+                        None, run_dan, image_base64, scan_rectangle, screen_dimensions
                     )
                     
             except Exception as fcos_error:
                 print(f"[SCAN] Error con FCOS: {fcos_error}, usando método manual")
                 # Fallback al método manual
-                predicted_date, confidence = ocr_service.process_base64_image(
-                    image_base64, 
-                    scan_rectangle, 
-                    screen_dimensions
+                predicted_date, confidence = await loop.run_in_executor(
+                    None, run_dan, image_base64, scan_rectangle, screen_dimensions
                 )
         
         else:
@@ -795,31 +1299,36 @@ async def scan_expiration_date(
             
             # Si se proporcionan coordenadas de recorte, guardar también la imagen recortada
             if scan_rectangle and screen_dimensions:
-                # Crear imagen PIL
-                image = Image.open(io.BytesIO(image_data))
+                cropped_filename = f"{images_dir}/barcode_{barcode}_{timestamp}_cropped.jpg"
                 
-                # Usar el servicio OCR global para recortar
-                cropped_image = ocr_service.crop_image_to_scan_rectangle(image, scan_rectangle, screen_dimensions)
+                def save_cropped():
+                    # Crear imagen PIL y recortar con el servicio OCR
+                    image = Image.open(io.BytesIO(image_data))
+                    cropped_image = service.crop_image_to_scan_rectangle(image, scan_rectangle, screen_dimensions)
+                    
+                    # Guardar imagen recortada
+                    with timings.stage("save_cropped"):
+                        cropped_image.save(cropped_filename)
                 
-                # Guardar imagen recortada
-                cropped_filename = f"{images_dir}/barcode_{barcode}_{timestamp}_cropped.jpg"
-                cropped_image.save(cropped_filename)
+                await loop.run_in_executor(None, save_cropped)
                 print(f"[SCAN] Imagen recortada guardada: {cropped_filename}")
             
             # Procesar la imagen (con recorte si se proporcionan coordenadas)
-            predicted_date, confidence = ocr_service.process_base64_image(
-                image_base64, 
-                scan_rectangle, 
-                screen_dimensions
+            predicted_date, confidence = await loop.run_in_executor(
+                None, run_dan, image_base64, scan_rectangle, screen_dimensions
             )
         
+        print(f"[SCAN] Tiempos (ms): {timings.as_ms()}" + (" [perfilado]" if profile else ""))
+        
         # Validar que se obtuvo una fecha
         if not predicted_date or confidence < 0.1:
+            SCANS_TOTAL.labels(result="no_date").inc()
             return {
                 "predicted_date": "",
                 "confidence": 0.0,
                 "success": False,
                 "message": "No se pudo detectar una fecha válida en la imagen",
+                "timings_ms": timings.as_ms(),
                 "debug_info": {
                     "image_saved": filename if 'filename' in locals() else None,
                     "cropped_image": cropped_filename,
@@ -835,6 +1344,7 @@ async def scan_expiration_date(
         # NO guardar automáticamente el producto aquí
         # El producto se guardará cuando el usuario confirme en el frontend
         print(f"[SCAN] Escaneo completado - fecha detectada: {predicted_date} (confianza: {confidence:.2f})")
+        SCANS_TOTAL.labels(result="success").inc()
         
         # Preparar información de FCOS para la respuesta
         fcos_info = None
@@ -861,6 +1371,7 @@ async def scan_expiration_date(
             "success": True,
             "message": "Fecha detectada correctamente",
             "fcos_info": fcos_info,
+            "timings_ms": timings.as_ms(),
             "debug_info": {
                 "image_saved": filename if 'filename' in locals() else None,
                 "cropped_image": cropped_filename,
@@ -875,13 +1386,172 @@ async def scan_expiration_date(
         
     except Exception as e:
         print(f"[SCAN] Error en scan_expiration_date: {e}")
+        SCANS_TOTAL.labels(result="error").inc()
         raise HTTPException(
             status_code=500, 
             detail=f"Error procesando la imagen: {str(e)}"
         )
+    finally:
+        INFERENCE_QUEUE_DEPTH.dec()
+
+class LatestFrameSlot:
+    """
+    Hueco "gana el último" con el siguiente frame pendiente de una conexión
+    
+    Un frame nuevo reemplaza al pendiente, de modo que tras cada inferencia solo
+    se procesa el frame más reciente y los intermedios se descartan.
+    """
+    
+    def __init__(self):
+        self.frame_id = None
+        self.frame = None
+        self.ready = asyncio.Event()
+    
+    def put(self, frame_id: int, frame: bytes) -> Optional[int]:
+        """Guardar el frame y devolver el id del frame pendiente que reemplaza (o None)"""
+        replaced = self.frame_id
+        self.frame_id, self.frame = frame_id, frame
+        self.ready.set()
+        return replaced
+    
+    def has_pending(self) -> bool:
+        return self.frame_id is not None
+    
+    async def take(self):
+        """Esperar y retirar el frame pendiente: (frame_id, frame)"""
+        while self.frame_id is None:
+            self.ready.clear()
+            await self.ready.wait()
+        item = (self.frame_id, self.frame)
+        self.frame_id = self.frame = None
+        return item
+
+async def process_stream_frame(websocket: WebSocket, frame_id: int, frame: bytes, barcode: str,
+                               slot: LatestFrameSlot):
+    """
+    Procesar un frame del canal de streaming: enviar las cajas FCOS en cuanto
+    están listas y después la lectura DAN
+    
+    Si al terminar FCOS ya hay un frame más reciente en el hueco, la lectura DAN
+    de este frame se omite ({"type": "cancelled"}) para pasar al nuevo cuanto antes.
+    """
+    loop = asyncio.get_event_loop()
+    timings = StageTimings()
+    service = ocr_service
+    INFERENCE_QUEUE_DEPTH.inc()
+    try:
+        # Paso 1: FCOS
+        fcos_result = await loop.run_in_executor(
+            None,
+            lambda: detect_expiry_dates_with_fcos(None, timings, image_data=frame, save_crops=False)
+        )
+        best = fcos_result.get("best_due_date") if fcos_result.get("success") else None
+        await websocket.send_json({
+            "type": "detection",
+            "frame_id": frame_id,
+            "success": best is not None,
+            "message": fcos_result.get("message"),
+            "best_due_date": {k: v for k, v in best.items() if k != "crop_base64"} if best else None,
+            "detections": [
+                {k: v for k, v in detection.items() if k != "crop_base64"}
+                for detection in fcos_result.get("all_detections", [])
+            ],
+            "resolution_pass": fcos_result.get("resolution_pass"),
+            "timings_ms": timings.as_ms()
+        })
+        
+        if best is None or service is None:
+            SCANS_TOTAL.labels(result="no_date").inc()
+            return
+        
+        if slot.has_pending():
+            await websocket.send_json({"type": "cancelled", "frame_id": frame_id})
+            return
+        
+        # Paso 2: DAN sobre el crop de la mejor detección
+        with timings.stage("dan"):
+            predicted_date, confidence = await loop.run_in_executor(
+                None, service.process_base64_image, best["crop_base64"], None, None
+            )
+        success = bool(predicted_date) and confidence >= 0.1
+        SCANS_TOTAL.labels(result="success" if success else "no_date").inc()
+        print(f"[STREAM] Frame {frame_id} ({barcode}): '{predicted_date}' ({confidence:.2f}) {timings.as_ms()}")
+        await websocket.send_json({
+            "type": "reading",
+            "frame_id": frame_id,
+            "success": success,
+            "predicted_date": predicted_date if success else "",
+            "confidence": float(confidence) if success else 0.0,
+            "timings_ms": timings.as_ms()
+        })
+    except Exception as e:
+        print(f"[STREAM] Error procesando frame {frame_id}: {e}")
+        SCANS_TOTAL.labels(result="error").inc()
+        try:
+            await websocket.send_json({"type": "error", "frame_id": frame_id, "message": str(e)})
+        except Exception:
+            pass
+    finally:
+        INFERENCE_QUEUE_DEPTH.dec()
+
+@app.websocket("/ws/scan")
+async def scan_stream(websocket: WebSocket):
+    """
+    Canal de escaneo en streaming para una sesión de conteo
+    
+    Protocolo:
+        - Mensaje de texto JSON opcional: {"barcode": "..."} (también ?barcode= en la URL)
+        - Mensaje binario: un frame JPEG; el servidor le asigna un frame_id incremental
+        - Respuestas: {"type": "frame", ...} al recibir el frame, {"type": "detection", ...}
+          al terminar FCOS y {"type": "reading", ...} al terminar DAN
+        - Como mucho hay una inferencia en curso por conexión: los frames que llegan
+          mientras tanto esperan en un hueco donde el más reciente reemplaza al
+          anterior, que se descarta ({"type": "cancelled"})
+    """
+    await websocket.accept()
+    session = {"barcode": websocket.query_params.get("barcode", "")}
+    frame_id = 0
+    slot = LatestFrameSlot()
+    print(f"[STREAM] Sesión abierta (barcode: {session['barcode'] or '-'})")
+    
+    async def process_frames():
+        while True:
+            next_id, frame = await slot.take()
+            await process_stream_frame(websocket, next_id, frame, session["barcode"], slot)
+    
+    processor = asyncio.create_task(process_frames())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            
+            if message.get("text") is not None:
+                try:
+                    session["barcode"] = json.loads(message["text"]).get("barcode", session["barcode"])
+                except (ValueError, AttributeError):
+                    await websocket.send_json({"type": "error", "message": "Mensaje de control inválido"})
+                continue
+            
+            frame = message.get("bytes")
+            if not frame:
+                continue
+            
+            # El frame más reciente reemplaza al pendiente; el que está en curso termina
+            frame_id += 1
+            await websocket.send_json({"type": "frame", "frame_id": frame_id})
+            replaced = slot.put(frame_id, frame)
+            if replaced is not None:
+                await websocket.send_json({"type": "cancelled", "frame_id": replaced})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        processor.cancel()
+        print(f"[STREAM] Sesión cerrada tras {frame_id} frames")
 
 @app.post("/detect-expiry-fcos")
 async def detect_expiry_fcos_endpoint(
+    request: Request,
     image_base64: str = Body(..., embed=True)
 ):
     """
@@ -896,7 +1566,11 @@ async def detect_expiry_fcos_endpoint(
     print("[FCOS] Iniciando detección...")
     
     try:
-        fcos_result = detect_expiry_dates_with_fcos(image_base64)
+        profile = should_profile(request.headers)
+        with INFERENCE_QUEUE_DEPTH.track_inprogress():
+            fcos_result = await asyncio.get_event_loop().run_in_executor(
+                None, lambda: detect_expiry_dates_with_fcos(image_base64, profile=profile)
+            )
         
         if fcos_result.get("success"):
             print(f"[FCOS] Detectó {len(fcos_result.get('all_detections', []))} regiones")
@@ -1061,6 +1735,8 @@ async def confirm_and_save_product(
 # Para ejecutar el backend:
 # fastapi dev main.py
 # (Configurado en pyproject.toml para host 0.0.0.0 y puerto 8000)
+# Varios workers compartiendo los pesos de los modelos:
+# python serve.py --workers 4
 
 if __name__ == "__main__":
     import uvicorn
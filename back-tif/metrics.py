@@ -0,0 +1,89 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from prometheus_client import (
+    Counter, Gauge, Histogram, CollectorRegistry, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+
+# Con serve.py cada worker escribe sus métricas en PROMETHEUS_MULTIPROC_DIR y /metrics
+# agrega las de todos los procesos; multiprocess_mode indica cómo combinar los gauges
+
+# Buckets pensados para etapas de inferencia (ms a varios segundos)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Latencia por etapa del pipeline de escaneo (decode, fcos, dan, disco, ...)
+SCAN_STAGE_SECONDS = Histogram(
+    "scan_stage_seconds",
+    "Duración de cada etapa del pipeline de escaneo",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Latencia total por endpoint HTTP
+REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "Duración de las peticiones HTTP por endpoint",
+    ["method", "endpoint", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Latencia de las operaciones de MongoDB
+DB_OPERATION_SECONDS = Histogram(
+    "db_operation_seconds",
+    "Duración de las operaciones de base de datos",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Peticiones de inferencia en curso o esperando (FCOS + DAN)
+INFERENCE_QUEUE_DEPTH = Gauge(
+    "inference_queue_depth",
+    "Peticiones de inferencia en curso o en espera",
+    multiprocess_mode="livesum",
+)
+
+# Estado y duración de la carga de modelos (una serie por worker en modo multiproceso)
+MODEL_LOADED = Gauge("model_loaded", "1 si el modelo está cargado", ["model"], multiprocess_mode="liveall")
+MODEL_LOAD_SECONDS = Gauge(
+    "model_load_seconds", "Duración de la carga del modelo", ["model"], multiprocess_mode="liveall"
+)
+
+# Resultado de los escaneos
+SCANS_TOTAL = Counter("scans_total", "Escaneos procesados", ["result"])
+
+
+class StageTimings:
+    """Acumula la duración de las etapas de una petición y las exporta a Prometheus"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Medir un bloque como la etapa `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, elapsed: float):
+        """Registrar una duración ya medida (segundos)"""
+        self.stages[name] = self.stages.get(name, 0.0) + elapsed
+        SCAN_STAGE_SECONDS.labels(stage=name).observe(elapsed)
+
+    def as_ms(self) -> Dict[str, float]:
+        """Duraciones en milisegundos, para incluir en la respuesta"""
+        return {name: round(elapsed * 1000, 2) for name, elapsed in self.stages.items()}
+
+
+def render_metrics():
+    """Devuelve (contenido, content_type) en el formato de exposición de Prometheus"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # Agregar las métricas de todos los workers, no solo las de este proceso
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
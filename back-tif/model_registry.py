@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+# Directorio raíz del registro: <MODEL_REGISTRY_DIR>/<modelo>/<versión>/
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "models/registry")
+
+# Versión con la que se registran los modelos cargados desde las rutas históricas
+BUILTIN_VERSION = "builtin"
+
+
+class ModelVersion:
+    """Un modelo cargado junto con su versión"""
+
+    def __init__(self, version: str, model: Any, load_time: float = 0.0):
+        self.version = version
+        self.model = model
+        self.load_time = load_time
+        self.loaded_at = time.time()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "load_time": round(self.load_time, 3),
+            "loaded_at": self.loaded_at,
+        }
+
+
+class ModelRegistry:
+    """
+    Registro de versiones de un modelo con recarga en caliente
+
+    La nueva versión se carga en un hilo en segundo plano y, cuando está lista,
+    se activa reasignando una única referencia. Las peticiones en curso conservan
+    la referencia que tomaron al empezar, por lo que terminan con el modelo
+    anterior sin cortes. La versión anterior se conserva para poder volver atrás.
+    """
+
+    def __init__(self, name: str, loader: Callable[[str], Any],
+                 on_activate: Optional[Callable[[Any], None]] = None):
+        """
+        Args:
+            name: Nombre del modelo ("dan", "fcos")
+            loader: Función que recibe el directorio de la versión y devuelve el modelo
+            on_activate: Callback con el modelo recién activado (p. ej. actualizar una global)
+        """
+        self.name = name
+        self.root = os.path.join(MODEL_REGISTRY_DIR, name)
+        self._loader = loader
+        self._on_activate = on_activate
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-loader")
+        self.active: Optional[ModelVersion] = None
+        self.previous: Optional[ModelVersion] = None
+        self.loading: Optional[str] = None
+        self.last_error: Optional[str] = None
+
+    def available_versions(self) -> List[str]:
+        """Versiones presentes en disco, ordenadas"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            entry for entry in os.listdir(self.root)
+            if os.path.isdir(os.path.join(self.root, entry))
+        )
+
+    def get(self) -> Any:
+        """Modelo activo (o None); tomar la referencia una vez por petición"""
+        active = self.active
+        return active.model if active is not None else None
+
+    def register(self, version: str, model: Any, load_time: float = 0.0):
+        """Activar un modelo ya cargado (p. ej. el del arranque)"""
+        self._activate(ModelVersion(version, model, load_time))
+
+    def resolve_version(self, version: str) -> str:
+        """
+        Directorio de una versión del registro
+
+        Raises:
+            ValueError: si el nombre de la versión no es un directorio simple
+            FileNotFoundError: si la versión no existe en el registro
+        """
+        # Solo nombres de directorio del propio registro: nada de rutas ni ".."
+        if not version or version in (".", "..") or os.sep in version or \
+                (os.altsep and os.altsep in version):
+            raise ValueError(f"Nombre de versión inválido: '{version}'")
+        if version not in self.available_versions():
+            raise FileNotFoundError(f"Versión '{version}' de {self.name} no encontrada en {self.root}")
+        return os.path.join(self.root, version)
+
+    def load_async(self, version: str) -> Future:
+        """
+        Cargar una versión en segundo plano y activarla al terminar
+
+        Raises:
+            ValueError: si el nombre de la versión no es un directorio simple
+            FileNotFoundError: si la versión no existe en el registro
+            RuntimeError: si ya hay una carga en curso
+        """
+        version_dir = self.resolve_version(version)
+
+        with self._lock:
+            if self.loading is not None:
+                raise RuntimeError(f"Ya se está cargando la versión '{self.loading}' de {self.name}")
+            self.loading = version
+            self.last_error = None
+
+        return self._executor.submit(self._load, version, version_dir)
+
+    def rollback(self) -> str:
+        """
+        Volver a la versión anterior
+
+        Raises:
+            RuntimeError: si no hay versión anterior
+        """
+        with self._lock:
+            if self.previous is None:
+                raise RuntimeError(f"No hay versión anterior de {self.name} para volver atrás")
+            previous = self.previous
+        self._activate(previous)
+        return previous.version
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "active": self.active.describe() if self.active else None,
+            "previous": self.previous.describe() if self.previous else None,
+            "loading": self.loading,
+            "last_error": self.last_error,
+            "available": self.available_versions(),
+        }
+
+    def _load(self, version: str, version_dir: str):
+        print(f"[REGISTRY] Cargando {self.name} versión '{version}' desde {version_dir}...")
+        start = time.perf_counter()
+        try:
+            model = self._loader(version_dir)
+            self._activate(ModelVersion(version, model, time.perf_counter() - start))
+            print(f"[REGISTRY] {self.name} versión '{version}' activa ({time.perf_counter() - start:.2f}s)")
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"[REGISTRY] Error cargando {self.name} versión '{version}': {e}")
+            raise
+        finally:
+            with self._lock:
+                self.loading = None
+
+    def _activate(self, new_version: ModelVersion):
+        with self._lock:
+            if self.active is not None and self.active is not new_version:
+                self.previous = self.active
+            self.active = new_version
+        if self._on_activate is not None:
+            self._on_activate(new_version.model)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Script para perfilar el tiempo de importación y de arranque del backend
+
+Uso:
+    python profile_startup.py            # perfila "import main"
+    python profile_startup.py --top 30   # muestra los 30 módulos más lentos
+    python profile_startup.py --module date_ocr_service
+"""
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+
+def run_importtime(module: str):
+    """Importa el módulo en un proceso nuevo con -X importtime y devuelve las entradas"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=Path(__file__).parent,
+        capture_output=True,
+        text=True,
+    )
+
+    entries = []
+    for line in result.stderr.splitlines():
+        # Formato: "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            _, data = line.split(":", 1)
+            self_us, cumulative_us, name = data.split("|")
+            # La indentación del nombre indica el nivel de anidamiento
+            entries.append((name[1:].rstrip(), int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+
+    return result.returncode, entries
+
+
+def print_report(module: str, entries, top: int):
+    """Imprime el resumen de los imports más costosos"""
+    # Solo módulos de primer nivel para el total acumulado
+    total_us = sum(cumulative for name, _, cumulative in entries if not name.startswith(" "))
+
+    print(f"📦 Perfil de importación de '{module}'")
+    print(f"   - Módulos importados: {len(entries)}")
+    print(f"   - Tiempo total: {total_us / 1e6:.3f}s")
+
+    print(f"\n🐢 Top {top} por tiempo acumulado:")
+    for name, self_us, cumulative_us in sorted(entries, key=lambda e: e[2], reverse=True)[:top]:
+        print(f"   {cumulative_us / 1e3:10.1f}ms  (propio {self_us / 1e3:8.1f}ms)  {name.strip()}")
+
+    heavy = [name.strip() for name, _, _ in entries if name.strip() in ("torch", "detectron2", "adet", "cv2", "numpy")]
+    print(f"\n🔎 Módulos pesados importados en el arranque: {', '.join(heavy) if heavy else 'ninguno'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perfil de importación del backend")
+    parser.add_argument("--module", default="main", help="Módulo a importar (por defecto: main)")
+    parser.add_argument("--top", type=int, default=20, help="Cantidad de módulos a mostrar")
+    args = parser.parse_args()
+
+    returncode, entries = run_importtime(args.module)
+    if returncode != 0:
+        print(f"❌ Error importando '{args.module}' (código {returncode})")
+    if not entries:
+        print("⚠️  No se obtuvieron datos de importación")
+        return
+
+    print_report(args.module, entries, args.top)
+    print("\n💡 Los tiempos de carga de DAN/FCOS se registran al iniciar el servidor ([STARTUP] Tiempos: ...)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Mapping, Optional
+
+# Perfilado opt-in de las peticiones de escaneo con torch.profiler
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MAX_TRACES = int(os.getenv("PROFILE_MAX_TRACES", "20"))
+PROFILE_HEADER = "x-profile"
+
+# Un solo hilo: las trazas se escriben en orden y fuera del camino de la petición
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+
+# Kineto admite una sola sesión de perfilado por proceso: con los escaneos en hilos
+# del executor, una segunda sesión simultánea cancelaría la traza en curso
+_session_lock = threading.Lock()
+
+
+def should_profile(headers: Optional[Mapping[str, str]] = None) -> bool:
+    """Perfilar si la petición trae X-Profile: 1 o si cae en el muestreo"""
+    if headers is not None and headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes"):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+@contextmanager
+def profile_section(name: str, enabled: bool, tag: str = ""):
+    """
+    Ejecutar el bloque bajo torch.profiler si `enabled`
+
+    Si otra sección se está perfilando en ese momento, el bloque se ejecuta sin
+    perfilar en lugar de esperar o de cancelar la otra traza.
+
+    Args:
+        name: Nombre de la sección ("fcos", "dan", ...)
+        enabled: Si es False el bloque se ejecuta sin overhead
+        tag: Identificador de la petición para el nombre de archivo
+    """
+    if not enabled:
+        yield
+        return
+
+    if not _session_lock.acquire(blocking=False):
+        print(f"[PROFILE] Sesión de perfilado en curso, se omite '{name}'" + (f" ({tag})" if tag else ""))
+        yield
+        return
+    try:
+        with _profile(name, tag):
+            yield
+    finally:
+        _session_lock.release()
+
+
+@contextmanager
+def _profile(name: str, tag: str):
+    """Perfilar el bloque y encolar la escritura de la traza"""
+    import torch
+    from torch.profiler import profile, ProfilerActivity
+
+    activities = [ProfilerActivity.CPU]
+    sort_by = "self_cpu_time_total"
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+        sort_by = "self_cuda_time_total"
+
+    with profile(activities=activities, record_shapes=True, profile_memory=True) as prof:
+        yield
+
+    _writer.submit(_write_profile, prof, name, tag, sort_by)
+
+
+def _write_profile(prof, name: str, tag: str, sort_by: str):
+    """Guardar la traza Chrome y la tabla de operadores y aplicar el límite de trazas"""
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        stem = f"{time.strftime('%Y%m%d_%H%M%S')}_{int(time.time() * 1000) % 1000:03d}_{name}"
+        if tag:
+            stem = f"{stem}_{tag}"
+
+        prof.export_chrome_trace(str(PROFILE_DIR / f"{stem}.trace.json"))
+        table = prof.key_averages().table(sort_by=sort_by, row_limit=30)
+        (PROFILE_DIR / f"{stem}.summary.txt").write_text(table)
+        print(f"[PROFILE] Traza guardada: {PROFILE_DIR / stem}.trace.json")
+
+        _prune_traces()
+    except Exception as e:
+        print(f"[PROFILE] Error guardando traza: {e}")
+
+
+def _prune_traces():
+    """Borrar las trazas más antiguas si se supera PROFILE_MAX_TRACES"""
+    traces = sorted(PROFILE_DIR.glob("*.trace.json"), key=lambda p: p.stat().st_mtime)
+    for trace in traces[:max(0, len(traces) - PROFILE_MAX_TRACES)]:
+        summary = trace.with_name(trace.name.replace(".trace.json", ".summary.txt"))
+        trace.unlink(missing_ok=True)
+        summary.unlink(missing_ok=True)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Servidor multiproceso con los pesos de los modelos compartidos
+
+`uvicorn --workers N` importa la aplicación en cada proceso, así que cada
+worker carga su propia copia del R-50 de FCOS y de los modelos DAN. Este
+script carga los modelos una sola vez en el proceso padre y luego hace fork
+de los workers, que heredan los pesos:
+
+    --share-mode fork  (por defecto) los workers comparten las páginas de los
+                       tensores copy-on-write. Antes del fork se ejecuta
+                       gc.freeze() para que el recolector no toque los objetos
+                       heredados y no fuerce copias de páginas.
+    --share-mode shm   los tensores se mueven a memoria compartida de torch
+                       (Module.share_memory()); nunca se duplican aunque se
+                       escriban. Requiere /dev/shm suficiente (en Docker,
+                       --shm-size).
+
+Métricas: /metrics agrega las de todos los workers a través de
+PROMETHEUS_MULTIPROC_DIR (por defecto un directorio temporal que se vacía al
+arrancar y se borra al salir).
+
+Cada worker configura torch.set_num_threads / set_num_interop_threads y los
+hilos de OpenCV para que entre todos no sobresuscriban los núcleos.
+
+Ahorro de memoria: los pesos cargados (FCOS R-50 y los tres modelos DAN) dejan
+de contarse una vez por worker. Con --report-memory el padre imprime Rss, Pss
+y memoria compartida de cada worker (/proc/<pid>/smaps_rollup, solo Linux);
+comparar el Pss total contra `uvicorn main:app --workers N` con el mismo N.
+Cifras por worker (Rss antes/después): todavía sin medir; el entorno en el
+que se escribió no tenía torch ni los pesos entrenados. Anotarlas aquí a
+partir de la salida de --report-memory en la máquina de producción.
+
+El cliente de MongoDB no se hereda: database.py lo crea en el primer uso
+dentro de cada worker, ya que pymongo no es seguro tras un fork.
+
+Limitaciones:
+    - Solo CPU: CUDA no se puede inicializar antes de un fork; con GPU se
+      sirve con un único worker.
+    - Una versión cargada en caliente (/admin/models) se carga en cada worker
+      por separado y ya no se comparte.
+
+Órdenes de /admin/models: el worker que recibe la petición la añade a un
+registro compartido (una línea JSON por orden) y avisa al padre con SIGUSR1;
+el padre reenvía la señal a todos los workers y cada uno aplica, en orden, las
+órdenes que aún no ha visto. Un worker repuesto tras morir recorre el registro
+desde el principio y termina con las mismas versiones que el resto.
+
+Uso:
+    python serve.py --workers 4
+    python serve.py --workers 4 --threads-per-worker 2 --share-mode shm --report-memory
+"""
+
+import argparse
+import fcntl
+import gc
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import uvicorn
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def configure_worker_threads(threads: int, interop_threads: int):
+    """Limitar los hilos de torch y OpenCV de este proceso"""
+    import cv2
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        # Solo se puede fijar antes del primer trabajo inter-op del proceso
+        pass
+    cv2.setNumThreads(threads)
+
+
+def share_model_weights(main):
+    """Mover los pesos de los modelos cargados a memoria compartida de torch"""
+    modules = []
+    if main.ocr_service is not None and main.ocr_service.models is not None:
+        modules.extend(main.ocr_service.models)
+    if main.fcos_predictor is not None:
+        modules.append(main.fcos_predictor.model)
+    for module in modules:
+        module.share_memory()
+    return len(modules)
+
+
+def read_memory_mb(pid: int) -> dict:
+    """Rss, Pss y memoria compartida del proceso en MB"""
+    fields = {"Rss": 0, "Pss": 0, "Shared_Clean": 0, "Shared_Dirty": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key = line.split(":")[0]
+                if key in fields:
+                    fields[key] = int(line.split()[1]) / 1024
+    except OSError:
+        return {}
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "shared": fields["Shared_Clean"] + fields["Shared_Dirty"],
+    }
+
+
+def report_memory(worker_pids):
+    """Imprimir el uso de memoria de cada worker y el total"""
+    total_rss = total_pss = 0.0
+    for pid in worker_pids:
+        memory = read_memory_mb(pid)
+        if not memory:
+            print(f"[SERVE] Memoria del worker {pid} no disponible")
+            continue
+        total_rss += memory["rss"]
+        total_pss += memory["pss"]
+        print(f"[SERVE] Worker {pid}: rss={memory['rss']:.0f}MB pss={memory['pss']:.0f}MB "
+              f"compartida={memory['shared']:.0f}MB")
+    print(f"[SERVE] Total: rss={total_rss:.0f}MB pss={total_pss:.0f}MB "
+          f"(Pss reparte las páginas compartidas entre los procesos)")
+
+
+def broadcast_model_command(log_path: str, command: dict):
+    """Añadir una orden de /admin/models al registro compartido y avisar al padre"""
+    with open(log_path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(command) + "\n")
+    os.kill(os.getppid(), signal.SIGUSR1)
+
+
+def start_command_listener(backend, log_path: str):
+    """Aplicar en este worker las órdenes del registro compartido a medida que llegan"""
+    pending = threading.Event()
+    signal.signal(signal.SIGUSR1, lambda signum, frame: pending.set())
+
+    def listen():
+        # Las órdenes se aplican sobre los modelos del arranque, ya registrados
+        backend.startup_complete.wait()
+        offset = 0
+        while True:
+            with open(log_path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+            # Solo líneas completas; el resto se lee en la siguiente vuelta
+            complete = data[:data.rfind(b"\n") + 1]
+            offset += len(complete)
+            for line in complete.splitlines():
+                command = json.loads(line)
+                try:
+                    backend.apply_model_command(command)
+                    print(f"[SERVE] Worker {os.getpid()}: orden aplicada {command}")
+                except Exception as e:
+                    print(f"[SERVE] Worker {os.getpid()}: error aplicando {command}: {e}")
+            pending.wait()
+            pending.clear()
+
+    threading.Thread(target=listen, name="model-commands", daemon=True).start()
+    backend.admin_broadcast = lambda command: broadcast_model_command(log_path, command)
+
+
+def run_worker(app, sock, args):
+    """Cuerpo del proceso hijo: configurar hilos y servir en el socket heredado"""
+    import main as backend
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    configure_worker_threads(args.threads_per_worker, args.interop_threads)
+    start_command_listener(backend, args.command_log)
+
+    config = uvicorn.Config(app, log_level=args.log_level)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def spawn_worker(app, sock, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(app, sock, args)
+        finally:
+            os._exit(0)
+    print(f"[SERVE] Worker iniciado (pid {pid})")
+    return pid
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Servidor multiproceso con pesos compartidos")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_WORKERS", "2")))
+    parser.add_argument("--threads-per-worker", type=int, default=int(os.getenv("TORCH_THREADS_PER_WORKER", "0")),
+                        help="Hilos intra-op de torch por worker (0 = núcleos / workers)")
+    parser.add_argument("--interop-threads", type=int, default=int(os.getenv("TORCH_INTEROP_THREADS", "1")))
+    parser.add_argument("--share-mode", choices=["fork", "shm"], default=os.getenv("MODEL_SHARE_MODE", "fork"))
+    parser.add_argument("--report-memory", action="store_true", help="Imprimir la memoria de los workers al arrancar")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if args.threads_per_worker <= 0:
+        args.threads_per_worker = max(1, cpu_count // args.workers)
+
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+
+    # Métricas multiproceso: debe fijarse antes de importar main (y con él metrics.py)
+    own_metrics_dir = "PROMETHEUS_MULTIPROC_DIR" not in os.environ
+    if own_metrics_dir:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(metrics_dir, exist_ok=True)
+    # Los valores de una ejecución anterior se sumarían a los de esta
+    for entry in os.listdir(metrics_dir):
+        if entry.endswith(".db"):
+            os.remove(os.path.join(metrics_dir, entry))
+    from prometheus_client import multiprocess
+
+    import torch
+
+    # El padre solo carga pesos: un hilo evita crear el pool de OpenMP antes del fork
+    torch.set_num_threads(1)
+
+    import main as backend
+
+    if torch.cuda.is_available() and args.workers > 1:
+        print("[SERVE] CUDA disponible: no se puede hacer fork tras inicializarla, se usa 1 worker")
+        args.workers = 1
+
+    print(f"[SERVE] Cargando modelos en el proceso padre (pid {os.getpid()})...")
+    dan_loaded, fcos_loaded = backend.preload_models()
+    print(f"[SERVE] DAN={'ok' if dan_loaded else 'no disponible'}, FCOS={'ok' if fcos_loaded else 'no disponible'}")
+
+    if args.share_mode == "shm":
+        shared = share_model_weights(backend)
+        print(f"[SERVE] {shared} modelos movidos a memoria compartida")
+
+    # Congelar los objetos heredados para que el GC de los hijos no los copie
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    # Registro compartido de órdenes /admin/models (ver start_command_listener)
+    command_fd, args.command_log = tempfile.mkstemp(prefix="model-commands-", suffix=".jsonl")
+    os.close(command_fd)
+
+    workers = set()
+
+    def forward_command(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGUSR1)
+            except ProcessLookupError:
+                pass
+
+    # Antes del fork: un SIGUSR1 sin manejador terminaría el proceso padre
+    signal.signal(signal.SIGUSR1, forward_command)
+
+    print(f"[SERVE] {args.workers} workers x {args.threads_per_worker} hilos en http://{args.host}:{args.port}")
+    workers.update(spawn_worker(backend.app, sock, args) for _ in range(args.workers))
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    if args.report_memory:
+        # Dar tiempo a que los workers terminen el arranque y el warm-up
+        time.sleep(10)
+        report_memory(workers)
+
+    # Reponer los workers que mueran hasta recibir la señal de parada
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        # Quitar los gauges "live" del worker muerto de /metrics
+        multiprocess.mark_process_dead(pid)
+        if not stopping:
+            print(f"[SERVE] Worker {pid} terminó (estado {status}), iniciando otro")
+            workers.add(spawn_worker(backend.app, sock, args))
+
+    sock.close()
+    os.remove(args.command_log)
+    if own_metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+    print("[SERVE] Servidor detenido")
+
+
+if __name__ == "__main__":
+    main()
@@ -139,6 +139,40 @@ def test_fcos_service():
         print(f"❌ Error al crear servicio FCOS: {e}")
         return False
 
+def test_registry_without_builtin():
+    """Prueba cargar una versión del registro sin los pesos FCOS de arranque"""
+    
+    print("\n🔍 Probando carga desde el registro sin modelo de arranque...")
+    
+    try:
+        import main as api
+        
+        versions = api.fcos_registry.available_versions()
+        if not versions:
+            print(f"⏭️  Sin versiones en {api.fcos_registry.root}, se omite la prueba")
+            return True
+        
+        # Simular que faltan los pesos de arranque
+        api.FCOS_MODEL_PATH = os.path.join(api.fcos_registry.root, "__sin_modelo__.pth")
+        if api.initialize_fcos_service():
+            print("❌ El modelo de arranque se cargó a pesar de no existir")
+            return False
+        
+        api.fcos_registry.load_async(versions[-1]).result()
+        if api.fcos_predictor is None:
+            print("❌ La versión del registro no quedó activa")
+            return False
+        if api.FCOS_MULTIRES_ENABLED and api.fcos_fast_aug is None:
+            print("❌ La pasada rápida no se creó para la versión del registro")
+            return False
+        
+        print(f"✅ Versión '{versions[-1]}' cargada sin modelo de arranque")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Error cargando desde el registro: {e}")
+        return False
+
 def main():
     """Función principal de verificación"""
     
@@ -157,11 +191,14 @@ def main():
     # Probar servicio
     service_ok = test_fcos_service()
     
+    # Probar el registro de modelos sin los pesos de arranque
+    registry_ok = test_registry_without_builtin()
+    
     print("\n" + "=" * 50)
     print("📋 RESUMEN FINAL")
     print("=" * 50)
     
-    if all([files_ok, deps_ok, import_ok, service_ok]):
+    if all([files_ok, deps_ok, import_ok, service_ok, registry_ok]):
         print("🎉 ¡Todo está configurado correctamente!")
         print("✅ Puedes usar FCOS en tu backend")
     else:
@@ -174,6 +211,8 @@ def main():
             print("   - Problemas de importación")
         if not service_ok:
             print("   - Problemas con el servicio")
+        if not registry_ok:
+            print("   - Problemas cargando versiones del registro")
         
         print("\n💡 Soluciones:")
         print("   1. Instala las dependencias: pip install -r requirements.txt")
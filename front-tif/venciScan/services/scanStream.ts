@@ -0,0 +1,99 @@
+import { BACKEND_URL } from '../config/backend';
+
+// Mensajes que envía el backend por /ws/scan
+export type ScanStreamMessage =
+  | { type: 'frame'; frame_id: number }
+  | {
+      type: 'detection';
+      frame_id: number;
+      success: boolean;
+      message?: string;
+      best_due_date: { class_name: string; confidence: number; bbox: number[] } | null;
+      detections: { class_name: string; confidence: number; bbox: number[] }[];
+      timings_ms: Record<string, number>;
+    }
+  | {
+      type: 'reading';
+      frame_id: number;
+      success: boolean;
+      predicted_date: string;
+      confidence: number;
+      timings_ms: Record<string, number>;
+    }
+  | { type: 'cancelled'; frame_id: number }
+  | { type: 'error'; frame_id?: number; message: string };
+
+export interface ScanStreamHandlers {
+  onDetection?: (message: Extract<ScanStreamMessage, { type: 'detection' }>) => void;
+  onReading?: (message: Extract<ScanStreamMessage, { type: 'reading' }>) => void;
+  onError?: (message: string) => void;
+  onClose?: () => void;
+}
+
+// Canal de escaneo en streaming: una conexión por sesión de conteo.
+// Cada frame enviado cancela en el servidor el que siga en curso, así que
+// solo se reciben resultados del frame más reciente.
+export class ScanStream {
+  private socket: WebSocket;
+  private latestFrameId = 0;
+
+  constructor(barcode: string, private handlers: ScanStreamHandlers) {
+    const wsUrl = BACKEND_URL.replace(/^http/, 'ws');
+    this.socket = new WebSocket(`${wsUrl}/ws/scan?barcode=${encodeURIComponent(barcode)}`);
+    this.socket.binaryType = 'arraybuffer';
+    this.socket.onmessage = (event) => this.handleMessage(event.data);
+    this.socket.onerror = () => this.handlers.onError?.('Error en la conexión de escaneo');
+    this.socket.onclose = () => this.handlers.onClose?.();
+  }
+
+  get isOpen(): boolean {
+    return this.socket.readyState === WebSocket.OPEN;
+  }
+
+  // Enviar un frame JPEG en base64 (como lo devuelve takePictureAsync) como mensaje binario
+  sendFrame(base64Image: string): void {
+    if (!this.isOpen) {
+      return;
+    }
+    const binary = atob(base64Image);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+      bytes[i] = binary.charCodeAt(i);
+    }
+    this.socket.send(bytes.buffer);
+  }
+
+  close(): void {
+    this.socket.close();
+  }
+
+  private handleMessage(data: string) {
+    let message: ScanStreamMessage;
+    try {
+      message = JSON.parse(data);
+    } catch {
+      return;
+    }
+
+    if (message.type === 'frame') {
+      this.latestFrameId = message.frame_id;
+      return;
+    }
+    // Ignorar resultados de frames ya reemplazados
+    if ('frame_id' in message && message.frame_id !== undefined && message.frame_id < this.latestFrameId) {
+      return;
+    }
+
+    switch (message.type) {
+      case 'detection':
+        this.handlers.onDetection?.(message);
+        break;
+      case 'reading':
+        this.handlers.onReading?.(message);
+        break;
+      case 'error':
+        this.handlers.onError?.(message.message);
+        break;
+    }
+  }
+}